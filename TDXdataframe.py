@@ -1,28 +1,112 @@
 from __future__ import annotations
 
+import hashlib
 import json
+import os
 import pandas as pd
 import xml.etree.ElementTree as ET
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
-def read_businfo_xml(xml_path: str) -> pd.DataFrame:
-    ns = {'ptx': 'https://ptx.transportdata.tw/standard/schema/'}
+TDX_NS_URI = "https://ptx.transportdata.tw/standard/schema/"
+STREAM_BATCH_SIZE = 50000
 
-    tree = ET.parse(xml_path)
-    root = tree.getroot()
+# ===== 共用：XML 串流讀取 =====
+def _ns_uri_from_tag(tag: str) -> str:
+    """從 root tag（{uri}xxx）解析 namespace，沒有 namespace 就用 TDX 預設"""
+    if tag.startswith("{"):
+        return tag.split("}")[0].strip("{")
+    return TDX_NS_URI
 
-    def t(elem: Optional[ET.Element], path: str) -> Optional[str]:
-        if elem is None:
-            return None
-        return elem.findtext(path, default=None, namespaces=ns)
+def _iterparse_records(xml_path: str, record_name: str, ns_uri: Optional[str] = None) -> Iterator[Tuple[ET.Element, str]]:
+    """
+    以 iterparse 逐筆讀取 root 底下的 <record_name> 節點，yield (節點, namespace uri)。
+    每筆處理完就清掉，記憶體內只會留著當下這一筆，不會建出整棵樹。
 
-    def as_int(x: Optional[str]) -> Optional[int]:
-        if x is None or x == "":
-            return None
-        try:
-            return int(x)
-        except ValueError:
-            return None
+    ns_uri 為 None 時依 root tag 自動判斷 namespace（同 ET.parse 版本的寫法）。
+    """
+    root = None
+    uri = ns_uri
+    record_tag = None
+    depth = 0
+
+    for event, elem in ET.iterparse(xml_path, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            if root is None:
+                root = elem
+                uri = ns_uri or _ns_uri_from_tag(root.tag)
+                record_tag = f"{{{uri}}}{record_name}"
+            continue
+
+        depth -= 1
+        # 只處理 root 的直接子節點，處理完從 root 移除
+        if depth == 1 and elem.tag == record_tag:
+            yield elem, uri
+            root.clear()
+
+def _column_batches(rows: Iterator[Dict[str, Any]], batch_size: int) -> Iterator[Dict[str, List[Any]]]:
+    """把逐列的 dict 轉為欄位導向的批次：{欄位: [值, ...]}，每批最多 batch_size 列"""
+    cols: Dict[str, List[Any]] = {}
+    n = 0
+
+    for row in rows:
+        for k, v in row.items():
+            col = cols.get(k)
+            if col is None:
+                col = cols[k] = [None] * n
+            col.append(v)
+        n += 1
+
+        # 某些列缺欄位時補 None，維持各欄等長
+        if len(row) != len(cols):
+            for col in cols.values():
+                if len(col) < n:
+                    col.append(None)
+
+        if n >= batch_size:
+            yield cols
+            cols = {}
+            n = 0
+
+    if n:
+        yield cols
+
+def _frame_from_batches(batches: Iterator[Dict[str, List[Any]]]) -> pd.DataFrame:
+    """合併欄位批次後一次建立 DataFrame（型別推斷與 list of dict 的版本一致）"""
+    merged: Dict[str, List[Any]] = {}
+    n = 0
+
+    for batch in batches:
+        size = len(next(iter(batch.values()))) if batch else 0
+        for k, values in batch.items():
+            col = merged.get(k)
+            if col is None:
+                col = merged[k] = [None] * n
+            col.extend(values)
+        n += size
+        for col in merged.values():
+            if len(col) < n:
+                col.extend([None] * (n - len(col)))
+
+    return pd.DataFrame(merged)
+
+# ===== BusRoute（公車路線營運資料）=====
+def _findtext(elem: Optional[ET.Element], path: str, ns: Dict[str, str]) -> Optional[str]:
+    if elem is None:
+        return None
+    return elem.findtext(path, default=None, namespaces=ns)
+
+def _as_int(x: Optional[str]) -> Optional[int]:
+    if x is None or x == "":
+        return None
+    try:
+        return int(x)
+    except ValueError:
+        return None
+
+def _businfo_rows(route: ET.Element, ns: Dict[str, str]) -> Iterator[Dict[str, Any]]:
+    """一個 <BusRoute> 展開為多列（每個 SubRoute 一列）"""
+    t = lambda elem, path: _findtext(elem, path, ns)
 
     def parse_operators(route_elem: ET.Element) -> List[Dict[str, Any]]:
         ops = []
@@ -43,117 +127,101 @@ def read_businfo_xml(xml_path: str) -> pd.DataFrame:
                 ids.append(opid.text.strip())
         return ids
 
-    rows: List[Dict[str, Any]] = []
-
-    for route in root.findall('ptx:BusRoute', ns):
-        ops = parse_operators(route)
-        ops_json = json.dumps(ops, ensure_ascii=False)
-        op0 = ops[0] if ops else {}
-
-        # Route-level (swagger order)
-        base = {
-            "RouteUID": t(route, 'ptx:RouteUID'),
-            "RouteID": t(route, 'ptx:RouteID'),
-            "HasSubRoutes": t(route, 'ptx:HasSubRoutes'),
-            # Operators (保留完整 + 常用第一筆)
-            "Operators_json": ops_json,
-            "OperatorID_first": op0.get("OperatorID"),
-            "OperatorNameZh_first": op0.get("OperatorNameZh"),
-            "OperatorNameEn_first": op0.get("OperatorNameEn"),
-            "OperatorCode_first": op0.get("OperatorCode"),
-            "OperatorNo_first": op0.get("OperatorNo"),
-            # Authority/Provider
-            "AuthorityID": t(route, 'ptx:AuthorityID'),
-            "ProviderID": t(route, 'ptx:ProviderID'),
+    ops = parse_operators(route)
+    ops_json = json.dumps(ops, ensure_ascii=False)
+    op0 = ops[0] if ops else {}
+
+    # Route-level (swagger order)
+    base = {
+        "RouteUID": t(route, 'ptx:RouteUID'),
+        "RouteID": t(route, 'ptx:RouteID'),
+        "HasSubRoutes": t(route, 'ptx:HasSubRoutes'),
+        # Operators (保留完整 + 常用第一筆)
+        "Operators_json": ops_json,
+        "OperatorID_first": op0.get("OperatorID"),
+        "OperatorNameZh_first": op0.get("OperatorNameZh"),
+        "OperatorNameEn_first": op0.get("OperatorNameEn"),
+        "OperatorCode_first": op0.get("OperatorCode"),
+        "OperatorNo_first": op0.get("OperatorNo"),
+        # Authority/Provider
+        "AuthorityID": t(route, 'ptx:AuthorityID'),
+        "ProviderID": t(route, 'ptx:ProviderID'),
+    }
+
+    # Route remaining fields (swagger order)
+    tail = {
+        "BusRouteType": _as_int(t(route, 'ptx:BusRouteType')),
+        "RouteNameZh": t(route, 'ptx:RouteName/ptx:Zh_tw'),
+        "RouteNameEn": t(route, 'ptx:RouteName/ptx:En'),
+        "DepartureStopNameZh": t(route, 'ptx:DepartureStopNameZh'),
+        "DepartureStopNameEn": t(route, 'ptx:DepartureStopNameEn'),
+        "DestinationStopNameZh": t(route, 'ptx:DestinationStopNameZh'),
+        "DestinationStopNameEn": t(route, 'ptx:DestinationStopNameEn'),
+        "TicketPriceDescriptionZh": t(route, 'ptx:TicketPriceDescriptionZh'),
+        "TicketPriceDescriptionEn": t(route, 'ptx:TicketPriceDescriptionEn'),
+        "FareBufferZoneDescriptionZh": t(route, 'ptx:FareBufferZoneDescriptionZh'),
+        "FareBufferZoneDescriptionEn": t(route, 'ptx:FareBufferZoneDescriptionEn'),
+        "RouteMapImageUrl": t(route, 'ptx:RouteMapImageUrl'),
+        "City": t(route, 'ptx:City'),
+        "CityCode": t(route, 'ptx:CityCode'),
+        "UpdateTime": t(route, 'ptx:UpdateTime'),
+        "VersionID": _as_int(t(route, 'ptx:VersionID')),
+    }
+
+    subroutes = route.findall('ptx:SubRoutes/ptx:SubRoute', ns)
+
+    # 若真的沒有 SubRoute，就輸出一列（其餘 SubRoute 欄位補 None）
+    if not subroutes:
+        yield {
+            **base,
+            "SubRouteUID": None,
+            "SubRouteID": None,
+            "OperatorIDs": [],
+            "SubRouteNameZh": None,
+            "SubRouteNameEn": None,
+            "Headsign": None,
+            "HeadsignEn": None,
+            "Direction": None,
+            "FirstBusTime": None,
+            "LastBusTime": None,
+            "HolidayFirstBusTime": None,
+            "HolidayLastBusTime": None,
+            "SubDepartureStopNameZh": None,
+            "SubDepartureStopNameEn": None,
+            "SubDestinationStopNameZh": None,
+            "SubDestinationStopNameEn": None,
+            **tail,
+        }
+        return
+
+    for sub in subroutes:
+        operator_ids = parse_subroute_operator_ids(sub)
+
+        yield {
+            **base,
+
+            # SubRoutes (swagger order)
+            "SubRouteUID": t(sub, 'ptx:SubRouteUID'),
+            "SubRouteID": t(sub, 'ptx:SubRouteID'),
+            "OperatorIDs": operator_ids,
+            "SubRouteNameZh": t(sub, 'ptx:SubRouteName/ptx:Zh_tw'),
+            "SubRouteNameEn": t(sub, 'ptx:SubRouteName/ptx:En'),
+            "Headsign": t(sub, 'ptx:Headsign'),
+            "HeadsignEn": t(sub, 'ptx:HeadsignEn'),
+            "Direction": _as_int(t(sub, 'ptx:Direction')),
+            "FirstBusTime": t(sub, 'ptx:FirstBusTime'),
+            "LastBusTime": t(sub, 'ptx:LastBusTime'),
+            "HolidayFirstBusTime": t(sub, 'ptx:HolidayFirstBusTime'),
+            "HolidayLastBusTime": t(sub, 'ptx:HolidayLastBusTime'),
+            "SubDepartureStopNameZh": t(sub, 'ptx:DepartureStopNameZh'),
+            "SubDepartureStopNameEn": t(sub, 'ptx:DepartureStopNameEn'),
+            "SubDestinationStopNameZh": t(sub, 'ptx:DestinationStopNameZh'),
+            "SubDestinationStopNameEn": t(sub, 'ptx:DestinationStopNameEn'),
+
+            **tail,
         }
 
-        subroutes = route.findall('ptx:SubRoutes/ptx:SubRoute', ns)
-
-        # 若真的沒有 SubRoute，就輸出一列（其餘 SubRoute 欄位補 None）
-        if not subroutes:
-            rows.append({
-                **base,
-                "SubRouteUID": None,
-                "SubRouteID": None,
-                "OperatorIDs": [],
-                "SubRouteNameZh": None,
-                "SubRouteNameEn": None,
-                "Headsign": None,
-                "HeadsignEn": None,
-                "Direction": None,
-                "FirstBusTime": None,
-                "LastBusTime": None,
-                "HolidayFirstBusTime": None,
-                "HolidayLastBusTime": None,
-                "SubDepartureStopNameZh": None,
-                "SubDepartureStopNameEn": None,
-                "SubDestinationStopNameZh": None,
-                "SubDestinationStopNameEn": None,
-
-                "BusRouteType": as_int(t(route, 'ptx:BusRouteType')),
-                "RouteNameZh": t(route, 'ptx:RouteName/ptx:Zh_tw'),
-                "RouteNameEn": t(route, 'ptx:RouteName/ptx:En'),
-                "DepartureStopNameZh": t(route, 'ptx:DepartureStopNameZh'),
-                "DepartureStopNameEn": t(route, 'ptx:DepartureStopNameEn'),
-                "DestinationStopNameZh": t(route, 'ptx:DestinationStopNameZh'),
-                "DestinationStopNameEn": t(route, 'ptx:DestinationStopNameEn'),
-                "TicketPriceDescriptionZh": t(route, 'ptx:TicketPriceDescriptionZh'),
-                "TicketPriceDescriptionEn": t(route, 'ptx:TicketPriceDescriptionEn'),
-                "FareBufferZoneDescriptionZh": t(route, 'ptx:FareBufferZoneDescriptionZh'),
-                "FareBufferZoneDescriptionEn": t(route, 'ptx:FareBufferZoneDescriptionEn'),
-                "RouteMapImageUrl": t(route, 'ptx:RouteMapImageUrl'),
-                "City": t(route, 'ptx:City'),
-                "CityCode": t(route, 'ptx:CityCode'),
-                "UpdateTime": t(route, 'ptx:UpdateTime'),
-                "VersionID": as_int(t(route, 'ptx:VersionID')),
-            })
-            continue
-
-        for sub in subroutes:
-            operator_ids = parse_subroute_operator_ids(sub)
-
-            rows.append({
-                **base,
-
-                # SubRoutes (swagger order)
-                "SubRouteUID": t(sub, 'ptx:SubRouteUID'),
-                "SubRouteID": t(sub, 'ptx:SubRouteID'),
-                "OperatorIDs": operator_ids,
-                "SubRouteNameZh": t(sub, 'ptx:SubRouteName/ptx:Zh_tw'),
-                "SubRouteNameEn": t(sub, 'ptx:SubRouteName/ptx:En'),
-                "Headsign": t(sub, 'ptx:Headsign'),
-                "HeadsignEn": t(sub, 'ptx:HeadsignEn'),
-                "Direction": as_int(t(sub, 'ptx:Direction')),
-                "FirstBusTime": t(sub, 'ptx:FirstBusTime'),
-                "LastBusTime": t(sub, 'ptx:LastBusTime'),
-                "HolidayFirstBusTime": t(sub, 'ptx:HolidayFirstBusTime'),
-                "HolidayLastBusTime": t(sub, 'ptx:HolidayLastBusTime'),
-                "SubDepartureStopNameZh": t(sub, 'ptx:DepartureStopNameZh'),
-                "SubDepartureStopNameEn": t(sub, 'ptx:DepartureStopNameEn'),
-                "SubDestinationStopNameZh": t(sub, 'ptx:DestinationStopNameZh'),
-                "SubDestinationStopNameEn": t(sub, 'ptx:DestinationStopNameEn'),
-
-                # Route remaining fields (swagger order)
-                "BusRouteType": as_int(t(route, 'ptx:BusRouteType')),
-                "RouteNameZh": t(route, 'ptx:RouteName/ptx:Zh_tw'),
-                "RouteNameEn": t(route, 'ptx:RouteName/ptx:En'),
-                "DepartureStopNameZh": t(route, 'ptx:DepartureStopNameZh'),
-                "DepartureStopNameEn": t(route, 'ptx:DepartureStopNameEn'),
-                "DestinationStopNameZh": t(route, 'ptx:DestinationStopNameZh'),
-                "DestinationStopNameEn": t(route, 'ptx:DestinationStopNameEn'),
-                "TicketPriceDescriptionZh": t(route, 'ptx:TicketPriceDescriptionZh'),
-                "TicketPriceDescriptionEn": t(route, 'ptx:TicketPriceDescriptionEn'),
-                "FareBufferZoneDescriptionZh": t(route, 'ptx:FareBufferZoneDescriptionZh'),
-                "FareBufferZoneDescriptionEn": t(route, 'ptx:FareBufferZoneDescriptionEn'),
-                "RouteMapImageUrl": t(route, 'ptx:RouteMapImageUrl'),
-                "City": t(route, 'ptx:City'),
-                "CityCode": t(route, 'ptx:CityCode'),
-                "UpdateTime": t(route, 'ptx:UpdateTime'),
-                "VersionID": as_int(t(route, 'ptx:VersionID')),
-            })
-
-    df = pd.DataFrame(rows)
-
+def _finalize_businfo(df: pd.DataFrame) -> pd.DataFrame:
     # 依 swagger 順序強制排欄位（你要的重點）
     desired_cols = [
         # BusRoute
@@ -195,73 +263,84 @@ def read_businfo_xml(xml_path: str) -> pd.DataFrame:
 
     return df
 
-def read_bus_stop_of_route_xml(xml_path: str) -> pd.DataFrame:
-    """
-    讀取 TDX 公車站序 XML（BusStopOfRoute），回傳整理好的 pandas DataFrame。
-    
-    每一列 = 一個站牌（Stop），同時附上路線 / 營運業者資訊。
-    """
-    tree = ET.parse(xml_path)
-    root = tree.getroot()
-
-    # 自動從 root 解析出 namespace（避免寫死）
-    if root.tag.startswith("{"):
-        uri = root.tag.split("}")[0].strip("{")
-    else:
-        uri = "https://ptx.transportdata.tw/standard/schema/"
-    ns = {"ns": uri}
-
-    def gettext(elem, path):
-        """安全取 text，找不到就回 None"""
-        if elem is None:
-            return None
-        child = elem.find(path, ns)
-        return child.text if child is not None else None
+def iter_businfo_xml(xml_path: str, batch_size: int = STREAM_BATCH_SIZE) -> Iterator[Dict[str, List[Any]]]:
+    """串流讀取 BusRoute XML，yield 欄位導向的批次（尚未排欄位/轉型）"""
+    def rows():
+        for route, uri in _iterparse_records(xml_path, "BusRoute", ns_uri=TDX_NS_URI):
+            yield from _businfo_rows(route, {'ptx': uri})
 
-    rows = []
+    return _column_batches(rows(), batch_size)
 
-    # 每一個 <BusStopOfRoute> 代表一條路線 + 方向
-    for bsr in root.findall("ns:BusStopOfRoute", ns):
+def read_businfo_xml(xml_path: str, stream: bool = False, batch_size: int = STREAM_BATCH_SIZE) -> pd.DataFrame:
+    """
+    讀取 TDX 公車路線營運資料 XML（BusRoute），回傳整理好的 pandas DataFrame。
 
-        # 路線共同欄位
-        base = {
-            "RouteUID":          gettext(bsr, "ns:RouteUID"),
-            "RouteID":           gettext(bsr, "ns:RouteID"),
-            "RouteName_Zh":      gettext(bsr, "ns:RouteName/ns:Zh_tw"),
-            "RouteName_En":      gettext(bsr, "ns:RouteName/ns:En"),
-            "SubRouteUID":       gettext(bsr, "ns:SubRouteUID"),
-            "SubRouteID":        gettext(bsr, "ns:SubRouteID"),
-            "SubRouteName_Zh":   gettext(bsr, "ns:SubRouteName/ns:Zh_tw"),
-            "SubRouteName_En":   gettext(bsr, "ns:SubRouteName/ns:En"),
-            "Direction":         gettext(bsr, "ns:Direction"),
-            "City":              gettext(bsr, "ns:City"),
-            "CityCode":          gettext(bsr, "ns:CityCode"),
-            "OperatorID":        gettext(bsr, "ns:Operators/ns:Operator/ns:OperatorID"),
-            "OperatorName_Zh":   gettext(bsr, "ns:Operators/ns:Operator/ns:OperatorName/ns:Zh_tw"),
-            "OperatorNo":        gettext(bsr, "ns:Operators/ns:Operator/ns:OperatorNo"),
-        }
+    stream=True 時改用 iterparse 串流讀取（不建整棵樹），輸出欄位與型別相同。
+    """
+    if stream:
+        return _finalize_businfo(_frame_from_batches(iter_businfo_xml(xml_path, batch_size)))
 
-        # 底下所有 <Stop>
-        for stop in bsr.findall("ns:Stops/ns:Stop", ns):
-            row = base.copy()
-            row.update({
-                "StopUID":          gettext(stop, "ns:StopUID"),
-                "StopID":           gettext(stop, "ns:StopID"),
-                "StopName_Zh":      gettext(stop, "ns:StopName/ns:Zh_tw"),
-                "StopName_En":      gettext(stop, "ns:StopName/ns:En"),
-                "StopBoarding":     gettext(stop, "ns:StopBoarding"),
-                "StopSequence":     gettext(stop, "ns:StopSequence"),
-                "PositionLon":      gettext(stop, "ns:StopPosition/ns:PositionLon"),
-                "PositionLat":      gettext(stop, "ns:StopPosition/ns:PositionLat"),
-                "GeoHash":          gettext(stop, "ns:StopPosition/ns:GeoHash"),
-                "StationID":        gettext(stop, "ns:StationID"),
-                "StationGroupID":   gettext(stop, "ns:StationGroupID"),
-                "LocationCityCode": gettext(stop, "ns:LocationCityCode"),
-            })
-            rows.append(row)
+    ns = {'ptx': TDX_NS_URI}
 
-    df = pd.DataFrame(rows)
+    tree = ET.parse(xml_path)
+    root = tree.getroot()
 
+    rows: List[Dict[str, Any]] = []
+    for route in root.findall('ptx:BusRoute', ns):
+        rows.extend(_businfo_rows(route, ns))
+
+    return _finalize_businfo(pd.DataFrame(rows))
+
+# ===== BusStopOfRoute（公車站序）=====
+def _gettext(elem: Optional[ET.Element], path: str, ns: Dict[str, str]) -> Optional[str]:
+    """安全取 text，找不到就回 None"""
+    if elem is None:
+        return None
+    child = elem.find(path, ns)
+    return child.text if child is not None else None
+
+def _bus_stop_of_route_rows(bsr: ET.Element, ns: Dict[str, str]) -> Iterator[Dict[str, Any]]:
+    """一個 <BusStopOfRoute>（路線 + 方向）展開為每個站牌一列"""
+    gettext = lambda elem, path: _gettext(elem, path, ns)
+
+    # 路線共同欄位
+    base = {
+        "RouteUID":          gettext(bsr, "ns:RouteUID"),
+        "RouteID":           gettext(bsr, "ns:RouteID"),
+        "RouteName_Zh":      gettext(bsr, "ns:RouteName/ns:Zh_tw"),
+        "RouteName_En":      gettext(bsr, "ns:RouteName/ns:En"),
+        "SubRouteUID":       gettext(bsr, "ns:SubRouteUID"),
+        "SubRouteID":        gettext(bsr, "ns:SubRouteID"),
+        "SubRouteName_Zh":   gettext(bsr, "ns:SubRouteName/ns:Zh_tw"),
+        "SubRouteName_En":   gettext(bsr, "ns:SubRouteName/ns:En"),
+        "Direction":         gettext(bsr, "ns:Direction"),
+        "City":              gettext(bsr, "ns:City"),
+        "CityCode":          gettext(bsr, "ns:CityCode"),
+        "OperatorID":        gettext(bsr, "ns:Operators/ns:Operator/ns:OperatorID"),
+        "OperatorName_Zh":   gettext(bsr, "ns:Operators/ns:Operator/ns:OperatorName/ns:Zh_tw"),
+        "OperatorNo":        gettext(bsr, "ns:Operators/ns:Operator/ns:OperatorNo"),
+    }
+
+    # 底下所有 <Stop>
+    for stop in bsr.findall("ns:Stops/ns:Stop", ns):
+        row = base.copy()
+        row.update({
+            "StopUID":          gettext(stop, "ns:StopUID"),
+            "StopID":           gettext(stop, "ns:StopID"),
+            "StopName_Zh":      gettext(stop, "ns:StopName/ns:Zh_tw"),
+            "StopName_En":      gettext(stop, "ns:StopName/ns:En"),
+            "StopBoarding":     gettext(stop, "ns:StopBoarding"),
+            "StopSequence":     gettext(stop, "ns:StopSequence"),
+            "PositionLon":      gettext(stop, "ns:StopPosition/ns:PositionLon"),
+            "PositionLat":      gettext(stop, "ns:StopPosition/ns:PositionLat"),
+            "GeoHash":          gettext(stop, "ns:StopPosition/ns:GeoHash"),
+            "StationID":        gettext(stop, "ns:StationID"),
+            "StationGroupID":   gettext(stop, "ns:StationGroupID"),
+            "LocationCityCode": gettext(stop, "ns:LocationCityCode"),
+        })
+        yield row
+
+def _finalize_bus_stop_of_route(df: pd.DataFrame) -> pd.DataFrame:
     # 可選：把數值欄位轉型（如果你需要的話）
     for col in ["StopSequence"]:
         if col in df.columns:
@@ -272,120 +351,379 @@ def read_bus_stop_of_route_xml(xml_path: str) -> pd.DataFrame:
 
     return df
 
-def read_bus_shape_of_route_xml(xml_path: str) -> pd.DataFrame:
+def iter_bus_stop_of_route_xml(xml_path: str, batch_size: int = STREAM_BATCH_SIZE) -> Iterator[Dict[str, List[Any]]]:
+    """串流讀取 BusStopOfRoute XML，yield 欄位導向的批次（尚未轉型）"""
+    def rows():
+        for bsr, uri in _iterparse_records(xml_path, "BusStopOfRoute"):
+            yield from _bus_stop_of_route_rows(bsr, {"ns": uri})
+
+    return _column_batches(rows(), batch_size)
+
+def read_bus_stop_of_route_xml(xml_path: str, stream: bool = False, batch_size: int = STREAM_BATCH_SIZE) -> pd.DataFrame:
+    """
+    讀取 TDX 公車站序 XML（BusStopOfRoute），回傳整理好的 pandas DataFrame。
+
+    每一列 = 一個站牌（Stop），同時附上路線 / 營運業者資訊。
+    stream=True 時改用 iterparse 串流讀取（不建整棵樹），輸出欄位與型別相同。
+    """
+    if stream:
+        return _finalize_bus_stop_of_route(_frame_from_batches(iter_bus_stop_of_route_xml(xml_path, batch_size)))
+
+    tree = ET.parse(xml_path)
+    root = tree.getroot()
+
+    # 自動從 root 解析出 namespace（避免寫死）
+    ns = {"ns": _ns_uri_from_tag(root.tag)}
+
+    rows = []
+
+    # 每一個 <BusStopOfRoute> 代表一條路線 + 方向
+    for bsr in root.findall("ns:BusStopOfRoute", ns):
+        rows.extend(_bus_stop_of_route_rows(bsr, ns))
+
+    return _finalize_bus_stop_of_route(pd.DataFrame(rows))
+
+# ===== BusShape（公車路線線形）=====
+def _bus_shape_row(bus: ET.Element, ns: Dict[str, str]) -> Dict[str, Any]:
+    """每一個 <BusShape> 就是一筆資料"""
+    return {
+        "Geometry": bus.findtext('ns:Geometry', namespaces=ns),
+        "EncodedPolyline": bus.findtext('ns:EncodedPolyline', namespaces=ns),
+        "RouteUID": bus.findtext('ns:RouteUID', namespaces=ns),
+        "RouteID": bus.findtext('ns:RouteID', namespaces=ns),
+        "RouteName_Zh": bus.find('ns:RouteName/ns:Zh_tw', ns).text if bus.find('ns:RouteName/ns:Zh_tw', ns) is not None else None,
+        "RouteName_En": bus.find('ns:RouteName/ns:En', ns).text if bus.find('ns:RouteName/ns:En', ns) is not None else None,
+        "SubRouteUID": bus.findtext('ns:SubRouteUID', namespaces=ns),
+        "SubRouteID": bus.findtext('ns:SubRouteID', namespaces=ns),
+        "SubRouteName_Zh": bus.find('ns:SubRouteName/ns:Zh_tw', ns).text if bus.find('ns:SubRouteName/ns:Zh_tw', ns) is not None else None,
+        "SubRouteName_En": bus.find('ns:SubRouteName/ns:En', ns).text if bus.find('ns:SubRouteName/ns:En', ns) is not None else None,
+        "Direction": bus.findtext('ns:Direction', namespaces=ns),
+        "UpdateTime": bus.findtext('ns:UpdateTime', namespaces=ns),
+        "VersionID": bus.findtext('ns:VersionID', namespaces=ns),
+    }
+
+def iter_bus_shape_of_route_xml(xml_path: str, batch_size: int = STREAM_BATCH_SIZE) -> Iterator[Dict[str, List[Any]]]:
+    """串流讀取 BusShape XML，yield 欄位導向的批次"""
+    def rows():
+        for bus, uri in _iterparse_records(xml_path, "BusShape", ns_uri=TDX_NS_URI):
+            yield _bus_shape_row(bus, {'ns': uri})
+
+    return _column_batches(rows(), batch_size)
+
+def read_bus_shape_of_route_xml(xml_path: str, stream: bool = False, batch_size: int = STREAM_BATCH_SIZE) -> pd.DataFrame:
     """
     讀取 TDX 公車路線 XML（BusShape），回傳整理好的 pandas DataFrame。
+    stream=True 時改用 iterparse 串流讀取（不建整棵樹），輸出欄位與型別相同。
     """
+    if stream:
+        return _frame_from_batches(iter_bus_shape_of_route_xml(xml_path, batch_size))
 
     # 解析 XML
     tree = ET.parse(xml_path)
     root = tree.getroot()
 
     # 宣告 XML namespace（必須！）
-    ns = {'ns': "https://ptx.transportdata.tw/standard/schema/"}
-
-    records = []
-
-    # 每一個 <BusShape> 就是一筆資料
-    for bus in root.findall('ns:BusShape', ns):
-        record = {
-            "Geometry": bus.findtext('ns:Geometry', namespaces=ns),
-            "EncodedPolyline": bus.findtext('ns:EncodedPolyline', namespaces=ns),
-            "RouteUID": bus.findtext('ns:RouteUID', namespaces=ns),
-            "RouteID": bus.findtext('ns:RouteID', namespaces=ns),
-            "RouteName_Zh": bus.find('ns:RouteName/ns:Zh_tw', ns).text if bus.find('ns:RouteName/ns:Zh_tw', ns) is not None else None,
-            "RouteName_En": bus.find('ns:RouteName/ns:En', ns).text if bus.find('ns:RouteName/ns:En', ns) is not None else None,
-            "SubRouteUID": bus.findtext('ns:SubRouteUID', namespaces=ns),
-            "SubRouteID": bus.findtext('ns:SubRouteID', namespaces=ns),
-            "SubRouteName_Zh": bus.find('ns:SubRouteName/ns:Zh_tw', ns).text if bus.find('ns:SubRouteName/ns:Zh_tw', ns) is not None else None,
-            "SubRouteName_En": bus.find('ns:SubRouteName/ns:En', ns).text if bus.find('ns:SubRouteName/ns:En', ns) is not None else None,
-            "Direction": bus.findtext('ns:Direction', namespaces=ns),
-            "UpdateTime": bus.findtext('ns:UpdateTime', namespaces=ns),
-            "VersionID": bus.findtext('ns:VersionID', namespaces=ns),
-        }
-        records.append(record)
+    ns = {'ns': TDX_NS_URI}
+
+    records = [_bus_shape_row(bus, ns) for bus in root.findall('ns:BusShape', ns)]
 
     # 轉成 DataFrame
     df = pd.DataFrame(records)
 
     return df
 
-def read_displayofroute_xml(xml_path: str) -> pd.DataFrame:
+# ===== BusDisplayStopOfRoute（顯示用路線站序）=====
+def _displayofroute_rows(bdsr: ET.Element, ns: Dict[str, str]) -> Iterator[Dict[str, Any]]:
+    """一個 <BusDisplayStopOfRoute> 展開為每個站牌一列"""
+    gettext = lambda elem, path: _gettext(elem, path, ns)
+
+    base = {
+        "RouteUID":     gettext(bdsr, "ns:RouteUID"),
+        "RouteID":      gettext(bdsr, "ns:RouteID"),
+        "RouteName_Zh": gettext(bdsr, "ns:RouteName/ns:Zh_tw"),
+        "RouteName_En": gettext(bdsr, "ns:RouteName/ns:En"),
+        "Direction":    gettext(bdsr, "ns:Direction"),
+        "UpdateTime":   gettext(bdsr, "ns:UpdateTime"),
+        "VersionID":    gettext(bdsr, "ns:VersionID"),
+    }
+
+    for stop in bdsr.findall("ns:Stops/ns:Stop", ns):
+        row = base.copy()
+        row.update({
+            # Stop 基本
+            "StopUID":      gettext(stop, "ns:StopUID"),
+            "StopID":       gettext(stop, "ns:StopID"),
+            "StopName_Zh":  gettext(stop, "ns:StopName/ns:Zh_tw"),
+            "StopName_En":  gettext(stop, "ns:StopName/ns:En"),
+
+            # 上下車/站序
+            "StopBoarding": gettext(stop, "ns:StopBoarding"),
+            "StopSequence": gettext(stop, "ns:StopSequence"),
+
+            # 位置
+            "PositionLon":  gettext(stop, "ns:StopPosition/ns:PositionLon"),
+            "PositionLat":  gettext(stop, "ns:StopPosition/ns:PositionLat"),
+            "GeoHash":      gettext(stop, "ns:StopPosition/ns:GeoHash"),
+
+            # 站位資訊
+            "StationID":        gettext(stop, "ns:StationID"),
+            "StationGroupID":   gettext(stop, "ns:StationGroupID"),
+            "LocationCityCode": gettext(stop, "ns:LocationCityCode"),
+        })
+        yield row
+
+def _finalize_displayofroute(df: pd.DataFrame) -> pd.DataFrame:
+    # 轉型（遇到空值就 NaN）
+    int_cols = ["Direction", "StopBoarding", "StopSequence", "VersionID"]
+    for c in int_cols:
+        if c in df.columns:
+            df[c] = pd.to_numeric(df[c], errors="coerce").astype("Int64")
+
+    for c in ["PositionLon", "PositionLat"]:
+        if c in df.columns:
+            df[c] = pd.to_numeric(df[c], errors="coerce")
+
+    # 常用排序：路線 + 方向 + 站序
+    sort_cols = [c for c in ["RouteUID", "Direction", "StopSequence"] if c in df.columns]
+    if sort_cols and len(df) > 0:
+        df = df.sort_values(sort_cols, kind="mergesort").reset_index(drop=True)
+
+    return df
+
+def iter_displayofroute_xml(xml_path: str, batch_size: int = STREAM_BATCH_SIZE) -> Iterator[Dict[str, List[Any]]]:
+    """串流讀取 BusDisplayStopOfRoute XML，yield 欄位導向的批次（尚未轉型、排序）"""
+    def rows():
+        for bdsr, uri in _iterparse_records(xml_path, "BusDisplayStopOfRoute"):
+            yield from _displayofroute_rows(bdsr, {"ns": uri})
+
+    return _column_batches(rows(), batch_size)
+
+def read_displayofroute_xml(xml_path: str, stream: bool = False, batch_size: int = STREAM_BATCH_SIZE) -> pd.DataFrame:
     """
     讀取 TDX 顯示用路線站序資料（BusDisplayStopOfRoute XML）並轉成 DataFrame
     欄位對齊 schema：RouteUID, RouteID, RouteName(Zh/En), Direction, Stops(Stop...), UpdateTime, VersionID
+    stream=True 時改用 iterparse 串流讀取（不建整棵樹），輸出欄位與型別相同。
     """
+    if stream:
+        return _finalize_displayofroute(_frame_from_batches(iter_displayofroute_xml(xml_path, batch_size)))
 
     tree = ET.parse(xml_path)
     root = tree.getroot()
 
     # 解析 namespace（TDX XML 常見 root tag 會是 {uri}xxx）
-    if root.tag.startswith("{"):
-        uri = root.tag.split("}")[0].strip("{")
-    else:
-        uri = "https://ptx.transportdata.tw/standard/schema/"
-    ns = {"ns": uri}
-
-    def gettext(elem, path):
-        """安全取值：找不到節點或內容就回 None"""
-        if elem is None:
-            return None
-        node = elem.find(path, ns)
-        return node.text if node is not None else None
+    ns = {"ns": _ns_uri_from_tag(root.tag)}
 
     rows = []
 
     for bdsr in root.findall("ns:BusDisplayStopOfRoute", ns):
-        base = {
-            "RouteUID":     gettext(bdsr, "ns:RouteUID"),
-            "RouteID":      gettext(bdsr, "ns:RouteID"),
-            "RouteName_Zh": gettext(bdsr, "ns:RouteName/ns:Zh_tw"),
-            "RouteName_En": gettext(bdsr, "ns:RouteName/ns:En"),
-            "Direction":    gettext(bdsr, "ns:Direction"),
-            "UpdateTime":   gettext(bdsr, "ns:UpdateTime"),
-            "VersionID":    gettext(bdsr, "ns:VersionID"),
-        }
+        rows.extend(_displayofroute_rows(bdsr, ns))
+
+    return _finalize_displayofroute(pd.DataFrame(rows))
+
+# ===== 靜態資料快取（Parquet）=====
+TDX_READERS = {
+    "BusRoute": read_businfo_xml,
+    "BusStopOfRoute": read_bus_stop_of_route_xml,
+    "BusShape": read_bus_shape_of_route_xml,
+    "DisplayStopOfRoute": read_displayofroute_xml,
+}
+CACHE_SCHEMA_VERSION = 1
+
+def _xml_kind(xml_path: str) -> Optional[str]:
+    """由 root tag（ArrayOfBusRoute...）判斷 TDX XML 的資料種類"""
+    for _, elem in ET.iterparse(xml_path, events=("start",)):
+        name = elem.tag.split("}")[-1]
+        for kind in TDX_READERS:
+            if name in (f"ArrayOf{kind}", f"ArrayOfBus{kind}"):
+                return kind
+        return None
+    return None
+
+def file_sha256(path: str, blocksize: int = 1 << 20) -> str:
+    """計算檔案的 sha256（分段讀取，不會整個檔案載入記憶體）"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _version_signature(df: pd.DataFrame) -> Dict[str, Optional[str]]:
+    """
+    取 TDX 的 VersionID / UpdateTime 最大值，作為資料版本。
+    VersionID 以數值比較（文字比較時 "987" 會大於 "1234"），整數不帶小數點；UpdateTime 以時間比較，回傳原始文字。
+    """
+    signature = {}
+    for c in ["VersionID", "UpdateTime"]:
+        if c in df.columns and df[c].notna().any():
+            values = df[c].dropna()
+            if c == "VersionID":
+                parsed = pd.to_numeric(values, errors="coerce")
+            else:
+                parsed = pd.to_datetime(values.astype(str), errors="coerce", utc=True, format="ISO8601")
+            if parsed.notna().any() and c == "VersionID":
+                latest = parsed.max()
+                signature[c] = str(int(latest)) if float(latest).is_integer() else str(latest)
+            elif parsed.notna().any():
+                signature[c] = str(values.loc[parsed.idxmax()])
+            else:
+                signature[c] = str(values.astype(str).max())
+        else:
+            signature[c] = None
+    return signature
+
+def _reader_signature(kind: str, reader_kwargs: Dict[str, Any]) -> str:
+    """kind + reader 參數的雜湊（參數依名稱排序後序列化），不同參數的解析結果分開快取"""
+    text = json.dumps({"kind": kind, "reader_kwargs": reader_kwargs}, sort_keys=True, ensure_ascii=False, default=repr)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def _cache_paths(source_path: str, cache_folder: str, reader_signature: Optional[str] = None) -> Tuple[str, str]:
+    source_path = os.path.abspath(source_path)
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    tag = hashlib.sha1(source_path.encode("utf-8")).hexdigest()[:8]  # 避免不同資料夾同檔名互相覆蓋
+    base = os.path.join(cache_folder, f"{stem}_{tag}")
+    if reader_signature is not None:
+        base += f"_{reader_signature[:8]}"  # 有 reader 參數時另存一份
+    return base + ".parquet", base + ".json"
+
+def _to_cache_frame(df: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[str, List[str]]]:
+    """重複度高的文字欄位轉為 category（Parquet 以 dictionary 編碼儲存），list 欄位另外記錄"""
+    df = df.copy()
+    categorical, list_columns = [], []
+
+    for c in df.columns:
+        if df[c].dtype != object:
+            continue
+        values = df[c].dropna()
+        # 只有重複度高的文字欄位才值得 category（例如 WKT 幾何每列都不同就不轉）
+        if values.map(type).eq(str).all() and values.nunique() <= max(len(values) // 2, 1):
+            df[c] = df[c].astype("category")
+            categorical.append(c)
+        elif values.map(lambda v: isinstance(v, list)).all():
+            list_columns.append(c)
 
-        for stop in bdsr.findall("ns:Stops/ns:Stop", ns):
-            row = base.copy()
-            row.update({
-                # Stop 基本
-                "StopUID":      gettext(stop, "ns:StopUID"),
-                "StopID":       gettext(stop, "ns:StopID"),
-                "StopName_Zh":  gettext(stop, "ns:StopName/ns:Zh_tw"),
-                "StopName_En":  gettext(stop, "ns:StopName/ns:En"),
-
-                # 上下車/站序
-                "StopBoarding": gettext(stop, "ns:StopBoarding"),
-                "StopSequence": gettext(stop, "ns:StopSequence"),
-
-                # 位置
-                "PositionLon":  gettext(stop, "ns:StopPosition/ns:PositionLon"),
-                "PositionLat":  gettext(stop, "ns:StopPosition/ns:PositionLat"),
-                "GeoHash":      gettext(stop, "ns:StopPosition/ns:GeoHash"),
-
-                # 站位資訊
-                "StationID":        gettext(stop, "ns:StationID"),
-                "StationGroupID":   gettext(stop, "ns:StationGroupID"),
-                "LocationCityCode": gettext(stop, "ns:LocationCityCode"),
-            })
-            rows.append(row)
+    return df, {"categorical": categorical, "list_columns": list_columns}
 
-    df = pd.DataFrame(rows)
+def _from_cache_frame(df: pd.DataFrame, meta: Dict[str, Any], categorical: bool) -> pd.DataFrame:
+    """還原為 reader 原本的型別；categorical=True 時文字欄位維持 category"""
+    fill_none = meta.get("kind") in TDX_READERS  # XML reader 的缺值是 None，CSV 是 NaN
 
-    # 轉型（遇到空值就 NaN）
-    int_cols = ["Direction", "StopBoarding", "StopSequence", "VersionID"]
-    for c in int_cols:
-        if c in df.columns:
-            df[c] = pd.to_numeric(df[c], errors="coerce").astype("Int64")
+    if not categorical:
+        for c in meta.get("categorical", []):
+            s = df[c].astype(object)
+            df[c] = s.where(s.notna(), None) if fill_none else s
 
-    for c in ["PositionLon", "PositionLat"]:
-        if c in df.columns:
-            df[c] = pd.to_numeric(df[c], errors="coerce")
+    for c in meta.get("list_columns", []):
+        df[c] = df[c].map(lambda v: list(v) if v is not None else v)
 
-    # 常用排序：路線 + 方向 + 站序
-    sort_cols = [c for c in ["RouteUID", "Direction", "StopSequence"] if c in df.columns]
-    if sort_cols and len(df) > 0:
-        df = df.sort_values(sort_cols, kind="mergesort").reset_index(drop=True)
+    return df
 
+def _read_source(source_path: str, kind: Optional[str], reader_kwargs: Dict[str, Any]) -> pd.DataFrame:
+    if kind == "csv":
+        return pd.read_csv(source_path, **reader_kwargs)
+    return TDX_READERS[kind](source_path, **reader_kwargs)
+
+def read_tdx_cached(source_path: str,
+                    kind: Optional[str] = None,
+                    cache_folder: Optional[str] = None,
+                    categorical: bool = False,
+                    version_id: Optional[Any] = None,
+                    update_time: Optional[str] = None,
+                    **reader_kwargs) -> pd.DataFrame:
+    """
+    讀取 TDX 靜態資料（XML 或轉存後的 CSV），並以 Parquet 快取解析結果。
+
+    快取失效條件：
+        1. 來源檔案 sha256 改變（檔案大小、修改時間相同時直接視為未變，不重算 hash）
+        2. kind 或 reader_kwargs 不同（有 reader_kwargs 時快取檔名另外加上參數的雜湊，不同參數各自快取）
+        3. 有給 version_id / update_time，且與快取內記錄的 TDX VersionID / UpdateTime 不同
+
+    Args:
+        source_path (str): XML 或 CSV 檔案路徑。
+        kind (str, optional): 'BusRoute'、'BusStopOfRoute'、'BusShape'、'DisplayStopOfRoute' 或 'csv'；
+            None 時依副檔名與 XML root tag 自動判斷。
+        cache_folder (str, optional): 快取資料夾，預設為來源檔案同層的 _cache。
+        categorical (bool): True 時文字欄位以 category 回傳（省記憶體）；預設還原為 object，與 reader 相同。
+        version_id, update_time: 目前 TDX 上最新的 VersionID / UpdateTime（可選）。
+        **reader_kwargs: 傳給 reader（或 pd.read_csv）的參數。
+
+    Returns:
+        pd.DataFrame: 與 reader 輸出相同欄位與型別的資料。
+    """
+    if kind is None:
+        kind = "csv" if source_path.lower().endswith(".csv") else _xml_kind(source_path)
+        if kind is None:
+            raise ValueError(f"無法判斷 TDX 資料種類：{source_path}")
+
+    if cache_folder is None:
+        cache_folder = os.path.join(os.path.dirname(os.path.abspath(source_path)), "_cache")
+    reader_signature = _reader_signature(kind, reader_kwargs)
+    parquet_path, meta_path = _cache_paths(source_path, cache_folder, reader_signature if reader_kwargs else None)
+
+    stat = os.stat(source_path)
+    meta = None
+    if os.path.exists(parquet_path) and os.path.exists(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+
+    if (meta is not None and meta.get("schema_version") == CACHE_SCHEMA_VERSION and meta.get("kind") == kind
+            and meta.get("reader") == reader_signature):
+        valid = meta["size"] == stat.st_size and meta["mtime_ns"] == stat.st_mtime_ns
+        if not valid and meta["sha256"] == file_sha256(source_path):
+            # 內容沒變（例如重新複製檔案），更新 stat 就好
+            valid = True
+            meta["size"], meta["mtime_ns"] = stat.st_size, stat.st_mtime_ns
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False, indent=1)
+
+        expected = {"VersionID": version_id, "UpdateTime": update_time}
+        for key, value in expected.items():
+            if value is not None and meta["version"].get(key) != str(value):
+                valid = False
+
+        if valid:
+            return _from_cache_frame(pd.read_parquet(parquet_path), meta, categorical)
+
+    # 快取不存在或已失效：重新解析並寫入
+    df = _read_source(source_path, kind, reader_kwargs)
+    cache_df, column_info = _to_cache_frame(df)
+    meta = {
+        "schema_version": CACHE_SCHEMA_VERSION,
+        "source": os.path.abspath(source_path),
+        "kind": kind,
+        "reader": reader_signature,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": file_sha256(source_path),
+        "version": _version_signature(df),
+        **column_info,
+    }
+
+    try:
+        os.makedirs(cache_folder, exist_ok=True)
+        cache_df.to_parquet(parquet_path, index=False)
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=1)
+    except Exception as e:
+        print(f"Error writing cache {parquet_path}: {e}")
+
+    if categorical:
+        return cache_df
     return df
+
+def read_combined_tdx_cached(file_list: List[str], filepath: bool = True, **kwargs) -> pd.DataFrame:
+    """
+    同 basicprocess.read_combined_dataframe，但每個檔案都經過 read_tdx_cached。
+    用於站序、路線等重複讀取的 TDX 靜態資料。
+    """
+    dataframes = []
+
+    for file in file_list:
+        try:
+            df = read_tdx_cached(file, **kwargs)
+            if filepath:
+                df['FilePath'] = file  # 添加來源檔案路徑欄位
+            dataframes.append(df)
+        except Exception as e:
+            print(f"Error reading {file}: {e}")
+
+    return pd.concat(dataframes, ignore_index=True)
@@ -1,8 +1,18 @@
+import atexit
+import json
+import logging
 import os 
+import numpy as np
 import pandas as pd 
 import re
+import shutil
+import threading
+import time
 import geopandas as gpd
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from functools import partial, wraps
 from pathlib import Path
 
 
@@ -43,30 +53,400 @@ def findfiles(filefolderpath, filetype='.csv', recursive=True):
 
     return filelist
 
-def read_combined_dataframe(file_list, filepath = True):
-    dataframes = []
-    
-    for file in file_list:
-        try:
-            if file.endswith('.csv'):
-                df = pd.read_csv(file)
-            elif file.endswith('.shp'):
-                df = gpd.read_file(file)
-            elif file.endswith(('.xls', '.xlsx')):
-                df = pd.read_excel(file)
-            else:
-                print(f"Unsupported file format: {file}")
-                continue
-            if filepath:
-                df['FilePath'] = file  # 添加來源檔案路徑欄位
-            dataframes.append(df)
-        except Exception as e:
-            print(f"Error reading {file}: {e}")
+def _read_single_file(file, filepath=True, usecols=None, dtype=None, engine=None):
+    """讀取單一檔案（read_combined_dataframe 的工作單位，需放在模組層才能給 ProcessPool 使用）"""
+    try:
+        if file.endswith('.csv'):
+            df = pd.read_csv(file, usecols=usecols, dtype=dtype, engine=engine)
+        elif file.endswith('.shp'):
+            df = gpd.read_file(file, columns=usecols) if usecols is not None else gpd.read_file(file)
+        elif file.endswith(('.xls', '.xlsx')):
+            df = pd.read_excel(file, usecols=usecols, dtype=dtype)
+        else:
+            print(f"Unsupported file format: {file}")
+            return None
+        if filepath:
+            df['FilePath'] = file  # 添加來源檔案路徑欄位
+        stage_count(rows_in=len(df), chunks=1, bytes_read=_path_size(file))
+        return df
+    except Exception as e:
+        print(f"Error reading {file}: {e}")
+        return None
+
+def read_combined_dataframe(file_list, filepath = True,
+                            max_workers=1, use_processes=False,
+                            usecols=None, dtype=None, engine=None):
+    """
+    讀取多個 CSV / SHP / Excel 檔案並合併為一個 DataFrame。
+
+    Args:
+        file_list (list): 檔案路徑列表。
+        filepath (bool, optional): 是否新增 FilePath 欄位記錄來源檔案，預設為 True。
+        max_workers (int, optional): 同時讀取的檔案數，預設為 1（逐檔讀取）；None 代表使用所有 CPU 核心。
+        use_processes (bool, optional): True 改用 ProcessPool（CSV 解析較吃 CPU 時使用），預設為 ThreadPool。
+        usecols (list/callable, optional): 每個檔案只讀取的欄位（CSV/Excel 的 usecols；SHP 的 columns）。
+        dtype (dict, optional): 每個檔案讀取時指定的欄位型別，避免型別推斷並節省記憶體。
+        engine (str, optional): CSV 的解析引擎，例如 'pyarrow'（需安裝 pyarrow，可多執行緒解析）。
+
+    Returns:
+        pd.DataFrame: 依 file_list 順序合併後的結果（不受平行處理完成順序影響）。
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    read_kwargs = dict(filepath=filepath, usecols=usecols, dtype=dtype, engine=engine)
+
+    if max_workers <= 1 or len(file_list) <= 1:
+        dataframes = [_read_single_file(file, **read_kwargs) for file in file_list]
+    else:
+        executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        with executor_class(max_workers=min(max_workers, len(file_list))) as executor:
+            # executor.map 會依輸入順序回傳，確保輸出順序固定
+            dataframes = list(executor.map(partial(_read_single_file, **read_kwargs), file_list))
+
+    dataframes = [df for df in dataframes if df is not None]
 
     # 合併所有 DataFrame
     combined_df = pd.concat(dataframes, ignore_index=True)
     return combined_df
 
+# 中間階段資料儲存（CSV 或 Parquet）
+STAGE_PARTITION_COLUMNS = ['InfoDate', 'Authority']
+STAGE_TIME_COLUMNS = ['BoardingTime', 'DeboardingTime']
+STAGE_DATE_COLUMNS = ['InfoDate', 'BoardinngDate', 'DeboardingDate']
+STAGE_SCHEMA_FILE = '_common_metadata'
+# 票證的鍵值、UID 與名稱欄位：不論第一批資料推斷成什麼型別（整批空白時為 float NaN、純數字時為 int）一律存成 string
+STAGE_STRING_COLUMNS = ['Authority', 'OperatorNo', 'HolderType', 'TicketType', 'SubTicketType',
+                        'RouteUID', 'RouteName', 'SubRouteUID', 'SubRouteName',
+                        'BoardingStopUID', 'BoardingStopName', 'DeboardingStopUID', 'DeboardingStopName']
+
+def stage_output_path(folder, name, storage='csv'):
+    """
+    回傳中間階段資料的輸出路徑：csv 為 `name.csv` 檔案；parquet 為 `name.parquet` 資料夾（依分區欄位拆成多個檔案）。
+
+    Args:
+        folder (str): 輸出資料夾。
+        name (str): 不含副檔名的檔名。
+        storage (str, optional): 'csv' 或 'parquet'，預設為 'csv'。
+    """
+    if storage not in ('csv', 'parquet'):
+        raise ValueError(f"Unsupported storage: {storage}")
+    return os.path.join(folder, f"{name}.{storage}")
+
+def stage_name(path):
+    """取得中間階段資料的檔名（去掉 .csv / .parquet）"""
+    return os.path.splitext(os.path.basename(os.path.normpath(path)))[0]
+
+def find_stage_paths(folder, storage='csv'):
+    """
+    尋找資料夾內（不含子資料夾）的中間階段資料。
+
+    Returns:
+        list: csv 回傳 .csv 檔案；parquet 回傳 .parquet 資料夾。
+    """
+    if storage == 'parquet':
+        return [os.path.join(folder, d) for d in sorted(os.listdir(folder))
+                if d.endswith('.parquet') and os.path.exists(os.path.join(folder, d, STAGE_SCHEMA_FILE))]
+    return findfiles(folder, filetype='.csv', recursive=False)
+
+def _stage_prepare(df):
+    """寫出 Parquet 前統一型別：時間欄位轉為原生 timestamp，日期欄位統一為 YYYY-MM-DD 字串（與 CSV 內容一致）"""
+    df = df.copy()
+    for col in STAGE_TIME_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+    for col in STAGE_DATE_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors='coerce').dt.strftime('%Y-%m-%d')
+    return df
+
+def _stage_schema(df, partition_cols):
+    """
+    以第一批資料決定整個資料集的 schema，之後每批都轉成相同 schema。
+    文字欄位、STAGE_STRING_COLUMNS 與分區欄位一律為 string（第一批整欄空白或看起來像數字時也一樣）。
+    """
+    import pyarrow as pa
+
+    fields = []
+    for field in pa.Schema.from_pandas(df, preserve_index=False):
+        if (pa.types.is_null(field.type) or df[field.name].dtype == object
+                or field.name in partition_cols or field.name in STAGE_STRING_COLUMNS):
+            field = field.with_type(pa.string())
+        fields.append(field)
+    return pa.schema(fields, metadata={'partition_cols': json.dumps(partition_cols)})
+
+def _stage_text(values):
+    """string 欄位寫出前轉為文字：缺值為 None，整數值的浮點數（例如讀成 float 的 UID）去掉小數點"""
+    if values.dtype == object and pd.api.types.infer_dtype(values, skipna=True) in ('string', 'empty'):
+        return values
+    if pd.api.types.is_float_dtype(values) and (values.dropna() % 1 == 0).all():
+        values = values.astype('Int64')
+    return values.astype(object).map(lambda x: None if pd.isna(x) else x if isinstance(x, str) else str(x))
+
+def _read_stage_schema(path):
+    import pyarrow.parquet as pq
+    schema = pq.read_schema(os.path.join(path, STAGE_SCHEMA_FILE))
+    return schema, json.loads(schema.metadata[b'partition_cols'])
+
+def _stage_partition_dir(outputpath, partition_cols, key):
+    """Hive 分區資料夾：outputpath/InfoDate=.../Authority=..."""
+    if not isinstance(key, tuple):
+        key = (key,)
+    parts = [f"{col}={'__HIVE_DEFAULT_PARTITION__' if pd.isna(value) else value}" for col, value in zip(partition_cols, key)]
+    return os.path.join(outputpath, *parts)
+
+@contextmanager
+def stage_writer(outputpath, partition_cols=None, buffer_rows=500000, append=False):
+    """
+    開啟中間階段資料的寫入器（依 outputpath 副檔名判斷 csv / parquet），取代原本各階段的 to_csv(mode='a')。
+
+    Parquet 依 InfoDate/Authority 分區（存在的欄位才分區），每個分區一個檔案，資料先在記憶體累積到
+    buffer_rows 筆才寫成一個 row group，避免每批資料都產生小檔案。UID 與站名等文字欄位使用 Parquet 字典編碼，
+    上下車時間存為原生 timestamp，下游讀取時不用再重新解析。
+
+    Args:
+        outputpath (str): stage_output_path 產生的路徑，既有的輸出會在第一次寫入時覆蓋。
+        partition_cols (list, optional): Parquet 分區欄位，預設為 STAGE_PARTITION_COLUMNS。
+        buffer_rows (int, optional): Parquet 累積多少筆才寫出。
+        append (bool, optional): True 時保留既有的輸出，只在後面追加（CSV 不再寫標題列；Parquet 沿用既有 schema，
+            每個分區另外寫一個新的 part 檔），給增量處理（runmanifest）使用。
+
+    Yields:
+        function: write(df)，每批資料呼叫一次。
+
+    Example:
+        with stage_writer(outputpath) as write:
+            for chunk in chunks:
+                write(chunk)
+    """
+    state = {'first_chunk': True, 'schema': None, 'partition_cols': partition_cols,
+             'buffers': {}, 'buffered': 0, 'writers': {}, 'files': []}
+
+    if not outputpath.endswith('.parquet'):
+        if append and os.path.exists(outputpath) and os.path.getsize(outputpath) > 0:
+            state['first_chunk'] = False
+        def write(df):
+            before = 0 if state['first_chunk'] or not os.path.exists(outputpath) else os.path.getsize(outputpath)
+            df.to_csv(
+                outputpath,
+                mode='w' if state['first_chunk'] else 'a',
+                header=state['first_chunk'],
+                index=False,
+                encoding='utf-8-sig'
+            )
+            state['first_chunk'] = False
+            stage_count(rows_out=len(df), bytes_written=os.path.getsize(outputpath) - before)
+        yield write
+        return
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import shutil
+
+    def flush():
+        cols = state['partition_cols']
+        file_schema = pa.schema([f for f in state['schema'] if f.name not in cols])
+        text_cols = [f.name for f in file_schema if pa.types.is_string(f.type)]
+        for key, frames in state['buffers'].items():
+            df = pd.concat(frames, ignore_index=True).reindex(columns=file_schema.names)
+            for col in text_cols:
+                df[col] = _stage_text(df[col])
+            table = pa.Table.from_pandas(df, schema=file_schema, preserve_index=False)
+            if key not in state['writers']:
+                folder = _stage_partition_dir(outputpath, cols, key) if cols else outputpath
+                os.makedirs(folder, exist_ok=True)
+                part = 0
+                while os.path.exists(os.path.join(folder, f'part-{part}.parquet')):
+                    part += 1
+                state['files'].append(os.path.join(folder, f'part-{part}.parquet'))
+                state['writers'][key] = pq.ParquetWriter(state['files'][-1], file_schema,
+                                                         use_dictionary=True, compression='snappy')
+            state['writers'][key].write_table(table)
+        state['buffers'] = {}
+        state['buffered'] = 0
+
+    def write(df):
+        df = _stage_prepare(df)
+        if state['first_chunk'] and append and os.path.exists(os.path.join(outputpath, STAGE_SCHEMA_FILE)):
+            state['schema'], state['partition_cols'] = _read_stage_schema(outputpath)
+            state['first_chunk'] = False
+        if state['first_chunk']:
+            if os.path.exists(outputpath):
+                shutil.rmtree(outputpath)
+            os.makedirs(outputpath)
+            if state['partition_cols'] is None:
+                state['partition_cols'] = [c for c in STAGE_PARTITION_COLUMNS if c in df.columns]
+            state['schema'] = _stage_schema(df, state['partition_cols'])
+            pq.write_metadata(state['schema'], os.path.join(outputpath, STAGE_SCHEMA_FILE))
+            state['first_chunk'] = False
+        if df.empty:
+            return
+
+        cols = state['partition_cols']
+        if cols:
+            for key, group in df.groupby(cols if len(cols) > 1 else cols[0], dropna=False, sort=False):
+                state['buffers'].setdefault(key, []).append(group)
+        else:
+            state['buffers'].setdefault(None, []).append(df)
+        state['buffered'] += len(df)
+        stage_count(rows_out=len(df))
+        if state['buffered'] >= buffer_rows:
+            flush()
+
+    try:
+        yield write
+        if state['buffered']:
+            flush()
+    finally:
+        for writer in state['writers'].values():
+            writer.close()
+        stage_count(bytes_written=sum(_path_size(f) for f in state['files']))
+
+def _stage_dataset(path, files=None):
+    """開啟 parquet 中間階段資料夾（分區欄位型別以 _common_metadata 為準）；files 指定時只開啟其中這些 part 檔"""
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    schema, partition_cols = _read_stage_schema(path)
+    partitioning = None
+    if partition_cols:
+        partitioning = ds.partitioning(
+            pa.schema([schema.field(c) for c in partition_cols]), flavor='hive'
+        )
+    if files is not None:
+        return ds.dataset(list(files), schema=schema, format='parquet', partitioning=partitioning,
+                          partition_base_dir=path)
+    return ds.dataset(path, schema=schema, format='parquet', partitioning=partitioning)
+
+def _filter_dataframe(df, filters):
+    """CSV 版本的 filters（與 Parquet 相同格式：[(欄位, 運算子, 值), ...]，全部條件取交集）"""
+    mask = pd.Series(True, index=df.index)
+    for col, op, value in filters:
+        s = df[col]
+        if op in ('=', '=='):
+            mask &= s == value
+        elif op == '!=':
+            mask &= s != value
+        elif op == '<':
+            mask &= s < value
+        elif op == '<=':
+            mask &= s <= value
+        elif op == '>':
+            mask &= s > value
+        elif op == '>=':
+            mask &= s >= value
+        elif op == 'in':
+            mask &= s.isin(value)
+        elif op == 'not in':
+            mask &= ~s.isin(value)
+        else:
+            raise ValueError(f"Unsupported filter operator: {op}")
+    return df[mask]
+
+def read_csv_from_offset(path, offset=0, skiprows=0, chunksize=100000, usecols=None, encoding=None, position=None):
+    """
+    從指定的位元組位置開始分批讀取 CSV（只讀取上次處理之後才附加的資料列）。
+
+    Args:
+        path (str): CSV 路徑。
+        offset (int, optional): 開始讀取的位元組位置，需位於某一列的開頭；0 代表從頭讀取。
+        skiprows (int, optional): 標題列前要跳過的列數（原始票證為 1）。
+        chunksize (int, optional): 每批筆數。
+        usecols (list, optional): 只讀取的欄位。
+        encoding (str, optional): 檔案編碼。
+        position (dict, optional): 讀完後寫入 position['end']（實際讀到的位元組位置），下次由此接續。
+
+    Yields:
+        pd.DataFrame: 每批資料（欄位名稱一律取自檔案的標題列）。
+    """
+    if position is None:
+        position = {}
+    if offset >= os.path.getsize(path):
+        position['end'] = offset
+        return
+
+    kwargs = dict(chunksize=chunksize, usecols=usecols, encoding=encoding)
+    if offset > 0:
+        # 從中間開始讀沒有標題列，欄位名稱由檔案開頭的標題列取得
+        columns = pd.read_csv(path, skiprows=skiprows, nrows=0, encoding=encoding).columns
+        kwargs.update(header=None, names=list(columns))
+    else:
+        kwargs.update(skiprows=skiprows)
+
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for chunk in pd.read_csv(f, **kwargs):
+            stage_count(rows_in=len(chunk), chunks=1)
+            yield chunk
+        position['end'] = f.tell()
+    stage_count(bytes_read=position['end'] - offset)
+
+def iter_stage_chunks(path, chunksize=100000, columns=None, filters=None, offset=0, files=None, position=None):
+    """
+    分批讀取中間階段資料（csv 檔案或 parquet 資料夾）。
+
+    Args:
+        path (str): 中間階段資料路徑。
+        chunksize (int, optional): 每批筆數。
+        columns (list, optional): 只讀取的欄位（Parquet 只會讀取這些欄位的資料）。
+        filters (list, optional): [(欄位, 運算子, 值), ...]；Parquet 會依 InfoDate/Authority 分區直接略過不需要的檔案。
+        offset (int, optional): CSV 從這個位元組位置開始讀（增量處理用，見 read_csv_from_offset）。
+        files (list, optional): Parquet 只讀取這些 part 檔（增量處理用），None 代表整個資料夾。
+        position (dict, optional): CSV 讀完後寫入 position['end']。
+
+    Yields:
+        pd.DataFrame: 每批資料。
+    """
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        dataset = _stage_dataset(path, files=files)
+        expression = pq.filters_to_expression(filters) if filters else None
+        for batch in dataset.to_batches(columns=columns, filter=expression, batch_size=chunksize):
+            stage_count(rows_in=batch.num_rows, chunks=1)
+            if batch.num_rows:
+                yield batch.to_pandas()
+        stage_count(bytes_read=sum(_path_size(f.path) for f in dataset.get_fragments(filter=expression)))
+        return
+
+    usecols = None
+    if columns is not None:
+        # filters 用到的欄位也要讀進來，篩選後再丟掉
+        usecols = list(dict.fromkeys(list(columns) + [f[0] for f in (filters or [])]))
+    for chunk in read_csv_from_offset(path, offset=offset, chunksize=chunksize, usecols=usecols,
+                                      encoding='utf-8-sig', position=position):
+        if filters:
+            chunk = _filter_dataframe(chunk, filters)
+        if columns is not None:
+            chunk = chunk[list(columns)]
+        if not chunk.empty:
+            yield chunk
+
+def read_stage(path, columns=None, filters=None):
+    """
+    一次讀取整份中間階段資料（csv 檔案或 parquet 資料夾），參數同 iter_stage_chunks。
+
+    Returns:
+        pd.DataFrame
+    """
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        dataset = _stage_dataset(path)
+        expression = pq.filters_to_expression(filters) if filters else None
+        table = dataset.to_table(columns=columns, filter=expression)
+        stage_count(rows_in=table.num_rows, chunks=1,
+                    bytes_read=sum(_path_size(f.path) for f in dataset.get_fragments(filter=expression)))
+        return table.to_pandas()
+
+    usecols = None
+    if columns is not None:
+        usecols = list(dict.fromkeys(list(columns) + [f[0] for f in (filters or [])]))
+    df = pd.read_csv(path, encoding='utf-8-sig', usecols=usecols)
+    stage_count(rows_in=len(df), chunks=1, bytes_read=os.path.getsize(path))
+    if filters:
+        df = _filter_dataframe(df, filters)
+    if columns is not None:
+        df = df[list(columns)]
+    return df.reset_index(drop=True)
+
 def filter_by_keywords(df, filtercolumn, filterlist):
     """
     從指定欄位中，排除包含 filterlist 關鍵字的資料列
@@ -88,88 +468,296 @@ def filter_by_keywords(df, filtercolumn, filterlist):
     pattern = '|'.join(map(str, filterlist))
     return df[~df[filtercolumn].str.contains(pattern, na=False)]
 
-def updatelog(file, text):
+# log 紀錄：updatelog / updatelog_format 先放進寫入緩衝區，累積 LOG_BUFFER_LINES 行、ERROR 以上的等級、
+# stage_monitor 的 STAGE 紀錄或程式結束時立即附加到檔案；其餘由背景執行緒每 LOG_FLUSH_SECONDS 秒寫入一次，
+# 緩衝中的內容最多只會晚 LOG_FLUSH_SECONDS 秒寫到檔案（讀取 log 前也會先 flushlog）。
+# segmented=True 時每天一個檔案（xxx.log → xxx.2024-10-01.log），refreshlog 清除過期紀錄只需刪除檔案。
+LOG_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+LOG_BUFFER_LINES = 1000
+LOG_FLUSH_SECONDS = 5
+_log_buffers = {}
+_log_flushed = {}
+_log_lock = threading.Lock()
+_log_flusher = None
+
+def log_segment_path(file, date=None):
+    """日期分段的 log 檔路徑：xxx.log → xxx.YYYY-MM-DD.log（date 預設為今天）"""
+    p = Path(file)
+    date = date or datetime.now()
+    return str(p.with_name(f'{p.stem}.{date:%Y-%m-%d}{p.suffix}'))
+
+def find_log_segments(file):
+    """
+    找出 file 的所有日期分段。
+
+    Returns:
+        list: [(日期, 路徑), ...]，依日期排序。
+    """
+    p = Path(file)
+    folder = p.parent if str(p.parent) else Path('.')
+    if not folder.is_dir():
+        return []
+
+    segments = []
+    prefix, suffix = p.stem + '.', p.suffix
+    for name in os.listdir(folder):
+        if not (name.startswith(prefix) and name.endswith(suffix)) or len(name) != len(prefix) + 10 + len(suffix):
+            continue
+        try:
+            date = datetime.strptime(name[len(prefix):len(prefix) + 10], '%Y-%m-%d')
+        except ValueError:
+            continue
+        segments.append((date, str(folder / name)))
+    return sorted(segments)
+
+def log_files(file):
+    """file 本身（存在時）與其所有日期分段，依時間先後排列"""
+    files = [str(file)] if os.path.exists(file) else []
+    return files + [path for _, path in find_log_segments(file)]
+
+def _write_log_buffer(path):
+    """把 path 的緩衝區附加到檔案（呼叫前需取得 _log_lock）"""
+    lines = _log_buffers.pop(path, None)
+    _log_flushed[path] = time.monotonic()
+    if lines:
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+
+def appendlog(file, line, segmented=False, flush=False):
+    """
+    將一行文字放進 log 的寫入緩衝區，達到行數、時間間隔或 flush=True 時才開檔附加。
+
+    Args:
+        file (str): log 檔路徑。
+        line (str): 要寫入的內容（不含換行）。
+        segmented (bool, optional): True 時寫入今天的日期分段（log_segment_path）。
+        flush (bool, optional): True 時立即寫入檔案。
+    """
+    path = log_segment_path(file) if segmented else file
+    with _log_lock:
+        _log_buffers.setdefault(path, []).append(line)
+        if (flush or len(_log_buffers[path]) >= LOG_BUFFER_LINES
+                or time.monotonic() - _log_flushed.get(path, 0) >= LOG_FLUSH_SECONDS):
+            _write_log_buffer(path)
+        if _log_buffers:
+            _start_log_flusher()
+
+def _start_log_flusher():
+    """啟動背景寫入執行緒（每 LOG_FLUSH_SECONDS 秒把緩衝區寫入檔案）；已在執行時不做任何事"""
+    global _log_flusher
+    if _log_flusher is None or not _log_flusher.is_alive():
+        _log_flusher = threading.Thread(target=_flush_log_loop, name='log-flusher', daemon=True)
+        _log_flusher.start()
+
+def _flush_log_loop():
+    while True:
+        time.sleep(LOG_FLUSH_SECONDS)
+        with _log_lock:
+            for path in list(_log_buffers):
+                _write_log_buffer(path)
+
+def _reset_log_after_fork():
+    """fork 出的子行程（ProcessPool）不沿用父行程的緩衝區與鎖，避免重複寫入同樣的內容"""
+    global _log_lock, _log_flusher
+    _log_lock = threading.Lock()
+    _log_buffers.clear()
+    _log_flusher = None
+
+def flushlog():
+    """把所有 log 緩衝區寫入檔案，並 flush logging 的 handler"""
+    with _log_lock:
+        for path in list(_log_buffers):
+            _write_log_buffer(path)
+    for handler in logging.getLogger().handlers:
+        handler.flush()
+
+atexit.register(flushlog)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_log_after_fork)
+
+def updatelog(file, text, segmented=False):
     """將 text 追加寫入指定的 log 檔案，並加上當前時間"""
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')  # 取得當前時間
-    log_entry = f"[{timestamp}] {text}"  # 格式化日誌內容
-    with open(file, 'a', encoding='utf-8') as f:
-        f.write(log_entry + '\n')
+    timestamp = datetime.now().strftime(LOG_TIME_FORMAT)  # 取得當前時間
+    appendlog(file, f"[{timestamp}] {text}", segmented=segmented)
 
-def is_expired(line, cutoff_date):
-    """判斷該行的時間戳記是否超過 `cutoff_date`"""
+def _log_time(line):
+    """`[YYYY-MM-DD HH:MM:SS]` 開頭的行回傳時間戳記，否則回傳 None"""
+    if not line.startswith('['):
+        return None
     try:
-        timestamp_str = line[1:20]  # 擷取 `[YYYY-MM-DD HH:MM:SS]`
-        log_time = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
-        return log_time < cutoff_date
+        return datetime.strptime(line[1:20], LOG_TIME_FORMAT)
     except ValueError:
-        return False  # 解析錯誤則保留該行
+        return None
+
+def is_expired(line, cutoff_date):
+    """判斷該行的時間戳記是否超過 `cutoff_date`"""
+    log_time = _log_time(line)
+    return log_time is not None and log_time < cutoff_date  # 解析錯誤則保留該行
 
 def refreshlog(file, day=30):
-    """僅檢查第一行的時間戳記，若超過 `day` 天才執行清理"""
+    """
+    清除超過 `day` 天的紀錄。
+    日期分段的檔案整天都過期時直接刪除；file 本身（未分段）僅檢查第一行的時間戳記，若超過 `day` 天才清理：
+    log 依時間順序附加，逐行跳過過期的紀錄，找到第一筆未過期的紀錄後其餘內容整段複製，不必整個讀進記憶體。
+    """
+    flushlog()
+    cutoff_date = datetime.now() - timedelta(days=day)  # 計算過期時間
+    for date, path in find_log_segments(file):
+        if date + timedelta(days=1) <= cutoff_date:
+            os.remove(path)
+
     if not os.path.exists(file):
         return  # 檔案不存在，直接返回
 
-    cutoff_date = datetime.now() - timedelta(days=day)  # 計算過期時間
-
     with open(file, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
+        first_log_time = _log_time(f.readline())
+        if first_log_time is None or first_log_time >= cutoff_date:
+            return  # 檔案為空、沒有時間戳記或第一行時間還在範圍內，直接跳出
+
+        f.seek(0)
+        tmpfile = file + '.tmp'
+        with open(tmpfile, 'w', encoding='utf-8') as out:
+            for line in f:
+                log_time = _log_time(line)
+                if log_time is None:
+                    out.write(line)  # 沒有時間戳記的行保留
+                elif log_time >= cutoff_date:
+                    out.write(line)
+                    break
+            shutil.copyfileobj(f, out, 16 * 1024 * 1024)
+    os.replace(tmpfile, file)
+
+def updatelog_format(file, text, level = 'INFO', segmented=False, flush=False):
+    """將 `[時間] [等級] text` 追加寫入 log；flush=True 或 ERROR 以上的等級立即寫入檔案"""
+    timestamp = datetime.now().strftime(LOG_TIME_FORMAT)
+    log_entry = f"[{timestamp}] [{level}] {text}"
+    appendlog(file, log_entry, segmented=segmented, flush=flush or str(level).upper() in ('ERROR', 'CRITICAL'))
 
-    if not lines:
-        return  # 檔案為空，直接返回
+# log 解析：整個檔案一次讀入後切行，時間戳記以固定位置切出、整欄轉換，等級與訊息以 str.partition / split 切開，
+# 不逐行套用正規表示式、也不逐行建立 dict。沒有時間戳記的行（例如 traceback）接到上一筆紀錄的訊息後面。
+def read_log_lines(logfile, encoding='utf-8'):
+    """
+    讀取 log 檔（含日期分段，依時間先後串接）的所有行。
 
-    # 解析第一行的時間戳記
-    first_line = lines[0]
-    if first_line.startswith('['):  # 確保這行有時間戳記
-        try:
-            timestamp_str = first_line[1:20]  # 擷取 `[YYYY-MM-DD HH:MM:SS]`
-            first_log_time = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
-            if first_log_time >= cutoff_date:
-                return  # 如果第一行時間還在範圍內，直接跳出
-        except ValueError:
-            pass  # 解析失敗就忽略，繼續清理
+    Returns:
+        pd.Series: 每行一個字串（不含換行），index 為行號（從 1 開始）。
+    """
+    flushlog()
+    lines = []
+    for path in log_files(logfile) or [logfile]:
+        with open(path, 'r', encoding=encoding, errors='replace') as f:
+            text = f.read()
+        lines.extend(text[:-1].split('\n') if text.endswith('\n') else text.split('\n') if text else [])
+    return pd.Series(lines, index=pd.RangeIndex(1, len(lines) + 1), dtype=object)
+
+def _parse_log_time(values, time_format):
+    """整欄轉換時間，無法解析時為 NaT。`,%f`（logging 的毫秒）先換成 ISO 的 `.%f` 才能走 to_datetime 的快速路徑"""
+    if ',%f' in time_format:
+        values = [v.replace(',', '.') if isinstance(v, str) else v for v in values]
+        time_format = time_format.replace(',%f', '.%f')
+    return pd.to_datetime(pd.Series(values, dtype=object), format=time_format, errors='coerce')
+
+def _join_continuation(lines, is_record, records, column):
+    """沒有時間戳記的非空白行接到上一筆紀錄的 column（第一筆紀錄之前的行捨棄）"""
+    group = np.cumsum(is_record)
+    extra = np.flatnonzero(~is_record & (group > 0))
+    extra = extra[[bool(line.strip()) for line in lines.iloc[extra]]] if len(extra) else extra
+    if len(extra):
+        joined = lines.iloc[extra].groupby(group[extra]).agg('\n'.join)
+        position = joined.index.to_numpy() - 1
+        values = records[column].to_numpy(dtype=object).copy()
+        values[position] = [f'{a}\n{b}' for a, b in zip(values[position], joined)]
+        records[column] = values
+    return records
+
+def parse_log_lines(lines, sep=' | ', names=("timestamp", "level", "message"), time_format="%Y-%m-%d %H:%M:%S,%f", regex=False):
+    """
+    解析 logging 格式的 log 行（預設為 `%(asctime)s | %(levelname)s | %(message)s`）。
 
-    # 若第一行時間超過 `day` 天，則開始過濾所有行
-    new_lines = [line for line in lines if not (line.startswith('[') and is_expired(line, cutoff_date))]
+    Args:
+        lines (pd.Series): read_log_lines 的結果。
+        sep (str): 欄位分隔字串；regex=True 時為正規表示式。最後一個欄位（訊息）中的分隔字串不會被切開。
+        names (sequence): 欄位名稱；有 timestamp 欄位時，時間無法解析的行視為上一筆紀錄的接續。
+        time_format (str): timestamp 欄位的時間格式。
+
+    Returns:
+        pd.DataFrame: line_no + names。
+    """
+    names = list(names)
+    lines = pd.Series(lines, dtype=object)
+    lines = lines[[bool(line.strip()) for line in lines]]
+    if regex:
+        pattern = re.compile(sep)
+        parts = [pattern.split(line, len(names) - 1) for line in lines]
+        columns = [[p[i] if len(p) > i else None for p in parts] for i in range(len(names))]
+    else:
+        # 每個分隔字串整欄 partition 一次（比 str.split 快），缺少的欄位為 None
+        columns, rest = [], list(lines)
+        for _ in names[:-1]:
+            parts = [r.partition(sep) if r is not None else (None, '', None) for r in rest]
+            columns.append([p[0] for p in parts])
+            rest = [p[2] if p[1] else None for p in parts]
+        columns.append(rest)
+    df = pd.DataFrame(dict(zip(names, columns)), index=lines.index)
+
+    if 'timestamp' not in names:
+        return df.rename_axis('line_no').reset_index()
+    df['timestamp'] = _parse_log_time(df['timestamp'], time_format).to_numpy()
+    is_record = df['timestamp'].notna().to_numpy()
+    records = df[is_record].rename_axis('line_no').reset_index()
+    return _join_continuation(lines, is_record, records, names[-1])
+
+def parse_bracket_log_lines(lines):
+    """
+    解析 updatelog / updatelog_format 格式的 log 行：`[YYYY-MM-DD HH:MM:SS] [LEVEL] message`，
+    等級可以省略（updatelog），等級後也可以接冒號（`[LEVEL]:message`）。
 
-    # 重新寫入檔案
-    with open(file, 'w', encoding='utf-8') as f:
-        f.writelines(new_lines)
+    Returns:
+        pd.DataFrame: line_no、timestamp、level（沒有等級時為 None）、message。
+    """
+    lines = pd.Series(lines, dtype=object)
+    head = lines.to_numpy(dtype=object).astype('U21')
+    is_record = (np.char.startswith(head, '[') & (np.char.str_len(head) == 21) & np.char.endswith(head, ']'))
+    timestamp = _parse_log_time(pd.Series(head, index=lines.index).str[1:20][is_record], LOG_TIME_FORMAT)
+    is_record[is_record] = timestamp.notna().to_numpy()
+
+    levels, messages = [], []
+    for line in lines[is_record]:
+        rest = line[21:].lstrip()
+        if rest.startswith('[') and ']' in rest:
+            level, _, message = rest[1:].partition(']')
+            levels.append(level)
+            messages.append(message.lstrip(':').strip())
+        else:
+            levels.append(None)
+            messages.append(rest.strip())
+    records = pd.DataFrame({'line_no': lines.index[is_record], 'timestamp': timestamp[timestamp.notna()].to_numpy(),
+                            'level': levels, 'message': messages})
+    return _join_continuation(lines, is_record, records, 'message')
 
 def log_txt_to_dataframe(
     txt_path: str,
-    log_re=re.compile(
-        r'^\[(?P<ts>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\]\s*'
-        r'\[(?P<level>[^\]]+)\]:(?P<msg>.*)$'
-    )) -> pd.DataFrame:
-
-    rows = []
-
-    with open(txt_path, "r", encoding="utf-8") as f:
-        for line_no, line in enumerate(f, start=1):
-            line = line.rstrip("\n")
-
-            if not line.strip():
-                continue
-
-            m = log_re.match(line)
-            if m:
-                rows.append({
-                    "line_no": line_no,
-                    "timestamp": pd.to_datetime(m.group("ts")),
-                    "level": m.group("level").lower(),
-                    "message": m.group("msg").strip()
-                })
-            else:
-                if rows:
-                    rows[-1]["message"] += "\n" + line
-
-    return pd.DataFrame(rows)
-
-def updatelog_format(file, text, level = 'INFO'):
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    log_entry = f"[{timestamp}] [{level}] {text}"
-    with open(file, 'a', encoding='utf-8') as f:
-        f.write(log_entry + '\n')
+    log_re=None) -> pd.DataFrame:
+    """
+    讀取 `[YYYY-MM-DD HH:MM:SS] [level]:message` 格式的 log（level 轉小寫）。
+    log_re 為自訂的正規表示式（需有 ts、level、msg 具名群組），以 str.extract 整欄比對；對不到的行接到上一筆紀錄。
+    """
+    lines = read_log_lines(txt_path)
+    if log_re is None:
+        df = parse_bracket_log_lines(lines)
+        df['level'] = df['level'].str.lower()
+        return df
+
+    lines = lines[lines.str.strip() != '']
+    m = lines.str.extract(log_re)
+    is_record = m['ts'].notna().to_numpy()
+    records = pd.DataFrame({
+        "line_no": lines.index[is_record],
+        "timestamp": pd.to_datetime(m['ts'][is_record].to_numpy()),
+        "level": m['level'][is_record].str.lower().to_numpy(),
+        "message": m['msg'][is_record].str.strip().to_numpy(),
+    })
+    return _join_continuation(lines, is_record, records, 'message')
 
 def transfer_log_to_dataframe(logfilepath):
     """
@@ -177,56 +765,187 @@ def transfer_log_to_dataframe(logfilepath):
     log 格式需為：
     [YYYY-MM-DD HH:MM:SS] [LEVEL] message
     """
-    pattern = r'\[(.*?)\] \[(.*?)\] (.*)'
-    rows = []
-
-    with open(logfilepath, 'r', encoding='utf-8') as f:
-        for line in f:
-            match = re.match(pattern, line.strip())
-            if match:
-                timestamp, level, message = match.groups()
-                rows.append({
-                    'timestamp': pd.to_datetime(timestamp),
-                    'level': level,
-                    'message': message
-                })
-
-    df = pd.DataFrame(rows)
-    return df
+    df = parse_bracket_log_lines(read_log_lines(logfilepath))
+    return df[df['level'].notna()].reindex(columns=['timestamp', 'level', 'message']).reset_index(drop=True)
 
 def get_df_log(
     logfile: str,
     *,
-    sep: str = r"\s*\|\s*",
+    sep: str = " | ",
     names: list[str] = ["timestamp", "level", "message"],
     encoding: str = "cp950",
-    time_format: str = "%Y-%m-%d %H:%M:%S,%f"):
-
-
-    df = pd.read_csv(
-        logfile,
-        sep=sep,
-        engine="python",
-        names=names,
-        encoding=encoding,
-    )
-
-    # 只有 timestamp 欄位存在時才轉時間（防呆）
-    if "timestamp" in df.columns:
-        df["timestamp"] = pd.to_datetime(
-            df["timestamp"],
-            format=time_format,
-            errors="coerce"  # 解析失敗 → NaT，不會炸掉
-        )
+    time_format: str = "%Y-%m-%d %H:%M:%S,%f",
+    regex: bool = False):
+    """
+    讀取 logging.basicConfig(format="%(asctime)s | %(levelname)s | %(message)s") 輸出的 log（含日期分段）。
+    訊息中有分隔字串時仍留在 message；traceback 等沒有時間戳記的行接到上一筆紀錄的 message。
 
-    return df
+    Returns:
+        pd.DataFrame: names 欄位，timestamp 解析失敗的行不會單獨成為一筆。
+    """
+    df = parse_log_lines(read_log_lines(logfile, encoding=encoding), sep=sep, names=names,
+                         time_format=time_format, regex=regex)
+    return df.drop(columns=['line_no'])
 
+EXCEL_MAX_ROWS = 1048575  # Excel 工作表列數上限（扣掉標題列）
 
 def outputlog(logfile: str):
+    """log（與 stage_monitor 的紀錄）輸出為同名的 Excel；超過工作表列數上限時分成 log、log_2 ... 多個工作表"""
     df_log = get_df_log(logfile)
+    df_stagelog = get_df_stagelog(logfile)
 
     p = Path(logfile)
     logfile_excel = str(p.with_suffix(".xlsx"))
 
-    df_log.to_excel(logfile_excel, index=False)
-    return logfile_excel
\ No newline at end of file
+    if df_stagelog.empty and len(df_log) <= EXCEL_MAX_ROWS:
+        df_log.to_excel(logfile_excel, index=False)
+        return logfile_excel
+
+    # 有 stage_monitor 的紀錄時另外輸出 stages 工作表
+    with pd.ExcelWriter(logfile_excel) as writer:
+        for i, start in enumerate(range(0, max(len(df_log), 1), EXCEL_MAX_ROWS)):
+            sheet_name = 'log' if i == 0 else f'log_{i + 1}'
+            df_log.iloc[start:start + EXCEL_MAX_ROWS].to_excel(writer, sheet_name=sheet_name, index=False)
+        if not df_stagelog.empty:
+            df_stagelog.to_excel(writer, sheet_name='stages', index=False)
+    return logfile_excel
+# 階段效能紀錄（每個 preXX_ / analyticsXX_ 階段的時間、筆數、讀寫量與記憶體）
+STAGE_LOG_PREFIX = 'STAGE '
+_active_stages = []
+_stage_lock = threading.Lock()
+
+def _current_rss():
+    """目前行程使用的記憶體（bytes）。有安裝 psutil 時為目前的 RSS，否則以 resource 取得的行程峰值代替；都沒有時回傳 None"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        return None
+
+def _path_size(path):
+    """檔案大小，或資料夾（parquet 中間階段資料）內所有檔案的大小總和"""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+def stage_count(rows_in=0, rows_out=0, chunks=0, bytes_read=0, bytes_written=0):
+    """
+    累加目前執行中的階段（stage_monitor）的計數，並在此時取樣記憶體。沒有執行中的階段時不做任何事。
+    iter_stage_chunks / read_csv_from_offset / read_stage / read_combined_dataframe / stage_writer 會自動呼叫；
+    其他自行讀寫檔案的地方可以手動補上。巢狀的階段會同時累加到外層。
+    """
+    if not _active_stages:
+        return
+    rss = _current_rss()
+    with _stage_lock:
+        for stats in _active_stages:
+            stats['rows_in'] += rows_in
+            stats['rows_out'] += rows_out
+            stats['chunks'] += chunks
+            stats['bytes_read'] += bytes_read
+            stats['bytes_written'] += bytes_written
+            if rss is not None:
+                stats['peak_rss'] = max(stats['peak_rss'] or 0, rss)
+
+@contextmanager
+def stage_monitor(stage, logfile=None, **info):
+    """
+    記錄一個階段的效能：執行時間、讀入 / 寫出筆數、讀寫的位元組數、批次數、每秒處理筆數與記憶體峰值。
+    結束時（含發生錯誤）寫一行 `STAGE {json}` 到 log：logfile 為 None 時以 logging.info 寫入
+    （notebook 以 logging.basicConfig 設定的 log 檔），否則以 updatelog_format 寫入 logfile。
+    之後以 get_df_stagelog 讀成 DataFrame，outputlog 也會一併輸出到 Excel 的 stages 工作表。
+
+    記憶體峰值在每批資料讀寫時取樣（需安裝 psutil；沒有時以 resource 取得的行程峰值代替，Windows 則不記錄）。
+    以 ProcessPool 讀取時，子行程的筆數與記憶體不會被計入。
+
+    Args:
+        stage (str): 階段名稱，例如 'pre02_get_correct_tickets'。
+        logfile (str, optional): 另外指定的 log 檔。
+        **info: 其他要一起記錄的欄位（例如 storage='parquet'）。
+
+    Yields:
+        dict: 這個階段的計數，可自行累加（例如 stats['rows_out'] += len(df)）。
+
+    Example:
+        with stage_monitor('pre04_reformat', storage='csv'):
+            pre04_reformat(...)
+    """
+    rss = _current_rss()
+    stats = {'rows_in': 0, 'rows_out': 0, 'chunks': 0, 'bytes_read': 0, 'bytes_written': 0, 'peak_rss': rss}
+    start = datetime.now()
+    status = 'ok'
+    with _stage_lock:
+        _active_stages.append(stats)
+    try:
+        yield stats
+    except BaseException as e:
+        status = f'error: {type(e).__name__}'
+        raise
+    finally:
+        with _stage_lock:
+            _active_stages.remove(stats)
+        end_rss = _current_rss()
+        wall = (datetime.now() - start).total_seconds()
+        peak = max([v for v in (stats['peak_rss'], end_rss) if v is not None], default=None)
+        record = {
+            'stage': stage, 'status': status,
+            'start': start.strftime('%Y-%m-%d %H:%M:%S'), 'wall_s': round(wall, 3),
+            'rows_in': stats['rows_in'], 'rows_out': stats['rows_out'], 'chunks': stats['chunks'],
+            'rows_per_s': round(max(stats['rows_in'], stats['rows_out']) / wall, 1) if wall > 0 else None,
+            'mb_read': round(stats['bytes_read'] / 2**20, 3), 'mb_written': round(stats['bytes_written'] / 2**20, 3),
+            'peak_rss_mb': round(peak / 2**20, 1) if peak is not None else None,
+            'rss_delta_mb': round((end_rss - rss) / 2**20, 1) if rss is not None and end_rss is not None else None,
+            **info,
+        }
+        message = STAGE_LOG_PREFIX + json.dumps(record, default=str)
+        if logfile is None:
+            logging.info(message)
+        else:
+            updatelog_format(logfile, message, flush=True)  # 階段中斷時也要留下紀錄，不放在緩衝區
+
+def monitor_stage(stage=None, logfile=None):
+    """
+    stage_monitor 的裝飾器版本，階段名稱預設為函數名稱。
+
+    Example:
+        @monitor_stage()
+        def pre02_get_correct_tickets(...):
+            ...
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_monitor(stage or func.__name__, logfile=logfile):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def get_df_stagelog(logfile, encoding='cp950'):
+    """
+    從 log 檔（含日期分段）取出 stage_monitor 的紀錄（每個階段一列），log 為 logging 或 updatelog_format 的格式都可以。
+
+    Returns:
+        pd.DataFrame: 欄位為 stage、status、start、wall_s、rows_in、rows_out、chunks、rows_per_s、
+        mb_read、mb_written、peak_rss_mb、rss_delta_mb 以及 stage_monitor 的 **info。
+    """
+    records = []
+    lines = read_log_lines(logfile, encoding=encoding)
+    for line in lines[lines.str.contains(STAGE_LOG_PREFIX + '{', regex=False)]:
+        try:
+            records.append(json.loads(line[line.find(STAGE_LOG_PREFIX + '{') + len(STAGE_LOG_PREFIX):]))
+        except ValueError:
+            continue
+    df = pd.DataFrame(records)
+    if 'start' in df.columns:
+        df['start'] = pd.to_datetime(df['start'])
+    return df
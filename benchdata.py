@@ -0,0 +1,225 @@
+"""
+基準測試用的合成資料，不需要 TICP 授權的票證資料即可測量管線效能。
+
+以固定的亂數種子產生：
+    make_network              公車路網（路線、方向、站序與站點經緯度）
+    write_bus_stop_of_route_xml / write_bus_shape_xml
+                              TDX 格式的站序（BusStopOfRoute）與線形（BusShape）XML
+    write_to1a_tickets        TO1A 格式的原始票證 CSV（欄位同 TICP 匯出檔，第一列為檔頭說明）
+
+票證的站點編號、站名、站序都取自同一份路網，再依 ERROR_RATES 混入各種異常（上車晚於下車、同站上下車、
+缺下車資料、站序與 TDX 不符、站點編號不在 TDX、記成另一個方向），讓 tickets_cleaning 與站序比對
+（checkseq → matchwithstopname → matchwith_anotherdirection）都有實際要處理的資料。
+同一組參數每次產生的內容完全相同；票證分批產生、分批寫出，1 億筆也不需要全部放在記憶體。
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import os
+import pandas as pd
+from typing import Dict, Optional
+from xml.sax.saxutils import escape
+
+from TDXdataframe import TDX_NS_URI
+
+TO1A_COLUMNS = ['Authority', 'OperatorNo', 'HolderType', 'TicketType', 'SubTicketType',
+                'RouteUID', 'RouteName', 'SubRouteUID', 'SubRouteName', 'Direction',
+                'BoardingStopUID', 'BoardingStopName', 'BoardingStopSequence', 'BoardingTime',
+                'DeboardingStopUID', 'DeboardingStopName', 'DeboardingStopSequence', 'DeboardingTime',
+                'InfoDate']
+
+# 各種異常的比例（每張票證獨立抽樣）
+ERROR_RATES = {
+    'time_reversed': 0.01,      # 上車晚於下車
+    'same_stop': 0.01,          # 同站上下車
+    'missing_off_time': 0.05,   # 沒有下車刷卡時間
+    'missing_off_stop': 0.05,   # 沒有下車站點資料
+    'wrong_sequence': 0.03,     # 上車站序與 TDX 站序不同
+    'unknown_stop': 0.01,       # 上車站點編號不在 TDX 站序（站名相同）
+    'other_direction': 0.01,    # 記成另一個方向（站點編號屬於另一個方向）
+}
+
+CITIES = ['TPE', 'NWT']
+CITY_NAMES = {'TPE': 'Taipei', 'NWT': 'NewTaipei'}
+
+# ===== 路網 =====
+def make_network(n_routes: int = 2000, min_stops: int = 10, max_stops: int = 60, seed: int = 0) -> pd.DataFrame:
+    """
+    產生公車路網：每條路線有去（Direction 0）、回（Direction 1）兩個方向，回程為去程反向、
+    站名相同但站點編號不同（同 TDX 對向站牌）。站點沿隨機方向約每 400 公尺一站，位於台北市附近。
+
+    Returns:
+        pd.DataFrame: RouteUID、RouteName、SubRouteUID、SubRouteName、Direction、City、
+                      StopUID、StopName、StopSequence、PositionLon、PositionLat（每站一列，依路線、方向、站序排序）
+    """
+    rng = np.random.default_rng(seed)
+    nstops = rng.integers(min_stops, max_stops + 1, n_routes)
+    city = np.array(CITIES)[np.arange(n_routes) % len(CITIES)]
+    start_lon = rng.uniform(121.40, 121.65, n_routes)
+    start_lat = rng.uniform(24.95, 25.15, n_routes)
+    heading = rng.uniform(0, 2 * np.pi, n_routes)
+
+    frames = []
+    uid = 0
+    for r in range(n_routes):
+        n = int(nstops[r])
+        step = rng.uniform(300, 500, n - 1) / 111000   # 約 400 公尺（度）
+        turn = np.cumsum(rng.normal(0, 0.25, n - 1)) + heading[r]
+        lon = start_lon[r] + np.concatenate([[0], np.cumsum(step * np.cos(turn))])
+        lat = start_lat[r] + np.concatenate([[0], np.cumsum(step * np.sin(turn))])
+        name = [f'路{r}站{k}' for k in range(n)]
+        route_uid = f'{city[r]}{r:05d}'
+        for direction in (0, 1):
+            order = np.arange(n) if direction == 0 else np.arange(n)[::-1]
+            offset = 0.0 if direction == 0 else 0.0002   # 對向站牌
+            frames.append(pd.DataFrame({
+                'RouteUID': route_uid, 'RouteName': f'{r}', 'SubRouteUID': f'{route_uid}1', 'SubRouteName': f'{r}',
+                'Direction': direction, 'City': CITY_NAMES[city[r]],
+                'StopUID': [f'{city[r]}{uid + k:07d}' for k in range(n)],
+                'StopName': [name[k] for k in order],
+                'StopSequence': np.arange(1, n + 1),
+                'PositionLon': np.round(lon[order] + offset, 6), 'PositionLat': np.round(lat[order] + offset, 6),
+            }))
+            uid += n
+    return pd.concat(frames, ignore_index=True)
+
+# ===== TDX XML =====
+def write_bus_stop_of_route_xml(network: pd.DataFrame, path: str) -> str:
+    """路網寫成 TDX BusStopOfRoute XML（read_bus_stop_of_route_xml 可讀取）"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f'<?xml version="1.0" encoding="utf-8"?><ArrayOfBusStopOfRoute xmlns="{TDX_NS_URI}">')
+        for (route_uid, direction), g in network.groupby(['RouteUID', 'Direction'], sort=False):
+            r = g.iloc[0]
+            stops = ''.join(
+                f'<Stop><StopUID>{uid}</StopUID><StopID>{uid[3:]}</StopID><StopName><Zh_tw>{escape(name)}</Zh_tw></StopName>'
+                f'<StopBoarding>0</StopBoarding><StopSequence>{seq}</StopSequence>'
+                f'<StopPosition><PositionLon>{lon}</PositionLon><PositionLat>{lat}</PositionLat></StopPosition>'
+                f'<StationID>{uid[3:]}</StationID><LocationCityCode>{uid[:3]}</LocationCityCode></Stop>'
+                for uid, name, seq, lon, lat in zip(g['StopUID'], g['StopName'], g['StopSequence'],
+                                                    g['PositionLon'], g['PositionLat']))
+            f.write(f'<BusStopOfRoute><RouteUID>{route_uid}</RouteUID><RouteID>{route_uid[3:]}</RouteID>'
+                    f'<RouteName><Zh_tw>{escape(r.RouteName)}</Zh_tw></RouteName>'
+                    f'<Operators><Operator><OperatorID>1</OperatorID><OperatorName><Zh_tw>合成客運</Zh_tw></OperatorName>'
+                    f'<OperatorNo>1</OperatorNo></Operator></Operators>'
+                    f'<SubRouteUID>{r.SubRouteUID}</SubRouteUID><SubRouteID>{r.SubRouteUID[3:]}</SubRouteID>'
+                    f'<SubRouteName><Zh_tw>{escape(r.SubRouteName)}</Zh_tw></SubRouteName>'
+                    f'<Direction>{direction}</Direction><City>{r.City}</City><CityCode>{route_uid[:3]}</CityCode>'
+                    f'<Stops>{stops}</Stops><UpdateTime>2025-01-01T00:00:00+08:00</UpdateTime><VersionID>1</VersionID>'
+                    f'</BusStopOfRoute>')
+        f.write('</ArrayOfBusStopOfRoute>')
+    return path
+
+def write_bus_shape_xml(network: pd.DataFrame, path: str, vertices_per_segment: int = 4, seed: int = 0) -> str:
+    """
+    路網寫成 TDX BusShape XML（read_bus_shape_of_route_xml 可讀取），每個方向一條線形，
+    Geometry 為經過各站的 WKT LINESTRING，相鄰兩站之間另外加入 vertices_per_segment 個略為偏移的節點。
+    """
+    rng = np.random.default_rng(seed)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f'<?xml version="1.0" encoding="utf-8"?><ArrayOfBusShape xmlns="{TDX_NS_URI}">')
+        for (route_uid, direction), g in network.groupby(['RouteUID', 'Direction'], sort=False):
+            lon, lat = g['PositionLon'].to_numpy(), g['PositionLat'].to_numpy()
+            t = np.linspace(0, 1, vertices_per_segment + 2)[:-1]
+            xs = (lon[:-1, None] + (lon[1:] - lon[:-1])[:, None] * t).ravel()
+            ys = (lat[:-1, None] + (lat[1:] - lat[:-1])[:, None] * t).ravel()
+            jitter = rng.normal(0, 0.00003, (2, len(xs)))
+            jitter[:, ::len(t)] = 0   # 站點本身不偏移
+            xs, ys = np.append(xs + jitter[0], lon[-1]), np.append(ys + jitter[1], lat[-1])
+            wkt = 'LINESTRING(' + ','.join(f'{x:.6f} {y:.6f}' for x, y in zip(xs, ys)) + ')'
+            r = g.iloc[0]
+            f.write(f'<BusShape><RouteUID>{route_uid}</RouteUID><RouteID>{route_uid[3:]}</RouteID>'
+                    f'<RouteName><Zh_tw>{escape(r.RouteName)}</Zh_tw></RouteName>'
+                    f'<SubRouteUID>{r.SubRouteUID}</SubRouteUID><SubRouteID>{r.SubRouteUID[3:]}</SubRouteID>'
+                    f'<SubRouteName><Zh_tw>{escape(r.SubRouteName)}</Zh_tw></SubRouteName>'
+                    f'<Direction>{direction}</Direction><Geometry>{wkt}</Geometry>'
+                    f'<UpdateTime>2025-01-01T00:00:00+08:00</UpdateTime><VersionID>1</VersionID></BusShape>')
+        f.write('</ArrayOfBusShape>')
+    return path
+
+# ===== TO1A 票證 =====
+def _ticket_chunk(network: pd.DataFrame, legs: Dict[str, np.ndarray], rows: int, rng: np.random.Generator,
+                  start: pd.Timestamp, days: int, error_rates: Dict[str, float]) -> pd.DataFrame:
+    """產生一批票證：隨機選路線方向、上車站與其後的下車站，再依 error_rates 混入異常"""
+    leg = rng.integers(0, len(legs['offset']), rows)
+    n = legs['nstops'][leg]
+    b = (rng.random(rows) * (n - 1)).astype(np.int64)
+    d = b + 1 + (rng.random(rows) * (n - 1 - b)).astype(np.int64)
+    bi, di = legs['offset'][leg] + b, legs['offset'][leg] + d
+
+    uid = network['StopUID'].to_numpy(dtype=object)
+    name = network['StopName'].to_numpy(dtype=object)
+    seq = network['StopSequence'].to_numpy(dtype=float)
+    route = network.iloc[legs['offset'][leg]]
+
+    day = start + pd.to_timedelta(rng.integers(0, days, rows), unit='D')
+    board = day + pd.to_timedelta(rng.integers(5 * 3600, 23 * 3600, rows), unit='s')
+    deboard = board + pd.to_timedelta((d - b) * 90 + rng.integers(0, 600, rows), unit='s')
+
+    df = pd.DataFrame({
+        'Authority': route['RouteUID'].str[:3].to_numpy(),
+        'OperatorNo': 1,
+        'HolderType': rng.integers(0, 4, rows),
+        'TicketType': 1,
+        'SubTicketType': rng.integers(0, 3, rows),
+        'RouteUID': route['RouteUID'].to_numpy(),
+        'RouteName': route['RouteName'].to_numpy(),
+        'SubRouteUID': route['SubRouteUID'].to_numpy(),
+        'SubRouteName': route['SubRouteName'].to_numpy(),
+        'Direction': route['Direction'].to_numpy(),
+        'BoardingStopUID': uid[bi], 'BoardingStopName': name[bi], 'BoardingStopSequence': seq[bi],
+        'BoardingTime': board.strftime('%Y-%m-%d %H:%M:%S'),
+        'DeboardingStopUID': uid[di], 'DeboardingStopName': name[di], 'DeboardingStopSequence': seq[di],
+        'DeboardingTime': deboard.strftime('%Y-%m-%d %H:%M:%S'),
+        'InfoDate': day.strftime('%Y-%m-%d'),
+    })
+
+    def mask(kind):
+        return rng.random(rows) < error_rates.get(kind, 0)
+
+    m = mask('time_reversed')
+    df.loc[m, ['BoardingTime', 'DeboardingTime']] = df.loc[m, ['DeboardingTime', 'BoardingTime']].to_numpy()
+    m = mask('same_stop')
+    df.loc[m, ['DeboardingStopUID', 'DeboardingStopName', 'DeboardingStopSequence']] = \
+        df.loc[m, ['BoardingStopUID', 'BoardingStopName', 'BoardingStopSequence']].to_numpy()
+    m = mask('wrong_sequence')
+    df.loc[m, 'BoardingStopSequence'] += 1
+    m = mask('unknown_stop')
+    df.loc[m, 'BoardingStopUID'] = df.loc[m, 'BoardingStopUID'].str[:3] + 'X' + df.loc[m, 'BoardingStopUID'].str[4:]
+    m = mask('other_direction')
+    df.loc[m, 'Direction'] = 1 - df.loc[m, 'Direction']
+    m = mask('missing_off_time')
+    df.loc[m, 'DeboardingTime'] = np.nan
+    m = mask('missing_off_stop')
+    df.loc[m, ['DeboardingStopUID', 'DeboardingStopName', 'DeboardingStopSequence']] = np.nan
+    return df
+
+def write_to1a_tickets(path: str, network: pd.DataFrame, rows: int, seed: int = 0,
+                       start: str = '2024-10-01', days: int = 61, chunk_rows: int = 1000000,
+                       error_rates: Optional[Dict[str, float]] = None) -> str:
+    """
+    產生 TO1A 格式的原始票證 CSV（第一列為檔頭說明，讀取時 skiprows=1，同 filter_ticket_data）。
+
+    Args:
+        path: 輸出 CSV 路徑
+        network: make_network 的結果
+        rows: 票證筆數
+        seed: 亂數種子（每一批以 (seed, 批次序號) 產生；seed 與 chunk_rows 相同時內容完全相同）
+        start, days: InfoDate 的範圍（start 起 days 天）
+        chunk_rows: 每批產生、寫出的筆數
+        error_rates: 異常比例，預設為 ERROR_RATES
+    """
+    error_rates = ERROR_RATES if error_rates is None else error_rates
+    network = network.sort_values(['RouteUID', 'Direction', 'StopSequence']).reset_index(drop=True)
+    first = network.groupby(['RouteUID', 'Direction'], sort=False).size()
+    legs = {'nstops': first.to_numpy(), 'offset': np.concatenate([[0], np.cumsum(first.to_numpy())[:-1]])}
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write('TO1A 合成票證資料（benchdata）\n')
+        for i, written in enumerate(range(0, rows, chunk_rows)):
+            rng = np.random.default_rng([seed, i])
+            chunk = _ticket_chunk(network, legs, min(chunk_rows, rows - written), rng,
+                                  pd.Timestamp(start), days, error_rates)
+            chunk.reindex(columns=TO1A_COLUMNS).to_csv(f, index=False, header=(i == 0))
+    return path
@@ -0,0 +1,394 @@
+"""
+管線效能基準測試：以 benchdata 產生的合成資料，在不同資料量（預設 100 萬 / 1000 萬 / 1 億筆票證）下執行各階段，
+記錄處理量（每秒筆數）與記憶體峰值，結果附加到 CSV，可以跨版本、跨機器比較。
+
+    python benchmark.py --scales 1000000 10000000
+    python benchmark.py --scales 1000000 --stages filter_ticket_data tickets_cleaning
+    python benchmark.py --compare 舊版結果.csv benchmark_results.csv
+
+每個階段都在獨立的子程序執行，記憶體峰值只包含該階段（含讀取輸入資料）。
+合成資料產生一次後存在 --data 資料夾，之後同樣的資料量與種子直接沿用。
+notebook 內的函數（filter_ticket_data、tickets_cleaning、checkseq ...）以 load_notebook_functions
+從 04_BusTicketAnalysis.ipynb 讀入，只執行 import、函數定義與大寫常數，不會執行 notebook 的處理步驟。
+"""
+
+from __future__ import annotations
+
+import argparse
+import ast
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import pandas as pd
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import benchdata
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+TICKET_NOTEBOOK = os.path.join(REPO_DIR, '04_BusTicketAnalysis.ipynb')
+DEFAULT_SCALES = [1000000, 10000000, 100000000]
+RESULT_PREFIX = 'BENCHMARK '
+RESULT_COLUMNS = ['run_id', 'stage', 'scale', 'rows', 'wall_s', 'compute_s', 'rows_per_s', 'peak_rss_mb', 'status',
+                  'commit', 'machine', 'platform', 'cpu_count', 'python', 'pandas']
+
+# ===== 載入 notebook 函數 =====
+def load_notebook_functions(notebook: str = TICKET_NOTEBOOK) -> Dict[str, Any]:
+    """
+    讀入 notebook 中的 import、函數定義與大寫常數（例如 ERR_TIME、OD_GROUP_COLUMNS），其餘敘述
+    （建立資料夾、刪除 log、執行各階段）一律略過。Jupyter 的 % / ! 指令也會略過。
+
+    Returns:
+        dict: 名稱 → 物件（同 notebook 執行完函數定義後的全域變數）
+    """
+    with open(notebook, encoding='utf-8') as f:
+        cells = json.load(f)['cells']
+
+    namespace: Dict[str, Any] = {'__name__': 'notebook'}
+    for i, cell in enumerate(cells):
+        if cell['cell_type'] != 'code':
+            continue
+        source = ''.join(cell['source'])
+        source = '\n'.join('' if line.lstrip().startswith(('%', '!')) else line for line in source.splitlines())
+        body = [node for node in ast.parse(source).body
+                if isinstance(node, (ast.Import, ast.ImportFrom, ast.FunctionDef))
+                or (isinstance(node, ast.Assign) and all(isinstance(t, ast.Name) and t.id.isupper() for t in node.targets))]
+        exec(compile(ast.Module(body=body, type_ignores=[]), f'{os.path.basename(notebook)}[{i}]', 'exec'), namespace)
+    return namespace
+
+# ===== 合成資料 =====
+def prepare_data(folder: str, scale: int, routes: int = 2000, seed: int = 0) -> Dict[str, str]:
+    """
+    產生（或沿用）基準測試資料：路網站序 / 線形 XML 與 scale 筆 TO1A 票證。
+
+    Returns:
+        dict: seq_xml、shape_xml、tickets 的路徑
+    """
+    os.makedirs(folder, exist_ok=True)
+    tag = f'r{routes}_s{seed}'
+    paths = {
+        'seq_xml': os.path.join(folder, f'BusStopOfRoute_{tag}.xml'),
+        'shape_xml': os.path.join(folder, f'BusShape_{tag}.xml'),
+        'tickets': os.path.join(folder, f'TO1A_{scale}_{tag}.csv'),
+    }
+    network = None
+    for key, write in (('seq_xml', benchdata.write_bus_stop_of_route_xml),
+                       ('shape_xml', benchdata.write_bus_shape_xml),
+                       ('tickets', None)):
+        if os.path.exists(paths[key]):
+            continue
+        if network is None:
+            network = benchdata.make_network(routes, seed=seed)
+        print(f"產生合成資料：{paths[key]}")
+        # 先寫到暫存檔，中斷時不會留下不完整的資料
+        temp = paths[key] + '.tmp'
+        if write is not None:
+            write(network, temp)
+        else:
+            benchdata.write_to1a_tickets(temp, network, scale, seed=seed)
+        os.replace(temp, paths[key])
+    return paths
+
+# ===== 各階段 =====
+def _timed(func: Callable, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def _ticket_chunks(paths: Dict[str, str], chunksize: int):
+    return pd.read_csv(paths['tickets'], skiprows=1, chunksize=chunksize)
+
+def _read_seq(paths: Dict[str, str]) -> pd.DataFrame:
+    """站序資料，Direction 轉為整數（同票證）"""
+    from TDXdataframe import read_bus_stop_of_route_xml
+    seq = read_bus_stop_of_route_xml(paths['seq_xml'], stream=True)
+    seq['Direction'] = pd.to_numeric(seq['Direction'])
+    return seq
+
+def bench_tdx_stopofroute(ns, paths, options):
+    from TDXdataframe import read_bus_stop_of_route_xml
+    return len(read_bus_stop_of_route_xml(paths['seq_xml'])), None
+
+def bench_tdx_stopofroute_stream(ns, paths, options):
+    from TDXdataframe import read_bus_stop_of_route_xml
+    return len(read_bus_stop_of_route_xml(paths['seq_xml'], stream=True)), None
+
+def bench_tdx_busshape(ns, paths, options):
+    from TDXdataframe import read_bus_shape_of_route_xml
+    return len(read_bus_shape_of_route_xml(paths['shape_xml'], stream=True)), None
+
+def bench_filter_ticket_data(ns, paths, options):
+    outputfolder = tempfile.mkdtemp(prefix='bench_', dir=options['data'])
+    try:
+        ns['filter_ticket_data'](paths['tickets'], '2024-10-01', '2024-11-30', outputfolder,
+                                 chunksize=options['chunksize'], storage=options['storage'], workers=options['workers'])
+    finally:
+        shutil.rmtree(outputfolder, ignore_errors=True)
+    return options['scale'], None
+
+def bench_tickets_cleaning(ns, paths, options):
+    rows, compute = 0, 0.0
+    for chunk in _ticket_chunks(paths, options['chunksize']):
+        _, seconds = _timed(ns['tickets_cleaning'], chunk)
+        rows, compute = rows + len(chunk), compute + seconds
+    return rows, compute
+
+def bench_checkseq(ns, paths, options):
+    """原本的三段站序比對：checkseq → matchwithstopname → matchwith_anotherdirection"""
+    df_seq = _read_seq(paths)
+    rows, compute = 0, 0.0
+    for chunk in _ticket_chunks(paths, options['chunksize']):
+        def cascade(df):
+            df_done, df_temp = ns['checkseq'](df, df_seq)
+            df_done, df_temp = ns['matchwithstopname'](df=df_temp, df_seq=df_seq, df_done=df_done)
+            return ns['matchwith_anotherdirection'](df=df_temp, df_seq=df_seq, df_done=df_done)
+        _, seconds = _timed(cascade, chunk.dropna(subset=['DeboardingStopUID']))
+        rows, compute = rows + len(chunk), compute + seconds
+    return rows, compute
+
+def bench_resolve_stopsequence(ns, paths, options):
+    """pre05 目前使用的向量化站序比對（結果同 checkseq 三段比對）"""
+    index = ns['build_stopseq_index'](_read_seq(paths))
+    rows, compute = 0, 0.0
+    for chunk in _ticket_chunks(paths, options['chunksize']):
+        _, seconds = _timed(ns['resolve_stopsequence'], chunk.dropna(subset=['DeboardingStopUID']), index, verbose=False)
+        rows, compute = rows + len(chunk), compute + seconds
+    return rows, compute
+
+def bench_seq_on_and_off_count(ns, paths, options):
+    """
+    分析02 的上下車量與車上人數。seq_on_and_off_count 的輸入路徑寫死在函數內，這裡以同樣的計算核心
+    （count_on_off + sparse_onbus，analytics02_onbus_count 使用的版本）處理票證彙總成的分時計次。
+    """
+    stops = ns['prepare_stop_list'](_read_seq(paths))
+    keys = ['InfoDate', 'BoardingHour', 'DeboardingHour', 'RouteUID', 'SubRouteUID', 'Direction',
+            'BoardingStopSequence', 'DeboardingStopSequence']
+    rows, compute, counts = 0, 0.0, []
+    for chunk in _ticket_chunks(paths, options['chunksize']):
+        def hourly(df):
+            df = df.assign(BoardingHour=pd.to_datetime(df['BoardingTime'], errors='coerce').dt.hour,
+                           DeboardingHour=pd.to_datetime(df['DeboardingTime'], errors='coerce').dt.hour)
+            return df.groupby(keys).size().rename('Count').reset_index()
+        count, seconds = _timed(hourly, chunk)
+        counts.append(count)
+        rows, compute = rows + len(chunk), compute + seconds
+
+    def onoff(df):
+        df = df.groupby(keys)['Count'].sum().reset_index()
+        df = ns['add_weekdayandweekendcolumns'](df)
+        df['Month'] = df['InfoDate'].dt.to_period('M')
+        return ns['sparse_onbus'](ns['count_on_off'](df, stops))
+    _, seconds = _timed(onoff, pd.concat(counts, ignore_index=True))
+    return rows, compute + seconds
+
+def bench_route_geometry(ns, paths, options):
+    """線形整欄解析 + 轉換為 TWD97（routegeometry.route_geometry，不使用快取），筆數為線形數"""
+    from TDXdataframe import read_bus_shape_of_route_xml
+    from routegeometry import route_geometry, TWD97
+    shape = read_bus_shape_of_route_xml(paths['shape_xml'], stream=True)
+    gdf, seconds = _timed(route_geometry, shape, target_crs=TWD97)
+    return len(gdf), seconds
+
+def bench_route_geometry_cached(ns, paths, options):
+    """同 route_geometry，但線形已存在 GeoParquet 快取（先建立快取，只計算第二次讀取的時間）"""
+    from TDXdataframe import read_bus_shape_of_route_xml
+    from routegeometry import route_geometry, TWD97
+    shape = read_bus_shape_of_route_xml(paths['shape_xml'], stream=True)
+    folder = tempfile.mkdtemp(prefix='bench_', dir=options['data'])
+    try:
+        store = os.path.join(folder, 'route_geometry.parquet')
+        route_geometry(shape, target_crs=TWD97, store=store)
+        gdf, seconds = _timed(route_geometry, shape, target_crs=TWD97, store=store)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    return len(gdf), seconds
+
+def bench_route_split(ns, paths, options):
+    """站點投影 + 路線拆分（02_公車路線shp拆分 的 split_routes_by_city），筆數為路段數"""
+    import geopandas as gpd
+    from TDXdataframe import read_bus_shape_of_route_xml
+    from routesplit import split_routes_by_city
+
+    shape = read_bus_shape_of_route_xml(paths['shape_xml'], stream=True)
+    busroute = gpd.GeoDataFrame(shape.drop(columns=['Geometry']),
+                                geometry=gpd.GeoSeries.from_wkt(shape['Geometry']), crs='EPSG:4326')
+    busroute['Direction'] = busroute['Direction'].astype(int)
+    seq = _read_seq(paths)
+    seq = gpd.GeoDataFrame(seq, geometry=gpd.points_from_xy(seq['PositionLon'], seq['PositionLat']), crs='EPSG:4326')
+    (_, segments), seconds = _timed(split_routes_by_city, busroute, seq, max_workers=options['workers'])
+    return len(segments), seconds
+
+STAGES: Dict[str, Callable] = {
+    'tdx_stopofroute': bench_tdx_stopofroute,
+    'tdx_stopofroute_stream': bench_tdx_stopofroute_stream,
+    'tdx_busshape': bench_tdx_busshape,
+    'filter_ticket_data': bench_filter_ticket_data,
+    'tickets_cleaning': bench_tickets_cleaning,
+    'checkseq': bench_checkseq,
+    'resolve_stopsequence': bench_resolve_stopsequence,
+    'seq_on_and_off_count': bench_seq_on_and_off_count,
+    'route_geometry': bench_route_geometry,
+    'route_geometry_cached': bench_route_geometry_cached,
+    'route_split': bench_route_split,
+}
+# 只跟路網大小（--routes）有關、與票證筆數無關的階段，只在第一個資料量執行
+NETWORK_STAGES = ['tdx_stopofroute', 'tdx_stopofroute_stream', 'tdx_busshape', 'route_geometry', 'route_geometry_cached',
+                  'route_split']
+
+# ===== 執行 =====
+def _peak_rss_mb() -> Optional[float]:
+    """
+    目前程序的記憶體峰值（MB）。Linux 讀 /proc/self/status 的 VmHWM（resource 的 ru_maxrss 會沿用父程序的峰值，
+    不適合子程序），Windows 以 psutil 的 peak_wset，其他平台以 ru_maxrss。
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 2**10, 1)
+    except OSError:
+        pass
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / 2**20, 1)
+    except (ImportError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (2**20 if sys.platform == 'darwin' else 2**10), 1)
+    except ImportError:
+        return None
+
+def run_stage(stage: str, paths: Dict[str, str], options: Dict[str, Any]) -> Dict[str, Any]:
+    """在目前的程序執行一個階段（子程序的進入點），回傳筆數、時間與記憶體峰值"""
+    ns = load_notebook_functions()
+    start = time.perf_counter()
+    rows, compute = STAGES[stage](ns, paths, options)
+    wall = time.perf_counter() - start
+    return {
+        'stage': stage, 'scale': options['scale'], 'rows': rows,
+        'wall_s': round(wall, 3), 'compute_s': round(compute, 3) if compute is not None else None,
+        'rows_per_s': round(rows / (compute or wall), 1) if (compute or wall) > 0 else None,
+        'peak_rss_mb': _peak_rss_mb(), 'status': 'ok',
+    }
+
+def _machine_info() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit, 'machine': platform.node(), 'platform': platform.platform(),
+        'cpu_count': os.cpu_count(), 'python': platform.python_version(), 'pandas': pd.__version__,
+    }
+
+def run_benchmarks(scales: List[int] = DEFAULT_SCALES, stages: Optional[List[str]] = None,
+                   data: str = 'benchmark_data', output: str = 'benchmark_results.csv',
+                   routes: int = 2000, seed: int = 0, chunksize: int = 100000, storage: str = 'csv',
+                   workers: int = 1, timeout: Optional[float] = None) -> pd.DataFrame:
+    """
+    依序在每個資料量執行各階段（每個階段一個子程序），結果附加到 output。
+    NETWORK_STAGES 只在第一個資料量執行。
+
+    Args:
+        scales: 票證筆數
+        stages: 要執行的階段（STAGES 的鍵），None 代表全部
+        data: 合成資料資料夾
+        output: 結果 CSV（已存在時附加）
+        routes, seed: 合成路網的路線數與亂數種子
+        chunksize: 分批讀取票證的筆數
+        storage: filter_ticket_data 的輸出格式（'csv' 或 'parquet'）
+        workers: route_split 的程序數
+        timeout: 每個階段的時間上限（秒），超過記為 timeout
+
+    Returns:
+        pd.DataFrame: 本次的結果
+    """
+    stages = list(STAGES) if stages is None else stages
+    data, output = os.path.abspath(data), os.path.abspath(output)
+    run_id = datetime.now().strftime('%Y%m%d-%H%M%S')
+    info = _machine_info()
+    records = []
+    for i, scale in enumerate(scales):
+        paths = prepare_data(data, scale, routes=routes, seed=seed)
+        for stage in stages:
+            if i > 0 and stage in NETWORK_STAGES:
+                continue
+            options = {'scale': scale, 'data': data, 'chunksize': chunksize, 'storage': storage, 'workers': workers}
+            command = [sys.executable, os.path.abspath(__file__), '--worker', stage,
+                       '--paths', json.dumps(paths), '--options', json.dumps(options)]
+            record = {'stage': stage, 'scale': scale}
+            try:
+                result = subprocess.run(command, cwd=REPO_DIR, capture_output=True, text=True, timeout=timeout)
+                lines = [l for l in result.stdout.splitlines() if l.startswith(RESULT_PREFIX)]
+                if result.returncode == 0 and lines:
+                    record = json.loads(lines[-1][len(RESULT_PREFIX):])
+                else:
+                    record['status'] = f'error: {result.stderr.strip().splitlines()[-1] if result.stderr.strip() else result.returncode}'
+            except subprocess.TimeoutExpired:
+                record['status'] = 'timeout'
+            record = {'run_id': run_id, **record, **info}
+            records.append(record)
+            print(f"{scale:>12,} {stage:<24} {record.get('status')}  "
+                  f"{record.get('rows_per_s') or '-'} rows/s  {record.get('peak_rss_mb') or '-'} MB")
+
+    df = pd.DataFrame(records).reindex(columns=RESULT_COLUMNS)
+    df.to_csv(output, mode='a', index=False, header=not os.path.exists(output), encoding='utf-8-sig')
+    return df
+
+def compare_results(baseline: str, current: str, tolerance: float = 0.2) -> pd.DataFrame:
+    """
+    比較兩份結果（各取每個階段、資料量最新一次的 run），處理量下降或記憶體峰值增加超過 tolerance 標記為 regression。
+
+    Returns:
+        pd.DataFrame: stage、scale、兩次的 rows_per_s / peak_rss_mb、變化比例與 regression
+    """
+    def latest(path):
+        df = pd.read_csv(path, encoding='utf-8-sig')
+        df = df[df['status'] == 'ok']
+        return df.sort_values('run_id').drop_duplicates(subset=['stage', 'scale'], keep='last')
+
+    columns = ['stage', 'scale', 'rows_per_s', 'peak_rss_mb']
+    df = latest(baseline)[columns].merge(latest(current)[columns], on=['stage', 'scale'], suffixes=('_base', '_new'))
+    df['throughput_change'] = (df['rows_per_s_new'] / df['rows_per_s_base'] - 1).round(3)
+    df['memory_change'] = (df['peak_rss_mb_new'] / df['peak_rss_mb_base'] - 1).round(3)
+    df['regression'] = (df['throughput_change'] < -tolerance) | (df['memory_change'] > tolerance)
+    return df.sort_values(['stage', 'scale']).reset_index(drop=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='票證管線效能基準測試（合成資料）')
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES, help='票證筆數')
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), help='要執行的階段，預設全部')
+    parser.add_argument('--data', default='benchmark_data', help='合成資料資料夾')
+    parser.add_argument('--output', default='benchmark_results.csv', help='結果 CSV（附加）')
+    parser.add_argument('--routes', type=int, default=2000, help='合成路網的路線數')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunksize', type=int, default=100000)
+    parser.add_argument('--storage', choices=['csv', 'parquet'], default='csv')
+    parser.add_argument('--workers', type=int, default=1, help='route_split、filter_ticket_data 的程序數')
+    parser.add_argument('--timeout', type=float, help='每個階段的時間上限（秒）')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), help='比較兩份結果 CSV')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='--compare 視為 regression 的變化比例')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--paths', help=argparse.SUPPRESS)
+    parser.add_argument('--options', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        result = run_stage(args.worker, json.loads(args.paths), json.loads(args.options))
+        print(RESULT_PREFIX + json.dumps(result))
+    elif args.compare:
+        df = compare_results(*args.compare, tolerance=args.tolerance)
+        print(df.to_string(index=False))
+        sys.exit(1 if df['regression'].any() else 0)
+    else:
+        run_benchmarks(args.scales, args.stages, data=args.data, output=args.output, routes=args.routes,
+                       seed=args.seed, chunksize=args.chunksize, storage=args.storage,
+                       workers=args.workers, timeout=args.timeout)
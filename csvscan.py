@@ -0,0 +1,183 @@
+"""
+單一大型 CSV 的平行掃描：把檔案切成數個以換行對齊的位元組區段，各區段交給 ProcessPool 分別讀取、篩選，
+寫成依區段順序編號的 part 檔，最後可以依序串接成一個輸出檔。
+
+原始票證（TO1A）每個檔案都是單一個數 GB 的 CSV，逐批 read_csv 只用到一個核心；
+切成區段後同一個檔案的讀取與篩選可以隨核心數增加而加快。
+
+限制：區段以換行切開，欄位內容不可以包含換行（TO1A 票證沒有這種欄位）。
+
+    result = scan_csv_parallel(path, filter_date_range, partfolder, skiprows=1, workers=8,
+                               column='InfoDate', start='2024-10-01', end='2024-11-30')
+    merge_csv_parts(result['parts'], result['columns'], outputpath)
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from io import BytesIO
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from runmanifest import update_partitions, merge_partitions
+
+RANGE_BYTES = 64 * 1024 * 1024   # 每個區段的大小上限（每個工作一次讀入記憶體的位元組數）
+
+# ===== 切分區段 =====
+def csv_data_start(path: str, skiprows: int = 0) -> int:
+    """第一筆資料列的位元組位置（跳過 skiprows 列與標題列）"""
+    with open(path, 'rb') as f:
+        for _ in range(skiprows + 1):
+            f.readline()
+        return f.tell()
+
+def split_byte_ranges(path: str, n_ranges: int, start: int = 0, end: Optional[int] = None) -> List[Tuple[int, int]]:
+    """
+    把 [start, end) 切成約 n_ranges 個區段，每個區段的邊界都移到下一個換行之後（區段只包含完整的資料列）。
+
+    Args:
+        start: 第一筆資料列的位置（csv_data_start，或增量處理時上次讀到的位置）
+        end: 結束位置，None 代表檔案結尾
+
+    Returns:
+        list: [(區段開始, 區段結束), ...]，依檔案順序排列、彼此相接、沒有空區段
+    """
+    end = os.path.getsize(path) if end is None else end
+    if start >= end:
+        return []
+
+    bounds = [start]
+    with open(path, 'rb') as f:
+        for guess in np.linspace(start, end, max(n_ranges, 1) + 1)[1:-1].astype(np.int64):
+            if guess <= bounds[-1]:
+                continue
+            f.seek(guess - 1)
+            f.readline()   # 從前一個位元組開始找換行，guess 剛好在列首時邊界不動
+            bound = min(f.tell(), end)
+            if bound > bounds[-1]:
+                bounds.append(bound)
+    if bounds[-1] < end:
+        bounds.append(end)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+# ===== 區段處理 =====
+def _scan_range(task: Tuple[int, int, int], path: str, columns: Sequence[str], func: Callable, partfolder: str,
+                chunksize: Optional[int], encoding: Optional[str], partition_column: Optional[str], func_kwargs: Dict[str, Any]):
+    """
+    讀取一個區段、套用 func，結果以同一個檔案 handle 寫成 part 檔（沒有標題列）。需放在模組層才能給 ProcessPool 使用。
+    區段已經整段讀進記憶體，chunksize 為 None 時整段一次 read_csv。
+
+    Returns:
+        dict: part 檔路徑（沒有資料時為 None）、讀取 / 輸出筆數、批數、讀取位元組數與分區紀錄
+    """
+    index, begin, stop = task
+    with open(path, 'rb') as f:
+        f.seek(begin)
+        data = f.read(stop - begin)
+
+    part = os.path.join(partfolder, f'part-{index:05d}.csv')
+    result = {'part': None, 'rows_in': 0, 'rows_out': 0, 'chunks': 0, 'bytes_read': len(data), 'partitions': {}}
+    reader = pd.read_csv(BytesIO(data), header=None, names=list(columns), chunksize=chunksize, encoding=encoding)
+    out = None
+    try:
+        for chunk in ([reader] if chunksize is None else reader):
+            result['rows_in'] += len(chunk)
+            result['chunks'] += 1
+            chunk = func(chunk, **func_kwargs)
+            if chunk is None or chunk.empty:
+                continue
+            if out is None:
+                out = open(part, 'w', encoding='utf-8', newline='')
+                result['part'] = part
+            chunk.to_csv(out, header=False, index=False)
+            result['rows_out'] += len(chunk)
+            if partition_column is not None:
+                update_partitions(result['partitions'], chunk, partition_column)
+    finally:
+        if out is not None:
+            out.close()
+    return result
+
+def scan_csv_parallel(path: str, func: Callable, partfolder: str, workers: Optional[int] = None,
+                      offset: int = 0, skiprows: int = 0, chunksize: Optional[int] = None, range_bytes: int = RANGE_BYTES,
+                      encoding: Optional[str] = None, partition_column: Optional[str] = None, **func_kwargs) -> Dict[str, Any]:
+    """
+    平行讀取單一 CSV，逐批套用 func（例如 filter_date_range）後寫成依區段順序編號的 part 檔。
+
+    Args:
+        path: CSV 路徑
+        func: func(chunk, **func_kwargs) → 篩選後的 DataFrame；需定義在模組層（ProcessPool 需要 pickle）
+        partfolder: part 檔資料夾（part-00000.csv, part-00001.csv ...，沒有標題列、UTF-8 無 BOM）
+        workers: 行程數，None 代表所有 CPU 核心
+        offset: 從這個位元組位置開始讀（增量處理用，同 read_csv_from_offset）；0 代表從第一筆資料列開始
+        skiprows: 標題列前要跳過的列數（原始票證為 1）
+        chunksize: 每個區段內每批筆數；None（預設）代表整個區段一次解析（區段大小由 range_bytes 控制）
+        range_bytes: 每個區段的大小上限，區段數至少等於 workers
+        partition_column: 指定時以 update_partitions 記錄篩選後資料的分區（給 runmanifest 使用）
+
+    Returns:
+        dict:
+            parts: 依檔案順序排列的 part 檔（沒有資料的區段不列入）
+            columns: 標題列的欄位名稱
+            rows_in, rows_out, chunks, bytes_read: 合計
+            partitions: 篩選後資料的分區紀錄（partition_column 為 None 時為空）
+            end: 實際讀到的位元組位置，下次由此接續（同 read_csv_from_offset 的 position['end']）
+    """
+    workers = workers or os.cpu_count() or 1
+    columns = list(pd.read_csv(path, skiprows=skiprows, nrows=0, encoding=encoding).columns)
+    start = offset if offset > 0 else csv_data_start(path, skiprows)
+    end = os.path.getsize(path)   # 掃描期間才附加的資料留給下一次
+    n_ranges = max(workers, -(-(end - start) // range_bytes))
+    tasks = [(i, begin, stop) for i, (begin, stop) in enumerate(split_byte_ranges(path, n_ranges, start, end))]
+
+    os.makedirs(partfolder, exist_ok=True)
+    scan = partial(_scan_range, path=path, columns=columns, func=func, partfolder=partfolder, chunksize=chunksize,
+                   encoding=encoding, partition_column=partition_column, func_kwargs=func_kwargs)
+    if workers <= 1 or len(tasks) <= 1:
+        results = [scan(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+            # executor.map 依區段順序回傳，part 檔順序即原始檔案順序
+            results = list(executor.map(scan, tasks))
+
+    summary = {'parts': [r['part'] for r in results if r['part'] is not None], 'columns': columns,
+               'partitions': {}, 'end': max(start, end)}
+    for key in ('rows_in', 'rows_out', 'chunks', 'bytes_read'):
+        summary[key] = sum(r[key] for r in results)
+    for r in results:
+        summary['partitions'] = merge_partitions(summary['partitions'], r['partitions'])
+    return summary
+
+def filter_date_range(chunk: pd.DataFrame, column: str, start, end) -> pd.DataFrame:
+    """日期篩選（同 filter_ticket_data）：column 轉為日期後保留 start ~ end（含）之間的資料列"""
+    chunk[column] = pd.to_datetime(chunk[column], errors='coerce')
+    return chunk[(chunk[column] >= pd.to_datetime(start)) & (chunk[column] <= pd.to_datetime(end))]
+
+# ===== 合併輸出 =====
+def merge_csv_parts(parts: Sequence[str], columns: Sequence[str], outputpath: str, append: bool = False,
+                    remove: bool = True) -> int:
+    """
+    依序串接 part 檔成一個 CSV（格式同 stage_writer：UTF-8 BOM + 標題列），不重新解析內容。
+
+    Args:
+        append: True 時接在既有的輸出後面（不再寫標題列），同 stage_writer(append=True)
+        remove: 串接後刪除 part 檔
+
+    Returns:
+        int: 寫入的位元組數
+    """
+    append = append and os.path.exists(outputpath) and os.path.getsize(outputpath) > 0
+    before = os.path.getsize(outputpath) if append else 0
+    if not append:
+        pd.DataFrame(columns=list(columns)).to_csv(outputpath, index=False, encoding='utf-8-sig')
+    with open(outputpath, 'ab') as out:
+        for part in parts:
+            with open(part, 'rb') as f:
+                shutil.copyfileobj(f, out, 16 * 1024 * 1024)
+            if remove:
+                os.remove(part)
+    return os.path.getsize(outputpath) - before
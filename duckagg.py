@@ -0,0 +1,182 @@
+"""
+以內嵌的 DuckDB 直接對中間階段資料（csv 檔案 / parquet 資料夾）做分組計次，不必先把所有票證讀進 pandas。
+DuckDB 會多執行緒掃描檔案，記憶體不足時分組結果會暫存到 temp_directory，處理的月份數不再受限於記憶體。
+
+輸出的欄位、缺值（'-99'）與數值格式同 pandas 版本（analytics01_hourlycount），只有列的順序改為依分組欄位排序。
+需另外安裝 duckdb（pip install duckdb），只有選用 backend='duckdb' 時才會載入。
+"""
+
+from __future__ import annotations
+
+import os
+import pandas as pd
+from typing import Any, Iterable, List, Optional, Sequence, Tuple
+
+MISSING_KEY = '-99'
+HIVE_DEFAULT_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+STAGE_PARTITION_COLUMNS = ['InfoDate', 'Authority']
+
+# ===== 連線 =====
+def connect(threads: Optional[int] = None, memory_limit: Optional[str] = None, temp_directory: Optional[str] = None):
+    """
+    建立 DuckDB 連線（記憶體內資料庫）。
+
+    Args:
+        threads: 使用的執行緒數，None 代表所有 CPU 核心
+        memory_limit: 記憶體上限，例如 '8GB'；超過時分組結果寫到 temp_directory
+        temp_directory: 暫存資料夾
+    """
+    try:
+        import duckdb
+    except ImportError as e:
+        raise ImportError("backend='duckdb' 需要安裝 duckdb：pip install duckdb") from e
+
+    con = duckdb.connect()
+    if threads is not None:
+        con.execute(f"SET threads = {int(threads)}")
+    if memory_limit is not None:
+        con.execute(f"SET memory_limit = {quote(memory_limit)}")
+    if temp_directory is not None:
+        os.makedirs(temp_directory, exist_ok=True)
+        con.execute(f"SET temp_directory = {quote(temp_directory)}")
+    return con
+
+def quote(value: Any) -> str:
+    """SQL 字串常值"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+def ident(name: str) -> str:
+    """SQL 欄位名稱"""
+    return '"' + name.replace('"', '""') + '"'
+
+# ===== 讀取中間階段資料 =====
+def stage_source_sql(path: str, columns: Sequence[str], filepath: bool = True) -> str:
+    """
+    讀取一份中間階段資料的 SELECT。CSV 一律以文字讀取（保留檔案中的原始寫法，例如 3.0），
+    Parquet 依分區資料夾（Hive）取得 InfoDate/Authority，__HIVE_DEFAULT_PARTITION__ 轉回缺值。
+    filepath 為 True 時加上 FilePath 欄位（值同 read_combined_dataframe 的 FilePath）。
+    """
+    if path.endswith('.parquet'):
+        source = (f"read_parquet({quote(os.path.join(path, '**', '*.parquet'))}, "
+                  f"hive_partitioning = true, hive_types_autocast = false, union_by_name = true)")
+        select = [f"NULLIF({ident(c)}, {quote(HIVE_DEFAULT_PARTITION)}) AS {ident(c)}" if c in STAGE_PARTITION_COLUMNS
+                  else ident(c) for c in columns]
+    else:
+        source = f"read_csv({quote(path)}, header = true, all_varchar = true)"
+        select = [ident(c) for c in columns]
+    if filepath:
+        select.append(f"{quote(path)} AS FilePath")
+    return f"SELECT {', '.join(select)} FROM {source}"
+
+def filters_to_sql(filters: Optional[Iterable[Tuple[str, str, Any]]]) -> str:
+    """
+    filters（同 iter_stage_chunks：[(欄位, 運算子, 值), ...]，全部條件取交集）轉為 WHERE 條件。
+    值為數字時以數值比較（CSV 以文字讀取，需先轉型），否則以文字比較。
+    """
+    conditions = []
+    for col, op, value in filters or []:
+        values = list(value) if op in ('in', 'not in') else [value]
+        numeric = all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values)
+        column = f"TRY_CAST({ident(col)} AS DOUBLE)" if numeric else f"CAST({ident(col)} AS VARCHAR)"
+        literals = [repr(float(v)) if numeric else quote(v) for v in values]
+        if op in ('=', '=='):
+            conditions.append(f"{column} = {literals[0]}")
+        elif op in ('!=', '<', '<=', '>', '>='):
+            conditions.append(f"{column} {op} {literals[0]}")
+        elif op == 'in':
+            conditions.append(f"{column} IN ({', '.join(literals) or 'NULL'})")
+        elif op == 'not in':
+            conditions.append(f"({column} NOT IN ({', '.join(literals) or 'NULL'}) OR {column} IS NULL)")
+        else:
+            raise ValueError(f"Unsupported filter operator: {op}")
+    return ' AND '.join(conditions) if conditions else 'TRUE'
+
+def stages_sql(files: Sequence[str], columns: Sequence[str], filters=None) -> str:
+    """多份中間階段資料合併（UNION ALL）並套用 filters"""
+    parts = [stage_source_sql(f, columns) for f in files]
+    return f"SELECT * FROM ({' UNION ALL BY NAME '.join(parts)}) WHERE {filters_to_sql(filters)}"
+
+# ===== 分組計次 =====
+def _key_sql(columns: Sequence[str]) -> List[str]:
+    """分組欄位一律轉為文字，缺值為 '-99'（同 pandas 版本的 fillna('-99') / encode_keys）"""
+    return [f"COALESCE(CAST({ident(c)} AS VARCHAR), {quote(MISSING_KEY)}) AS {ident(c)}" for c in columns]
+
+def hourlycount_duckdb(files: Sequence[str], df_stops: pd.DataFrame, outputfile: str,
+                       groupbycolumns: Sequence[str], outputcolumns: Sequence[str], filters=None,
+                       con=None, **connect_kwargs) -> int:
+    """
+    analytics01_hourlycount 的 DuckDB 版本：分組計次、加上上下車站點經緯度後直接寫出 CSV。
+
+    Args:
+        files: 04_計算交通量格式 的中間階段資料（csv 檔案或 parquet 資料夾）
+        df_stops: 站點經緯度（StopUID、PositionLon、PositionLat，StopUID 不重複）
+        outputfile: 輸出 CSV
+        groupbycolumns: 分組欄位（含 FilePath）
+        outputcolumns: 輸出欄位與順序（BoardingLon/Lat、DeboardingLon/Lat 由 df_stops 對應）
+        filters: [(欄位, 運算子, 值), ...]
+        con: 既有的 DuckDB 連線，None 時以 connect(**connect_kwargs) 建立
+
+    Returns:
+        int: 輸出筆數
+    """
+    own = con is None
+    con = connect(**connect_kwargs) if own else con
+    try:
+        con.register('stops', df_stops[['StopUID', 'PositionLon', 'PositionLat']].astype({'StopUID': str}))
+        readcolumns = [c for c in groupbycolumns if c != 'FilePath']
+
+        coordinates = {
+            'BoardingLon': 'b.PositionLon', 'BoardingLat': 'b.PositionLat',
+            'DeboardingLon': 'd.PositionLon', 'DeboardingLat': 'd.PositionLat',
+        }
+        select = [coordinates.get(c, f"c.{ident(c)}" if c in groupbycolumns or c == 'Count' else 'NULL') + f" AS {ident(c)}"
+                  for c in outputcolumns]
+        sql = f"""
+            WITH tickets AS ({stages_sql(files, readcolumns, filters)}),
+            counts AS (
+                SELECT {', '.join(_key_sql(groupbycolumns))}, COUNT(*) AS Count
+                FROM tickets GROUP BY ALL
+            )
+            SELECT {', '.join(select)}
+            FROM counts c
+            LEFT JOIN stops b ON c.BoardingStopUID = b.StopUID
+            LEFT JOIN stops d ON c.DeboardingStopUID = d.StopUID
+            ORDER BY {', '.join(f'c.{ident(k)}' for k in groupbycolumns)}
+        """
+        con.execute(f"COPY ({sql}) TO {quote(outputfile)} (FORMAT csv, HEADER)")
+        return con.execute(f"SELECT COUNT(*) FROM read_csv({quote(outputfile)}, header = true, all_varchar = true)").fetchone()[0]
+    finally:
+        con.unregister('stops')
+        if own:
+            con.close()
+
+def odcount_duckdb(hourlycount_file: str, outputfile: str, groupbycolumns: Sequence[str],
+                   value: str = 'Count', con=None, **connect_kwargs) -> int:
+    """
+    以分時計次（analytics01 的輸出）彙總起訖量：依 groupbycolumns 加總 value。
+    groupbycolumns 可以包含 'Month'（由 InfoDate 取 YYYY-MM）。鍵值以文字分組、依文字排序，同 pandas 版本。
+
+    Returns:
+        int: 輸出筆數
+    """
+    own = con is None
+    con = connect(**connect_kwargs) if own else con
+    try:
+        derived = {'Month': "substr(CAST(InfoDate AS VARCHAR), 1, 7)"}
+        keys = [f"{derived[c]} AS {ident(c)}" if c in derived else ident(c) for c in groupbycolumns]
+        sql = f"""
+            SELECT * FROM (
+                SELECT {', '.join(ident(c) for c in groupbycolumns)}, SUM(TRY_CAST({ident(value)} AS BIGINT)) AS {ident(value)}
+                FROM (
+                    SELECT {', '.join(keys)}, {ident(value)}
+                    FROM read_csv({quote(hourlycount_file)}, header = true, all_varchar = true)
+                )
+                GROUP BY ALL
+            )
+            ORDER BY {', '.join(f"COALESCE({ident(c)}, '')" for c in groupbycolumns)}
+        """
+        con.execute(f"COPY ({sql}) TO {quote(outputfile)} (FORMAT csv, HEADER)")
+        return con.execute(f"SELECT COUNT(*) FROM read_csv({quote(outputfile)}, header = true, all_varchar = true)").fetchone()[0]
+    finally:
+        if own:
+            con.close()
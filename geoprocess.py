@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from functools import lru_cache
+from pyproj import CRS, Transformer
+from typing import Tuple
+
+# ===== 座標轉換 =====
+@lru_cache(maxsize=None)
+def _transformer(crs: str, target_crs: str) -> Transformer:
+    """同一組座標系統只建立一次 Transformer（always_xy：x = 經度、y = 緯度，同 GeoDataFrame.to_crs）"""
+    return Transformer.from_crs(CRS.from_user_input(crs), CRS.from_user_input(target_crs), always_xy=True)
+
+def transform_xy(x, y, crs: str = "EPSG:4326", target_crs: str = "EPSG:3826") -> Tuple[np.ndarray, np.ndarray]:
+    """座標陣列轉換座標系統，crs 與 target_crs 相同時直接回傳"""
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    if CRS.from_user_input(crs) == CRS.from_user_input(target_crs):
+        return x, y
+    return _transformer(crs, target_crs).transform(x, y)
+
+# ===== 建立幾何 =====
+def dataframe_to_point(df: pd.DataFrame, lon_col: str, lat_col: str,
+                       crs: str = "EPSG:4326", target_crs: str = "EPSG:3826") -> gpd.GeoDataFrame:
+    '''
+    Parameters:
+    df (dataframe) : 含經緯度座標欄位的dataframe
+    lon_col (str) : 經度欄位
+    lat_col (str) : 緯度欄位
+    crs (str) : 目前經緯度座標的座標系統，常用的為4326(WGS84)、3826(TWD97)
+    target_crs：目標轉換的座標系統
+
+    先轉換座標陣列，再以 points_from_xy 一次建立點位（不逐筆建立 Point，也不需要再 to_crs）
+    '''
+    x, y = transform_xy(df[lon_col].to_numpy(), df[lat_col].to_numpy(), crs=crs, target_crs=target_crs)
+    return gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(x, y), crs=target_crs)
+
+def get_line(df: pd.DataFrame, x1: str = 'Lon_o', x2: str = 'Lon_d', y1: str = 'Lat_o', y2: str = 'Lat_d',
+             target_crs: str = "EPSG:3826") -> gpd.GeoDataFrame:
+    '''
+    Parameters:
+    df (dataframe) : 含經緯度座標欄位的dataframe
+    x1 (str) : 起點經度欄位
+    y1 (str) : 起點緯度欄位
+    x2 (str) : 迄點經度欄位
+    y2 (str) : 迄點緯度欄位
+
+    預設立場：輸入為wgs84的經緯度點位
+    起訖點座標先轉為 target_crs，再以 shapely.linestrings 從 (n, 2, 2) 座標陣列一次建立所有線段
+    '''
+    xo, yo = transform_xy(df[x1].to_numpy(), df[y1].to_numpy(), crs="EPSG:4326", target_crs=target_crs)
+    xd, yd = transform_xy(df[x2].to_numpy(), df[y2].to_numpy(), crs="EPSG:4326", target_crs=target_crs)
+    coords = np.stack([np.column_stack([xo, yo]), np.column_stack([xd, yd])], axis=1)
+    return gpd.GeoDataFrame(df, geometry=shapely.linestrings(coords), crs=target_crs)
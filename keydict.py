@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import json
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, List, Optional
+
+MISSING_KEY = '-99'
+
+# 票證欄位 → 共用的字典（上、下車站點共用同一份 StopUID / StopName 字典，代碼可以直接比對）
+KEY_DOMAINS = {
+    'RouteUID': 'RouteUID',
+    'SubRouteUID': 'SubRouteUID',
+    'RouteName': 'RouteName',
+    'RouteName_Zh': 'RouteName',
+    'SubRouteName': 'SubRouteName',
+    'SubRouteName_Zh': 'SubRouteName',
+    'StopUID': 'StopUID',
+    'BoardingStopUID': 'StopUID',
+    'DeboardingStopUID': 'StopUID',
+    'StopName': 'StopName',
+    'StopName_Zh': 'StopName',
+    'BoardingStopName': 'StopName',
+    'DeboardingStopName': 'StopName',
+    'Authority': 'Authority',
+    'HolderType': 'HolderType',
+}
+
+# TDX 站序資料中用來建立字典的欄位
+SEQ_DICTIONARY_COLUMNS = ['RouteUID', 'SubRouteUID', 'RouteName_Zh', 'SubRouteName_Zh', 'StopUID', 'StopName_Zh']
+
+def _domain(column: str) -> str:
+    return KEY_DOMAINS.get(column, column)
+
+def _sorted_index(values: Iterable) -> pd.Index:
+    """排序後的字典：類別順序與文字排序一致，分組結果的順序與原本以文字分組相同"""
+    return pd.Index(pd.unique(pd.Series(list(values), dtype=object).dropna())).sort_values()
+
+# ===== 鍵值工具（odmatrix、screenline、stopmatch 共用）=====
+def as_key(s: pd.Series) -> pd.Series:
+    """鍵值統一為文字（3 與 3.0 視為相同、缺值為 MISSING_KEY），與 CSV 內容一致；只轉換不重複的值"""
+    codes, uniques = pd.factorize(s)
+    keys = pd.Series(np.asarray(uniques).astype(str)).str.replace(r'^(-?\d+)\.0$', r'\1', regex=True)
+    return pd.Series(np.append(keys.to_numpy(dtype=object), MISSING_KEY)[codes], index=s.index)
+
+def concat_ranges(lengths: np.ndarray) -> np.ndarray:
+    """串接多個 arange(length)（CSR 指標展開成每個元素在所屬區段內的位置）"""
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+# ===== 字典 =====
+def build_key_dictionary(df_seq: Optional[pd.DataFrame] = None) -> Dict[str, pd.Index]:
+    """
+    以 TDX 站序資料建立票證鍵值字典（RouteUID、SubRouteUID、路線名稱、StopUID、站名），每個字典都包含 '-99'。
+    票證中出現、但站序資料沒有的值會在 encode_keys 時自動加入。
+
+    Returns:
+        dict: {字典名稱: 排序後的 pd.Index}
+    """
+    dictionary = {}
+    if df_seq is not None:
+        for col in SEQ_DICTIONARY_COLUMNS:
+            if col in df_seq.columns:
+                domain = _domain(col)
+                values = df_seq[col].dropna().astype(str).unique()
+                dictionary[domain] = _sorted_index(list(dictionary.get(domain, [])) + list(values) + [MISSING_KEY])
+    return dictionary
+
+def save_key_dictionary(dictionary: Dict[str, pd.Index], path: str) -> str:
+    """字典存成 JSON，之後的階段以 load_key_dictionary 讀回，代碼保持一致"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({k: v.tolist() for k, v in dictionary.items()}, f, ensure_ascii=False)
+    return path
+
+def load_key_dictionary(path: str) -> Dict[str, pd.Index]:
+    with open(path, 'r', encoding='utf-8') as f:
+        return {k: pd.Index(v, dtype=object) for k, v in json.load(f).items()}
+
+# ===== 編碼 / 解碼 =====
+def encode_keys(df: pd.DataFrame, dictionary: Dict[str, pd.Index], columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    將文字鍵值欄位轉為整數代碼的 Categorical（缺值為 '-99'，同原本的 fillna('-99')）。
+    字典中沒有的值會先加入字典（dictionary 會被更新），同一字典的欄位共用相同類別，可直接以代碼分組或合併。
+    每個欄位只 factorize 一次，再把代碼對應到字典的位置。
+
+    Args:
+        df: 要轉換的資料
+        dictionary: build_key_dictionary / load_key_dictionary 的結果
+        columns: 要轉換的欄位，None 代表所有文字欄位（數值欄位維持原本的型別）
+
+    Returns:
+        pd.DataFrame: 轉換後的資料（新的 DataFrame）
+    """
+    if columns is None:
+        columns = [c for c in df.columns if df[c].dtype == object]
+        only_strings = True
+    else:
+        only_strings = False
+
+    # 1. 每個欄位各自 factorize（缺值代碼為 -1）
+    factorized = {}
+    for col in columns:
+        codes, uniques = pd.factorize(df[col])
+        if only_strings and pd.api.types.infer_dtype(uniques, skipna=True) not in ('string', 'empty'):
+            continue
+        factorized[col] = (codes, pd.Index(uniques, dtype=object))
+
+    # 2. 先把所有欄位的新值加入字典，確保共用字典的欄位類別完全相同
+    for col, (_, uniques) in factorized.items():
+        domain = _domain(col)
+        known = dictionary.get(domain, pd.Index([MISSING_KEY], dtype=object))
+        new = uniques[~uniques.isin(known)]
+        if len(new) or domain not in dictionary:
+            dictionary[domain] = _sorted_index(list(known) + list(new))
+
+    # 3. factorize 的代碼 → 字典的位置（-1 取到最後一個元素，也就是 '-99' 的位置）
+    df = df.copy()
+    for col, (codes, uniques) in factorized.items():
+        categories = dictionary[_domain(col)]
+        lookup = np.append(categories.get_indexer(uniques), categories.get_loc(MISSING_KEY))
+        df[col] = pd.Categorical.from_codes(lookup[codes], categories=categories)
+    return df
+
+def decode_keys(df: pd.DataFrame, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """輸出前將 Categorical 欄位轉回文字"""
+    if columns is None:
+        columns = [c for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)]
+    for col in columns:
+        df[col] = df[col].astype(object)
+    return df
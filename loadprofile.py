@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import numpy as np
+import os
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional
+
+STOP_KEY_COLUMNS = ['RouteUID', 'SubRouteUID', 'Direction']
+LOAD_GROUP_COLUMNS = ['RouteUID', 'SubRouteUID', 'Direction', 'Month', 'WDWK', 'Hour']
+
+# ===== 站序 =====
+def prepare_stop_list(df_seq: pd.DataFrame) -> pd.DataFrame:
+    """
+    整理 TDX 站序資料為站間量使用的站點清單（同 seq_withhour 的欄位整理與去重，但不與月份/小時交叉展開）。
+
+    Returns:
+        pd.DataFrame: RouteUID、RouteName、SubRouteUID、SubRouteName、Direction、StopUID、StopName、
+                      StopSequence、PositionLon、PositionLat，依路線、方向、站序排序
+    """
+    stops = df_seq.reindex(columns=['RouteUID', 'RouteName_Zh', 'SubRouteUID', 'SubRouteName_Zh', 'Direction',
+                                    'StopUID', 'StopName_Zh', 'StopSequence', 'PositionLon', 'PositionLat'])
+    stops = stops.rename(columns={'RouteName_Zh': 'RouteName',
+                                  'SubRouteName_Zh': 'SubRouteName',
+                                  'StopName_Zh': 'StopName'})
+    stops = stops.drop_duplicates(subset=STOP_KEY_COLUMNS + ['StopSequence'])
+    return stops.sort_values(STOP_KEY_COLUMNS + ['StopSequence']).reset_index(drop=True)
+
+# ===== 上下車量（稀疏） =====
+def count_on_off(df: pd.DataFrame, stops: pd.DataFrame, months: Optional[Iterable] = None,
+                 hours: Iterable[int] = range(24), wdwk: Iterable[int] = (0, 1)) -> pd.DataFrame:
+    """
+    由起迄計次資料彙總各站的上車量（On）與下車量（Off），只保留有觀測到的站點（稀疏格式）。
+    篩選條件同 seq_on_and_off_count：上、下車兩端都必須對得到站序、月份、平假日與小時，否則整筆剔除。
+
+    Args:
+        df: 起迄計次資料（需有 Month、WDWK、BoardingHour、DeboardingHour、RouteUID、SubRouteUID、Direction、
+            BoardingStopSequence、DeboardingStopSequence、Count）
+        stops: prepare_stop_list 的結果
+        months: 要保留的月份（Period 或 'YYYY-MM'），None 代表資料內所有月份
+        hours: 要保留的小時
+        wdwk: 要保留的 WDWK
+
+    Returns:
+        pd.DataFrame: LOAD_GROUP_COLUMNS + StopSequence、On、Off
+    """
+    df = df[df['WDWK'].isin(list(wdwk))]
+    df = df[df['BoardingHour'].isin(list(hours)) & df['DeboardingHour'].isin(list(hours))]
+    if months is not None:
+        months = pd.PeriodIndex(pd.to_datetime(pd.Series(list(months)).astype(str)), freq='M')
+        df = df[df['Month'].isin(months)]
+
+    # 上下車兩端的站序都要存在
+    stop_index = pd.MultiIndex.from_frame(stops[STOP_KEY_COLUMNS + ['StopSequence']])
+    board_ok = stop_index.get_indexer(pd.MultiIndex.from_frame(
+        df[STOP_KEY_COLUMNS + ['BoardingStopSequence']])) >= 0
+    deboard_ok = stop_index.get_indexer(pd.MultiIndex.from_frame(
+        df[STOP_KEY_COLUMNS + ['DeboardingStopSequence']])) >= 0
+    df = df[board_ok & deboard_ok]
+
+    df_on = (df.rename(columns={'BoardingHour': 'Hour', 'BoardingStopSequence': 'StopSequence'})
+               .groupby(LOAD_GROUP_COLUMNS + ['StopSequence'])['Count'].sum().rename('On'))
+    df_off = (df.rename(columns={'DeboardingHour': 'Hour', 'DeboardingStopSequence': 'StopSequence'})
+                .groupby(LOAD_GROUP_COLUMNS + ['StopSequence'])['Count'].sum().rename('Off'))
+
+    onoff = pd.concat([df_on, df_off], axis=1).fillna(0).reset_index()
+    return onoff
+
+def sparse_onbus(onoff: pd.DataFrame, group_columns: List[str] = LOAD_GROUP_COLUMNS,
+                 seqcolumn: str = 'StopSequence', outcolumn: str = 'OnBus', max_workers: int = 1) -> pd.DataFrame:
+    """
+    只在有上下車的站點計算車上人數：同一組（路線、方向、月份、平假日、小時）內依站序累加 On - Off，負值以 0 計。
+    沒有上下車的站點車上人數不變，因此與 calc_onbus_pd 在完整站序表上的結果相同。
+
+    Returns:
+        pd.DataFrame: 依 group_columns + seqcolumn 排序，新增 outcolumn
+    """
+    onoff = onoff.sort_values(group_columns + [seqcolumn]).reset_index(drop=True)
+    return calc_onbus(onoff, group_columns, 'On', 'Off', seqcolumn, outcolumn, max_workers=max_workers)
+
+# ===== 車上人數累加核心 =====
+def _segment_cumsum(delta: np.ndarray, group_codes: np.ndarray) -> np.ndarray:
+    """已依群組排好的陣列做分段累加：整段 cumsum 後減去每組起點前的累計值"""
+    n = len(delta)
+    if n == 0:
+        return delta.astype(float)
+    cs = np.cumsum(delta, dtype=float)
+    starts = np.flatnonzero(np.r_[True, group_codes[1:] != group_codes[:-1]])
+    base = cs[starts] - delta[starts]
+    return cs - np.repeat(base, np.diff(np.r_[starts, n]))
+
+def segment_onbus(on, off, seq, group_codes, max_workers: int = 1, chunk_rows: int = 1000000) -> np.ndarray:
+    """
+    依明確的群組代碼計算車上人數：同一組內依站序累加 On - Off，負值以 0 計（取代 seq == 1 重新起算的寫法）。
+
+    輸入已依 (群組, 站序) 排好時直接計算，不需排序；否則以 np.lexsort 取得順序，結果仍依輸入的列順序回傳。
+    資料量大時依群組邊界切成多段，以多執行緒平行計算（numpy 的累加運算會釋放 GIL）。
+
+    Args:
+        on, off, seq: 上車量、下車量、站序（等長陣列）
+        group_codes: 每列的整數群組代碼（例如 groupby(...).ngroup()）
+        max_workers: 平行計算的執行緒數，None 代表使用所有 CPU 核心
+        chunk_rows: 每段約多少列（只會在群組邊界切開）
+
+    Returns:
+        np.ndarray: 每列的車上人數
+    """
+    on, off = np.asarray(on, dtype=float), np.asarray(off, dtype=float)
+    seq, group_codes = np.asarray(seq), np.asarray(group_codes)
+    n = len(on)
+
+    same_group = group_codes[1:] == group_codes[:-1]
+    is_sorted = bool(np.all((group_codes[1:] > group_codes[:-1]) | (same_group & (seq[1:] >= seq[:-1])))) if n > 1 else True
+    order = None if is_sorted else np.lexsort((seq, group_codes))
+
+    delta = on - off if order is None else (on - off)[order]
+    codes = group_codes if order is None else group_codes[order]
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    if max_workers <= 1 or n <= chunk_rows:
+        out = _segment_cumsum(delta, codes)
+    else:
+        # 切段位置對齊群組起點，各段互不相依
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        cuts = np.unique(starts[np.searchsorted(starts, np.arange(0, n, chunk_rows))])
+        bounds = list(zip(cuts, np.r_[cuts[1:], n]))
+        out = np.empty(n, dtype=float)
+
+        def run(bound):
+            a, b = bound
+            out[a:b] = _segment_cumsum(delta[a:b], codes[a:b])
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(run, bounds))
+
+    np.maximum(out, 0, out)
+    if order is None:
+        return out
+    result = np.empty(n, dtype=float)
+    result[order] = out
+    return result
+
+def calc_onbus(df: pd.DataFrame, group_columns: List[str], oncolumn: str = 'On', offcolumn: str = 'Off',
+               seqcolumn: str = 'StopSequence', outcolumn: str = 'OnBus', max_workers: int = 1) -> pd.DataFrame:
+    """
+    DataFrame 版本的 segment_onbus：以 group_columns 編成整數群組代碼後計算車上人數，新增 outcolumn。
+    不要求資料事先排序，也不要求每組站序從 1 開始。
+    """
+    group_codes = df.groupby(group_columns, sort=False, dropna=False).ngroup().to_numpy()
+    df[outcolumn] = segment_onbus(df[oncolumn].to_numpy(), df[offcolumn].to_numpy(), df[seqcolumn].to_numpy(),
+                                  group_codes, max_workers=max_workers)
+    return df
+
+# ===== 展開為完整站序表 =====
+def expand_onbus(sparse: pd.DataFrame, stops: pd.DataFrame, months: Optional[Iterable] = None,
+                 hours: Iterable[int] = range(24), wdwk: Iterable[int] = (0, 1),
+                 all_groups: bool = True, outcolumn: str = 'OnBus') -> pd.DataFrame:
+    """
+    將 sparse_onbus 的結果展開為每一站都有一列的完整表（同 seq_on_and_off_count + calc_onbus_pd 的輸出）。
+
+    Args:
+        sparse: sparse_onbus 的結果
+        stops: prepare_stop_list 的結果
+        months: 展開的月份，None 代表 sparse 內出現的月份
+        hours, wdwk: 展開的小時、WDWK
+        all_groups: True 展開所有路線 × 月份 × WDWK × 小時（同原本 seq_withhour 的交叉表）；
+                    False 只展開有上下車的組合，可大幅減少列數
+
+    Returns:
+        pd.DataFrame: 站序欄位 + Month、WDWK、Hour、On、Off、outcolumn
+    """
+    if months is None:
+        months = pd.PeriodIndex(sparse['Month'].drop_duplicates().sort_values(), freq='M')
+    else:
+        months = pd.PeriodIndex(pd.to_datetime(pd.Series(list(months)).astype(str)), freq='M')
+
+    if all_groups:
+        # 用 numpy repeat/tile 產生交叉表，避免多次 cross merge 的中間表
+        combos = pd.MultiIndex.from_product([months, list(wdwk), list(hours)],
+                                            names=['Month', 'WDWK', 'Hour']).to_frame(index=False)
+        dense = stops.iloc[np.repeat(np.arange(len(stops)), len(combos))].reset_index(drop=True)
+        combos = combos.iloc[np.tile(np.arange(len(combos)), len(stops))].reset_index(drop=True)
+        dense = pd.concat([dense, combos], axis=1)
+    else:
+        groups = sparse[LOAD_GROUP_COLUMNS].drop_duplicates()
+        groups = groups[groups['Month'].isin(months)]
+        dense = stops.merge(groups, on=STOP_KEY_COLUMNS, how='inner')
+
+    dense = dense.sort_values(['RouteUID', 'SubRouteUID', 'SubRouteName', 'Month', 'WDWK', 'Hour',
+                               'Direction', 'StopSequence']).reset_index(drop=True)
+    dense = dense.merge(sparse[LOAD_GROUP_COLUMNS + ['StopSequence', 'On', 'Off', outcolumn]],
+                        on=LOAD_GROUP_COLUMNS + ['StopSequence'], how='left')
+
+    dense[['On', 'Off']] = dense[['On', 'Off']].fillna(0)
+    # 沒有上下車的站點沿用前一站的車上人數，第一個有上下車的站點之前為 0
+    group_id = dense.groupby(LOAD_GROUP_COLUMNS, sort=False).ngroup()
+    dense[outcolumn] = dense[outcolumn].groupby(group_id).ffill().fillna(0)
+
+    return dense.reindex(columns=['RouteUID', 'RouteName', 'SubRouteUID', 'SubRouteName', 'Month', 'WDWK', 'Hour',
+                                  'Direction', 'StopUID', 'StopName', 'StopSequence', 'PositionLon', 'PositionLat',
+                                  'On', 'Off', outcolumn])
@@ -0,0 +1,298 @@
+"""
+起訖量（分析03）的稀疏矩陣格式。
+
+每條路線（RouteUID、SubRouteUID、Direction）每個時段（預設 Month、WDWK、BoardingHour）一個
+上車站序 × 下車站序的稀疏矩陣。所有矩陣存成同一組整數陣列（路線、時段、上車站序、下車站序、筆數），
+依路線 → 時段 → 上車站序 → 下車站序排序，並以 route_ptr 記錄每條路線的起訖位置（同 CSR 的 indptr），
+文字欄位（路線、站名、時段）只存在對照表中一次。
+
+    od = odmatrix_from_hourlycount(hourlycount_file)
+    save_odmatrix(od, '起訖矩陣.npz')
+    m = route_matrix(od, ('TPE10', 'TPE101', 0), periods=select_periods(od, WDWK=[0], BoardingHour=range(7, 10)))
+    zone, zones = zone_matrix(od, stop_zone)          # 分區 × 分區
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple, Union
+
+from keydict import as_key
+
+ROUTE_COLUMNS = ['RouteUID', 'SubRouteUID', 'Direction']
+PERIOD_COLUMNS = ['Month', 'WDWK', 'BoardingHour']
+ODMATRIX_VERSION = 1
+
+# 上下車站序、站點欄位（分時計次的欄位名稱）
+BOARD_COLUMNS = ['BoardingStopSequence', 'BoardingStopUID', 'BoardingStopName']
+DEBOARD_COLUMNS = ['DeboardingStopSequence', 'DeboardingStopUID', 'DeboardingStopName']
+
+# ===== 建立 =====
+def build_odmatrix(df: pd.DataFrame, route_columns: Sequence[str] = ROUTE_COLUMNS,
+                   period_columns: Sequence[str] = PERIOD_COLUMNS, value: str = 'Count') -> Dict[str, Any]:
+    """
+    由分時計次（analytics01 的輸出）建立起訖矩陣。上、下車站序需為正整數，否則該筆不列入（筆數記在 dropped）。
+
+    Args:
+        df: 分時計次，需有 route_columns、period_columns（Month 可由 InfoDate 產生）、上下車站序與站點、value
+        route_columns: 路線鍵值
+        period_columns: 時段鍵值
+
+    Returns:
+        dict:
+            routes: 路線對照表（route_columns、RouteName、NStops），index 為路線代碼
+            periods: 時段對照表（period_columns），index 為時段代碼
+            stops: 各路線站序對應的站點（route、Seq、StopUID、StopName）
+            route、period、o、d、count: 依路線、時段、上車、下車站序排序的陣列
+            route_ptr: 路線 i 的資料位於 [route_ptr[i], route_ptr[i + 1])
+            dropped: 站序無效而未列入的筆數
+    """
+    df = df.copy()
+    if 'Month' in period_columns and 'Month' not in df.columns:
+        df['Month'] = df['InfoDate'].astype(str).str[:7]
+
+    o = pd.to_numeric(df[BOARD_COLUMNS[0]], errors='coerce')
+    d = pd.to_numeric(df[DEBOARD_COLUMNS[0]], errors='coerce')
+    counts = pd.to_numeric(df[value], errors='coerce').fillna(0)
+    valid = (o > 0) & (d > 0) & (o % 1 == 0) & (d % 1 == 0)
+    dropped = float(counts[~valid].sum())
+    df, o, d, counts = df[valid], o[valid].astype('int64'), d[valid].astype('int64'), counts[valid]
+
+    # 路線、時段代碼（對照表依文字排序）
+    route_keys = pd.MultiIndex.from_frame(df[list(route_columns)].apply(as_key))
+    route_codes, route_index = route_keys.factorize(sort=True)
+    period_keys = pd.MultiIndex.from_frame(df[list(period_columns)].apply(as_key))
+    period_codes, period_index = period_keys.factorize(sort=True)
+
+    # 相同（路線、時段、上車、下車）加總，並依此順序排序
+    cells = pd.DataFrame({'route': route_codes, 'period': period_codes, 'o': o.to_numpy(), 'd': d.to_numpy(),
+                          'count': counts.to_numpy()})
+    cells = cells.groupby(['route', 'period', 'o', 'd'], sort=True)['count'].sum().reset_index()
+
+    routes = route_index.to_frame(index=False, name=list(route_columns))
+    n_stops = np.zeros(len(routes), dtype='int64')
+    np.maximum.at(n_stops, cells['route'].to_numpy(), np.maximum(cells['o'], cells['d']).to_numpy() + 1)
+    routes['NStops'] = n_stops
+    if 'RouteName' in df.columns:
+        names = pd.Series(df['RouteName'].to_numpy(), index=route_codes)
+        routes['RouteName'] = names[~names.index.duplicated()].reindex(routes.index).to_numpy()
+
+    # 各路線站序 → 站點（上、下車兩端都可以提供）
+    ends = []
+    for seq, cols in ((o, BOARD_COLUMNS), (d, DEBOARD_COLUMNS)):
+        end = pd.DataFrame({'route': route_codes, 'Seq': seq.to_numpy()})
+        for src, dst in zip(cols[1:], ['StopUID', 'StopName']):
+            end[dst] = df[src].to_numpy() if src in df.columns else None
+        ends.append(end)
+    stops = (pd.concat(ends, ignore_index=True).drop_duplicates(['route', 'Seq'])
+             .sort_values(['route', 'Seq']).reset_index(drop=True))
+
+    count = cells['count'].to_numpy()
+    count = count.astype('int32') if (count % 1 == 0).all() and count.max(initial=0) < 2 ** 31 else count
+    route = cells['route'].to_numpy().astype('int32')
+    return {
+        'routes': routes,
+        'periods': period_index.to_frame(index=False, name=list(period_columns)),
+        'stops': stops,
+        'route': route,
+        'period': cells['period'].to_numpy().astype('int32'),
+        'o': cells['o'].to_numpy().astype('int16'),
+        'd': cells['d'].to_numpy().astype('int16'),
+        'count': count,
+        'route_ptr': np.searchsorted(route, np.arange(len(routes) + 1)).astype('int64'),
+        'dropped': dropped,
+    }
+
+def odmatrix_from_hourlycount(path: str, route_columns: Sequence[str] = ROUTE_COLUMNS,
+                              period_columns: Sequence[str] = PERIOD_COLUMNS, value: str = 'Count') -> Dict[str, Any]:
+    """讀取分時計次 CSV（只讀需要的欄位，文字欄位以 category 讀入）並建立起訖矩陣"""
+    columns = set(route_columns) | set(period_columns) | set(BOARD_COLUMNS) | set(DEBOARD_COLUMNS) | {'RouteName', 'InfoDate', value}
+    df = pd.read_csv(path, usecols=lambda c: c in columns, dtype={c: 'category' for c in columns if c != value})
+    return build_odmatrix(df, route_columns=route_columns, period_columns=period_columns, value=value)
+
+# ===== 存檔 =====
+def _table_arrays(prefix: str, table: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """對照表逐欄存成 numpy 陣列（文字為 unicode 陣列，不需要 pickle）"""
+    arrays = {}
+    for col in table.columns:
+        values = table[col].to_numpy()
+        arrays[f'{prefix}::{col}'] = values if values.dtype != object else pd.Series(values).fillna('').astype(str).to_numpy().astype(str)
+    return arrays
+
+def save_odmatrix(od: Dict[str, Any], path: str) -> str:
+    """存成單一壓縮的 .npz（陣列 + 對照表）"""
+    arrays = {k: od[k] for k in ('route', 'period', 'o', 'd', 'count', 'route_ptr')}
+    arrays['meta::version'] = np.array(ODMATRIX_VERSION)
+    arrays['meta::dropped'] = np.array(od.get('dropped', 0.0))
+    for name in ('routes', 'periods', 'stops'):
+        arrays.update(_table_arrays(name, od[name]))
+        arrays[f'meta::{name}'] = np.array(list(od[name].columns), dtype=str)
+    np.savez_compressed(path, **arrays)
+    return path
+
+def load_odmatrix(path: str) -> Dict[str, Any]:
+    """讀取 save_odmatrix 的結果"""
+    with np.load(path, allow_pickle=False) as z:
+        if int(z['meta::version']) != ODMATRIX_VERSION:
+            raise ValueError(f"Unsupported OD matrix version: {path}")
+        od = {k: z[k] for k in ('route', 'period', 'o', 'd', 'count', 'route_ptr')}
+        od['dropped'] = float(z['meta::dropped'])
+        for name in ('routes', 'periods', 'stops'):
+            od[name] = pd.DataFrame({str(col): z[f'{name}::{col}'] for col in z[f'meta::{name}']})
+    return od
+
+# ===== 選取 =====
+def route_id(od: Dict[str, Any], route: Union[int, Tuple]) -> int:
+    """路線代碼：整數直接回傳，tuple 依 route_columns 的順序比對（例如 ('TPE10', 'TPE101', 0)）"""
+    if isinstance(route, (int, np.integer)):
+        return int(route)
+    key_columns = [c for c in od['routes'].columns if c not in ('NStops', 'RouteName')]
+    keys = pd.MultiIndex.from_frame(od['routes'][key_columns].astype(str))
+    key = tuple(as_key(pd.Series([v])).iloc[0] for v in route)
+    pos = keys.get_indexer([key])[0]
+    if pos < 0:
+        raise KeyError(f"Route not found: {route}")
+    return int(pos)
+
+def select_periods(od: Dict[str, Any], **conditions) -> np.ndarray:
+    """
+    依時段欄位篩選時段代碼，例如 select_periods(od, WDWK=[0], BoardingHour=range(7, 10))。
+    條件值可以是單一值或多個值（以文字比對，3 與 '3' 相同）。
+    """
+    periods = od['periods']
+    mask = np.ones(len(periods), dtype=bool)
+    for col, values in conditions.items():
+        if isinstance(values, (str, int, np.integer)) or not isinstance(values, Iterable):
+            values = [values]
+        mask &= periods[col].astype(str).isin(as_key(pd.Series(list(values))).tolist()).to_numpy()
+    return np.flatnonzero(mask)
+
+def _rows(od: Dict[str, Any], routes: Optional[Iterable] = None, periods: Optional[Iterable[int]] = None) -> np.ndarray:
+    """符合路線、時段的資料位置"""
+    if routes is None:
+        rows = np.arange(len(od['route']))
+    else:
+        ptr = od['route_ptr']
+        rows = np.concatenate([np.arange(ptr[r], ptr[r + 1]) for r in (route_id(od, r) for r in routes)] or [np.array([], dtype='int64')])
+    if periods is not None:
+        rows = rows[np.isin(od['period'][rows], np.asarray(list(periods)))]
+    return rows
+
+def route_matrix(od: Dict[str, Any], route: Union[int, Tuple], periods: Optional[Iterable[int]] = None) -> sparse.csr_matrix:
+    """
+    某條路線（選取的時段加總）的上車站序 × 下車站序矩陣，大小為 NStops × NStops（站序直接當作索引）。
+    """
+    r = route_id(od, route)
+    rows = _rows(od, [r], periods)
+    n = int(od['routes']['NStops'].iloc[r])
+    return sparse.csr_matrix((od['count'][rows], (od['o'][rows], od['d'][rows])), shape=(n, n))
+
+def route_totals(od: Dict[str, Any], periods: Optional[Iterable[int]] = None) -> pd.DataFrame:
+    """各路線（選取的時段加總）的總運量"""
+    rows = _rows(od, periods=periods)
+    total = np.bincount(od['route'][rows], weights=od['count'][rows], minlength=len(od['routes']))
+    return od['routes'].assign(Count=total)
+
+def period_totals(od: Dict[str, Any], routes: Optional[Iterable] = None) -> pd.DataFrame:
+    """各時段（選取的路線加總）的總運量"""
+    rows = _rows(od, routes=routes)
+    total = np.bincount(od['period'][rows], weights=od['count'][rows], minlength=len(od['periods']))
+    return od['periods'].assign(Count=total)
+
+# ===== 彙總 =====
+def rollup_periods(od: Dict[str, Any], keep: Sequence[str]) -> Dict[str, Any]:
+    """
+    時段合併：只保留 keep 欄位（例如 ['WDWK'] 把所有月份、小時加總），回傳新的起訖矩陣。
+    """
+    codes, index = pd.MultiIndex.from_frame(od['periods'][list(keep)]).factorize(sort=True)
+    period = codes[od['period']]
+    cells = pd.DataFrame({'route': od['route'], 'period': period, 'o': od['o'], 'd': od['d'], 'count': od['count']})
+    cells = cells.groupby(['route', 'period', 'o', 'd'], sort=True)['count'].sum().reset_index()
+    route = cells['route'].to_numpy().astype('int32')
+    return dict(od,
+                periods=index.to_frame(index=False, name=list(keep)),
+                route=route,
+                period=cells['period'].to_numpy().astype('int32'),
+                o=cells['o'].to_numpy().astype(od['o'].dtype),
+                d=cells['d'].to_numpy().astype(od['d'].dtype),
+                count=cells['count'].to_numpy().astype(od['count'].dtype),
+                route_ptr=np.searchsorted(route, np.arange(len(od['routes']) + 1)).astype('int64'))
+
+def screenline_volume(od: Dict[str, Any], cuts: pd.DataFrame, periods: Optional[Iterable[int]] = None) -> pd.DataFrame:
+    """
+    屏柵線通過量：cuts 每一列為一條路線上的切點（route_columns + CutAfterSeq，代表切在該站序與下一站之間），
+    通過量 = 上車站序 <= CutAfterSeq < 下車站序 的起訖量（即矩陣右上角 M[:k+1, k+1:] 的總和）。
+
+    Returns:
+        pd.DataFrame: cuts + 各時段的通過量（period 代碼與 periods 對照表合併後的長表格）
+    """
+    key_columns = [c for c in od['routes'].columns if c not in ('NStops', 'RouteName')]
+    keys = pd.MultiIndex.from_frame(od['routes'][key_columns].astype(str))
+    cut_keys = pd.MultiIndex.from_frame(cuts[key_columns].apply(as_key))
+    cut_route = keys.get_indexer(cut_keys)
+
+    results = []
+    for i, (r, k) in enumerate(zip(cut_route, cuts['CutAfterSeq'].to_numpy())):
+        if r < 0:
+            continue
+        rows = _rows(od, [r], periods)
+        crossing = rows[(od['o'][rows] <= k) & (od['d'][rows] > k)]
+        volume = np.bincount(od['period'][crossing], weights=od['count'][crossing], minlength=len(od['periods']))
+        hit = np.flatnonzero(volume) if periods is None else np.asarray(list(periods))
+        results.append(pd.DataFrame({'cut': i, 'period': hit, 'Volume': volume[hit]}))
+
+    if not results:
+        return pd.DataFrame(columns=list(cuts.columns) + list(od['periods'].columns) + ['Volume'])
+    out = pd.concat(results, ignore_index=True)
+    out = out.join(cuts.reset_index(drop=True), on='cut').join(od['periods'], on='period')
+    return out[list(cuts.columns) + list(od['periods'].columns) + ['Volume']]
+
+def zone_matrix(od: Dict[str, Any], stop_zone: Union[pd.Series, Dict[str, Any]], periods: Optional[Iterable[int]] = None,
+                routes: Optional[Iterable] = None) -> Tuple[sparse.csr_matrix, pd.Index]:
+    """
+    分區 × 分區的起訖量（熱度圖）。每個 (路線, 站序) 依其 StopUID 對應到分區，
+    Z = Σ_路線 P_oᵀ · M · P_d，以一次 COO → CSR 完成（重複的格子自動加總）。
+
+    Args:
+        stop_zone: StopUID → 分區（Series 或 dict），對不到分區的站點不列入
+        periods、routes: 只計算這些時段、路線
+
+    Returns:
+        (csr_matrix, zones)：zones 為矩陣列、欄對應的分區
+    """
+    stop_zone = pd.Series(stop_zone)
+    zones = pd.Index(pd.unique(stop_zone.dropna())).sort_values()
+    stops = od['stops']
+    stop_code = zones.get_indexer(stops['StopUID'].map(stop_zone))
+
+    # (路線, 站序) → 分區代碼的查表：lookup[route, seq]
+    n_seq = int(od['routes']['NStops'].max()) if len(od['routes']) else 0
+    lookup = np.full((len(od['routes']), n_seq + 1), -1, dtype='int64')
+    lookup[stops['route'].to_numpy(), stops['Seq'].to_numpy()] = stop_code
+
+    rows = _rows(od, routes=routes, periods=periods)
+    zo = lookup[od['route'][rows], od['o'][rows]]
+    zd = lookup[od['route'][rows], od['d'][rows]]
+    ok = (zo >= 0) & (zd >= 0)
+    matrix = sparse.coo_matrix((od['count'][rows][ok], (zo[ok], zd[ok])), shape=(len(zones), len(zones))).tocsr()
+    return matrix, zones
+
+# ===== 輸出 =====
+def to_long(od: Dict[str, Any], routes: Optional[Iterable] = None, periods: Optional[Iterable[int]] = None) -> pd.DataFrame:
+    """展開為長表格（路線、時段、上下車站序與站點、Count），給 Tableau 等工具使用"""
+    rows = _rows(od, routes=routes, periods=periods)
+    out = pd.DataFrame({'route': od['route'][rows], 'period': od['period'][rows],
+                        'BoardingStopSequence': od['o'][rows], 'DeboardingStopSequence': od['d'][rows],
+                        'Count': od['count'][rows]})
+    stops = od['stops'].set_index(['route', 'Seq'])[['StopUID', 'StopName']]
+    for prefix, seq in (('Boarding', 'BoardingStopSequence'), ('Deboarding', 'DeboardingStopSequence')):
+        found = stops.reindex(pd.MultiIndex.from_arrays([out['route'], out[seq]]))
+        out[f'{prefix}StopUID'] = found['StopUID'].to_numpy()
+        out[f'{prefix}StopName'] = found['StopName'].to_numpy()
+    out = out.join(od['routes'].drop(columns=['NStops']), on='route').join(od['periods'], on='period')
+    columns = [c for c in od['routes'].columns if c != 'NStops'] + list(od['periods'].columns) + [
+        'BoardingStopSequence', 'BoardingStopUID', 'BoardingStopName',
+        'DeboardingStopSequence', 'DeboardingStopUID', 'DeboardingStopName', 'Count']
+    return out[columns]
@@ -0,0 +1,162 @@
+"""
+公車路線線形（TDX BusShape）的幾何轉換與快取。
+
+read_bus_shape_of_route_xml 保留原始的 Geometry（WKT）與 EncodedPolyline 文字，原本各 notebook 以
+df_route['Geometry'].apply(wkt.loads) 逐列解析、每次執行都重新轉換座標。這裡改為：
+
+    1. shapely.from_wkt 整欄一次解析；WKT 缺值或無法解析時，改由 EncodedPolyline 以向量化的方式解碼
+    2. 只轉換一次座標系統（例如 EPSG:3826）
+    3. 結果以 GeoParquet（WKB）存起來，依 SubRouteUID、Direction、VersionID 對應，
+       之後同一個版本的線形直接讀取，只有新增或變動的路線才需要重新解析
+
+    gdf_route = route_geometry(df_route, target_crs=TWD97, store=os.path.join(cache_folder, 'route_geometry_EPSG3826.parquet'))
+"""
+
+from __future__ import annotations
+
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from typing import Optional, Sequence
+
+WGS84 = 'EPSG:4326'
+TWD97 = 'EPSG:3826'
+ROUTE_GEOMETRY_KEYS = ['SubRouteUID', 'Direction', 'VersionID']
+SOURCE_HASH_COLUMN = 'SourceHash'
+
+# ===== EncodedPolyline =====
+def decode_polylines(encoded: Sequence[Optional[str]], precision: int = 5) -> np.ndarray:
+    """
+    向量化解碼 Google Encoded Polyline（TDX EncodedPolyline，緯度在前、精度 1e-5）。
+
+    所有字串串接成一個位元組陣列，一次算出每個數值（5 bits 一組，0x20 為延續位元）、
+    還原正負號，再依路線累加座標差值，最後以 shapely.linestrings 一次建立線形。
+
+    Returns:
+        np.ndarray: 每個輸入一個 LineString（經度, 緯度）；缺值、格式錯誤或少於兩個點時為 None
+    """
+    texts = pd.Series(list(encoded), dtype=object)
+    result = np.full(len(texts), None, dtype=object)
+    valid = texts.map(lambda x: isinstance(x, str) and len(x) > 0 and x.isascii()).to_numpy(dtype=bool)
+    if not valid.any():
+        return result
+
+    lengths = texts[valid].str.len().to_numpy()
+    data = np.frombuffer(''.join(texts[valid]).encode('ascii'), dtype=np.uint8).astype(np.int64) - 63
+    starts = np.cumsum(lengths) - lengths
+
+    # 字元需介於 '?'(63) 與 '~'(126)，且最後一個字元不能帶延續位元
+    ok = (np.minimum.reduceat(data, starts) >= 0) & (np.maximum.reduceat(data, starts) <= 63)
+    ok &= (data[starts + lengths - 1] & 0x20) == 0
+    last = (data & 0x20) == 0
+    last[starts + lengths - 1] = True   # 格式錯誤的字串也在結尾切斷，不影響下一條
+
+    # 每個數值：各組 5 bits 依序左移後相加，再還原正負號（zigzag）
+    first = np.flatnonzero(np.r_[True, last[:-1]])
+    shift = 5 * (np.arange(len(data)) - np.repeat(first, np.diff(np.r_[first, len(data)])))
+    values = np.add.reduceat((data & 0x1f) << shift, first)
+    values = np.where(values & 1, ~(values >> 1), values >> 1)
+
+    # 每條路線的數值個數需為偶數（緯度、經度成對）且至少兩個點
+    counts = np.add.reduceat(last.astype(np.int64), starts)
+    ok &= (counts % 2 == 0) & (counts >= 4)
+    keep = np.repeat(ok, counts)
+    values, counts = values[keep], counts[ok]
+    if len(counts) == 0:
+        return result
+
+    # 座標差值依路線累加（各路線從 0 開始）
+    n_points = counts // 2
+    lat, lon = values[0::2], values[1::2]
+    point_start = np.repeat(np.cumsum(n_points) - n_points, n_points)
+    lat, lon = np.cumsum(lat), np.cumsum(lon)
+    lat = lat - np.r_[0, lat][point_start]
+    lon = lon - np.r_[0, lon][point_start]
+
+    coords = np.column_stack([lon, lat]) / 10 ** precision
+    lines = shapely.linestrings(coords, indices=np.repeat(np.arange(len(n_points)), n_points))
+    result[np.flatnonzero(valid)[ok]] = lines
+    return result
+
+# ===== 線形轉換 =====
+def geometry_from_text(wkt_values: Sequence[Optional[str]], polylines: Optional[Sequence[Optional[str]]] = None) -> np.ndarray:
+    """
+    WKT 整欄一次解析（shapely.from_wkt），缺值或無法解析的列改用 EncodedPolyline 解碼。
+
+    Returns:
+        np.ndarray: shapely 幾何陣列，兩者都無法取得時為 None
+    """
+    wkt_values = np.array([x if isinstance(x, str) else None for x in wkt_values], dtype=object)
+    geometry = shapely.from_wkt(wkt_values, on_invalid='ignore')
+    if polylines is not None:
+        missing = pd.isna(geometry)
+        if missing.any():
+            geometry[missing] = decode_polylines(pd.Series(list(polylines), dtype=object)[missing])
+    return geometry
+
+def _source_hash(df: pd.DataFrame, columns: Sequence[str]) -> np.ndarray:
+    """原始線形文字的雜湊（VersionID 相同但線形不同時仍會重新解析）"""
+    return pd.util.hash_pandas_object(df[list(columns)].astype(object).fillna(''), index=False).to_numpy()
+
+def read_route_store(store: str, crs) -> Optional[gpd.GeoDataFrame]:
+    """讀取線形快取（GeoParquet）；不存在、無法讀取或座標系統不同時回傳 None"""
+    if not os.path.exists(store):
+        return None
+    try:
+        cached = gpd.read_parquet(store)
+    except Exception as e:
+        print(f"Error reading route geometry store {store}: {e}")
+        return None
+    if cached.crs is None or not cached.crs.equals(crs):
+        return None
+    return cached
+
+def route_geometry(df_route: pd.DataFrame, crs=WGS84, target_crs=None, store: Optional[str] = None,
+                   geometry_column: str = 'Geometry', polyline_column: str = 'EncodedPolyline',
+                   key_columns: Sequence[str] = ROUTE_GEOMETRY_KEYS) -> gpd.GeoDataFrame:
+    """
+    BusShape 資料表轉為 GeoDataFrame（取代 df_route['Geometry'].apply(wkt.loads) + to_crs）。
+
+    Args:
+        df_route: read_bus_shape_of_route_xml / read_combined_tdx_cached 讀入的路線線形
+        crs: 原始座標系統
+        target_crs: 輸出座標系統，None 代表不轉換
+        store: 線形快取（GeoParquet）路徑；指定時 key_columns 與原始線形都相同的路線直接取用快取，
+               其餘路線解析、轉換座標後寫回快取。key_columns 有缺值的路線不寫入快取
+        geometry_column, polyline_column: WKT 與 EncodedPolyline 欄位（EncodedPolyline 欄位可以不存在）
+
+    Returns:
+        gpd.GeoDataFrame: 原本的欄位（去掉 geometry_column）+ geometry，index 同 df_route
+    """
+    target_crs = crs if target_crs is None else target_crs
+    source_columns = [c for c in (geometry_column, polyline_column) if c in df_route.columns]
+    keys = df_route.reindex(columns=list(key_columns)).astype(str).reset_index(drop=True)
+    keys[SOURCE_HASH_COLUMN] = _source_hash(df_route, source_columns)
+    storable = df_route.reindex(columns=list(key_columns)).notna().all(axis=1).to_numpy()
+
+    geometry = np.full(len(df_route), None, dtype=object)
+    cached = read_route_store(store, target_crs) if store is not None else None
+    if cached is not None:
+        found = keys.reset_index().merge(cached, on=list(key_columns) + [SOURCE_HASH_COLUMN], how='inner')
+        geometry[found['index'].to_numpy()] = found.geometry.to_numpy()
+
+    # 快取中沒有的路線：整欄解析後只轉換一次座標
+    missing = pd.isna(geometry)
+    if missing.any():
+        polylines = df_route[polyline_column].to_numpy()[missing] if polyline_column in df_route.columns else None
+        decoded = geometry_from_text(df_route[geometry_column].to_numpy()[missing], polylines)
+        decoded = gpd.GeoSeries(decoded, crs=crs).to_crs(target_crs).to_numpy()
+        geometry[missing] = decoded
+
+        new = keys[missing & storable & ~pd.isna(geometry)] if store is not None else keys.iloc[:0]
+        if len(new):
+            new = gpd.GeoDataFrame(new, geometry=geometry[new.index.to_numpy()], crs=target_crs)
+            merged = new if cached is None else pd.concat([cached, new], ignore_index=True)
+            merged = merged.drop_duplicates(subset=list(key_columns), keep='last')
+            os.makedirs(os.path.dirname(os.path.abspath(store)), exist_ok=True)
+            merged.to_parquet(store, index=False)
+
+    gdf_route = df_route.drop(columns=[geometry_column], errors='ignore')
+    return gpd.GeoDataFrame(gdf_route, geometry=gpd.GeoSeries(geometry, index=df_route.index, crs=target_crs))
@@ -0,0 +1,263 @@
+from __future__ import annotations
+
+import numpy as np
+import os
+import pandas as pd
+import geopandas as gpd
+import shapely
+from concurrent.futures import ProcessPoolExecutor
+from pyproj import Geod
+from shapely.ops import linemerge
+from typing import Optional, Tuple
+
+# split_routes 輸出時由站序帶入的欄位（起點站 → Start、終點站 → End）
+SEGMENT_COLUMNS = ['RouteUID', 'SRouteUID', 'Direction', 'StartSeq', 'EndSeq', 'StartOri', 'EndOri', 'Len_route', 'geometry']
+
+# ===== 共用 =====
+def _route_lines(geoms) -> np.ndarray:
+    """路線幾何轉為 LineString 陣列：MultiLineString 先 linemerge，仍無法合併成單線者為 None"""
+    geoms = np.asarray(geoms, dtype=object)
+    out = geoms.copy()
+    is_line = shapely.get_type_id(geoms) == 1
+    for i in np.flatnonzero(~is_line):
+        g = geoms[i]
+        if g is None or shapely.is_empty(g):
+            out[i] = None
+            continue
+        try:
+            merged = linemerge(g)
+        except Exception:
+            merged = None
+        out[i] = merged if shapely.get_type_id(merged) == 1 else None
+    return out
+
+def _ranges(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """串接多個 arange(start, start + length)"""
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(starts, lengths) + np.arange(total) - offsets
+
+# ===== 投影 =====
+def snap_stops_to_routes(stops_gdf: gpd.GeoDataFrame, routes_gdf: gpd.GeoDataFrame,
+                         route_id_col: str, route_direction_col: str,
+                         seq_id_col: str, seq_direction_col: str,
+                         seq_lat_col: str, seq_lng_col: str,
+                         route_geom_col: str = 'geometry') -> gpd.GeoDataFrame:
+    """
+    批次版 snap_points_to_line：以 shapely 2 的向量化函式（line_locate_point / line_interpolate_point）
+    一次把所有站點投影到對應的路線上，結果與逐列 project / interpolate 相同。
+
+    每個站點對應第一條 (路線, 方向) 相同的路線；沒有對應路線者保留原始點位、distance 為 0。
+
+    Returns:
+        gpd.GeoDataFrame: geometry、seq_lat_col、seq_lng_col 改為投影點，新增 distance（原始點到投影點的大地線距離，公尺）
+    """
+    routes = routes_gdf.drop_duplicates(subset=[route_id_col, route_direction_col], keep='first')
+    route_index = pd.MultiIndex.from_frame(routes[[route_id_col, route_direction_col]])
+    pos = route_index.get_indexer(pd.MultiIndex.from_frame(stops_gdf[[seq_id_col, seq_direction_col]]))
+
+    points = np.asarray(stops_gdf.geometry.values, dtype=object)
+    snapped = points.copy()
+    matched = np.flatnonzero(pos >= 0)
+    if len(matched):
+        lines = np.asarray(routes[route_geom_col].values, dtype=object)[pos[matched]]
+        measures = shapely.line_locate_point(lines, points[matched])
+        snapped[matched] = shapely.line_interpolate_point(lines, measures)
+
+    # 距離：WGS84 大地線（公尺），點位為 EPSG:4326 (x=lon, y=lat)
+    orig_xy, snap_xy = shapely.get_coordinates(points), shapely.get_coordinates(snapped)
+    _, _, distance = Geod(ellps="WGS84").inv(orig_xy[:, 0], orig_xy[:, 1], snap_xy[:, 0], snap_xy[:, 1])
+
+    out = stops_gdf.copy()
+    out['geometry'] = snapped
+    out[seq_lat_col] = snap_xy[:, 1]
+    out[seq_lng_col] = snap_xy[:, 0]
+    out['distance'] = distance
+    return out
+
+# ===== 切段 =====
+def substring_batch(lines, line_codes, start_dist, end_dist) -> np.ndarray:
+    """
+    向量化的 shapely.ops.substring（normalized=False、距離為由起點起算的非負值）。
+
+    同一條路線的所有切段只計算一次累積距離，以 searchsorted 找出中間的頂點，再一次以 shapely.linestrings 建立幾何；
+    起點大於終點時回傳反向的線段，起點等於終點時回傳 Point，與 substring 相同。
+
+    Args:
+        lines: LineString 陣列
+        line_codes: 每個切段對應 lines 的位置
+        start_dist, end_dist: 每個切段的起、終點距離
+
+    Returns:
+        np.ndarray: 每個切段的幾何（LineString 或 Point）
+    """
+    lines = np.asarray(lines, dtype=object)
+    line_codes = np.asarray(line_codes, dtype=np.int64)
+    lengths = shapely.length(lines)
+    s = np.clip(np.asarray(start_dist, dtype=float), 0, lengths[line_codes])
+    e = np.clip(np.asarray(end_dist, dtype=float), 0, lengths[line_codes])
+    n = len(s)
+    out = np.empty(n, dtype=object)
+
+    is_point = s == e
+    out[is_point] = shapely.line_interpolate_point(lines[line_codes[is_point]], s[is_point])
+
+    seg = np.flatnonzero(~is_point)
+    if len(seg) == 0:
+        return out
+    lo, hi = np.minimum(s[seg], e[seg]), np.maximum(s[seg], e[seg])
+    reverse = s[seg] > e[seg]
+    codes = line_codes[seg]
+
+    # 每條路線的頂點與累積距離（同 substring 以 pairwise 累加的算法）
+    coords, coord_line = shapely.get_coordinates(lines, return_index=True)
+    coord_start = np.searchsorted(coord_line, np.arange(len(lines)))
+    k0, k1 = np.empty(len(seg), dtype=np.int64), np.empty(len(seg), dtype=np.int64)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.flatnonzero(np.r_[True, codes[order][1:] != codes[order][:-1], True])
+    for a, b in zip(bounds[:-1], bounds[1:]):
+        idx = order[a:b]
+        code = codes[idx[0]]
+        xy = coords[coord_start[code]:coord_start[code] + shapely.get_num_coordinates(lines[code])]
+        d = np.diff(xy, axis=0)
+        cum = np.r_[0.0, np.cumsum(np.sqrt(d[:, 0] ** 2 + d[:, 1] ** 2))][:-1]  # 最後一個頂點不會被加入
+        k0[idx] = coord_start[code] + np.searchsorted(cum, lo[idx], side='right')
+        k1[idx] = coord_start[code] + np.searchsorted(cum, hi[idx], side='left')
+    inner = np.maximum(k1 - k0, 0)
+
+    # 組合頂點：起點 + 中間頂點 + 終點，反向者整段倒序
+    counts = inner + 2
+    offsets = np.cumsum(counts) - counts
+    start_xy = shapely.get_coordinates(shapely.line_interpolate_point(lines[codes], lo))
+    end_xy = shapely.get_coordinates(shapely.line_interpolate_point(lines[codes], hi))
+    total = int(counts.sum())
+    xy = np.empty((total, 2), dtype=float)
+    seg_id = np.repeat(np.arange(len(seg)), counts)
+    pos = np.arange(total) - np.repeat(offsets, counts)
+    pos = np.where(reverse[seg_id], counts[seg_id] - 1 - pos, pos) + offsets[seg_id]
+    forward = np.empty((total, 2), dtype=float)
+    forward[offsets] = start_xy
+    forward[offsets + counts - 1] = end_xy
+    inner_pos = _ranges(offsets + 1, inner)
+    forward[inner_pos] = coords[_ranges(k0, inner)]
+    xy[pos] = forward
+
+    out[seg] = shapely.linestrings(xy, indices=seg_id)
+    return out
+
+def split_routes_batch(busroute_select: gpd.GeoDataFrame, seq_select: pd.DataFrame,
+                       route_id_col: str = 'RouteName', route_direction_col: str = 'Direction',
+                       seq_id_col: str = 'RouteName', seq_direction_col: str = 'Direction',
+                       seq_seq_col: str = 'Seq', seq_lat_col: str = 'Lat', seq_lng_col: str = 'Lon',
+                       route_geom_col: str = 'geometry') -> gpd.GeoDataFrame:
+    """
+    批次版 split_routes：依站序把每條路線切成相鄰兩站之間的路段。
+
+    每條路線與其站點一次配對，站點（seq_lng_col, seq_lat_col）以 line_locate_point 投影，
+    再以 substring_batch 一次切出所有路段。起訖投影位置相同者為 Point（同 substring），由呼叫端決定是否剔除。
+    路線為 MultiLineString 時先 linemerge，仍無法合併成單線者略過（原本的 substring 會直接出錯）。
+
+    Returns:
+        gpd.GeoDataFrame: SEGMENT_COLUMNS，crs 同 busroute_select
+    """
+    crs = getattr(busroute_select, 'crs', None)
+    routes = busroute_select.reset_index(drop=True)
+    lines = _route_lines(routes[route_geom_col].values)
+
+    bad = np.flatnonzero(pd.isna(lines))
+    if len(bad):
+        print(f"{len(bad)} 條路線無法合併為單一線段，略過拆分：{routes.loc[bad, route_id_col].tolist()[:10]}")
+
+    # 路線 × 站點配對（每條路線內依站序排列）
+    key = pd.DataFrame({'__id__': routes[route_id_col].values, '__dir__': routes[route_direction_col].values,
+                        '__route__': np.arange(len(routes))})[~pd.isna(lines)]
+    stops = seq_select.reset_index(drop=True)
+    stops = stops.assign(__id__=stops[seq_id_col].values, __dir__=stops[seq_direction_col].values,
+                         __stop__=np.arange(len(stops)))
+    pairs = key.merge(stops[['__id__', '__dir__', '__stop__', seq_seq_col]], on=['__id__', '__dir__'], how='inner')
+    pairs = pairs.sort_values(['__route__', seq_seq_col], kind='mergesort').reset_index(drop=True)
+
+    route_pos = pairs['__route__'].to_numpy()
+    stop_pos = pairs['__stop__'].to_numpy()
+    points = shapely.points(stops[seq_lng_col].to_numpy(dtype=float)[stop_pos],
+                            stops[seq_lat_col].to_numpy(dtype=float)[stop_pos])
+    measures = shapely.line_locate_point(lines[route_pos], points)
+
+    # 相鄰兩站（同一條路線）組成一個路段
+    j = np.flatnonzero(route_pos[1:] == route_pos[:-1])
+    geoms = substring_batch(lines, route_pos[j], measures[j], measures[j + 1])
+
+    def stop_value(col, rows):
+        if col not in stops.columns:
+            return np.full(len(rows), np.nan)
+        return stops[col].to_numpy()[stop_pos[rows]]
+
+    def route_value(col):
+        if col not in routes.columns:
+            return np.full(len(j), np.nan)
+        return routes[col].to_numpy()[route_pos[j]]
+
+    output = pd.DataFrame({
+        'RouteUID': stop_value('RouteUID', j),
+        'SRouteUID': route_value(route_id_col),
+        'Direction': route_value(route_direction_col),
+        'StartSeq': stop_value(seq_seq_col, j),
+        'EndSeq': stop_value(seq_seq_col, j + 1),
+        'StartOri': stop_value('Ori_seq', j),
+        'EndOri': stop_value('Ori_seq', j + 1),
+        'Len_route': route_value('Len_route'),
+    })
+    return gpd.GeoDataFrame(output, geometry=gpd.GeoSeries(geoms, crs=crs), crs=crs).reindex(columns=SEGMENT_COLUMNS)
+
+# ===== 各縣市平行處理 =====
+def _split_one_city(args) -> Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]:
+    """子程序執行：單一縣市的站點投影 + 路線拆分"""
+    routes, stops, cols = args
+    snapped = snap_stops_to_routes(stops, routes, cols['route_id_col'], cols['route_direction_col'],
+                                   cols['seq_id_col'], cols['seq_direction_col'],
+                                   cols['seq_lat_col'], cols['seq_lng_col'])
+    segments = split_routes_batch(routes, stops, **cols)
+    return snapped, segments
+
+def split_routes_by_city(busroute: gpd.GeoDataFrame, seq: gpd.GeoDataFrame,
+                         route_id_col: str = 'SubRouteUID', route_direction_col: str = 'Direction',
+                         seq_id_col: str = 'SubRouteUID', seq_direction_col: str = 'Direction',
+                         seq_seq_col: str = 'StopSequence', seq_lat_col: str = 'PositionLat', seq_lng_col: str = 'PositionLon',
+                         city_prefix_len: int = 3, max_workers: Optional[int] = None) -> Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]:
+    """
+    依縣市（UID 前綴，例如 TPE、NWT、TXG、KHH、THB）分組，以多程序同時執行站點投影與路線拆分。
+
+    Args:
+        busroute: 路線 GeoDataFrame
+        seq: 站序 GeoDataFrame（geometry 為原始站點）
+        city_prefix_len: UID 前幾碼代表縣市
+        max_workers: 程序數，None 代表依 CPU 核心數；1 代表不開子程序，直接在目前的程序執行
+
+    Returns:
+        (snapped, segments)：snap_stops_to_routes 與 split_routes_batch 的結果（各縣市合併）
+    """
+    cols = dict(route_id_col=route_id_col, route_direction_col=route_direction_col,
+                seq_id_col=seq_id_col, seq_direction_col=seq_direction_col,
+                seq_seq_col=seq_seq_col, seq_lat_col=seq_lat_col, seq_lng_col=seq_lng_col)
+
+    route_city = busroute[route_id_col].astype(str).str[:city_prefix_len]
+    seq_city = seq[seq_id_col].astype(str).str[:city_prefix_len]
+    tasks = [(busroute[route_city == city], seq[seq_city == city], cols) for city in pd.unique(seq_city)]
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = min(max_workers, len(tasks))
+
+    if max_workers <= 1:
+        results = [_split_one_city(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_split_one_city, tasks))
+
+    if not results:
+        return _split_one_city((busroute, seq, cols))
+    snapped = pd.concat([r[0] for r in results])
+    segments = pd.concat([r[1] for r in results], ignore_index=True)
+    return snapped, segments
@@ -0,0 +1,294 @@
+"""
+票證流程（pre01 → analytics02）的增量執行紀錄。
+
+manifest（JSON）記錄每個階段讀過的每個來源檔：
+  - CSV：大小、修改時間、檔案開頭與讀取位置前的雜湊、已讀到的位元組位置（offset）
+  - Parquet 資料夾：已讀過的 part 檔（大小、修改時間）
+  - 讀到的資料依 InfoDate 分區的筆數與內容雜湊（partitions）
+並記錄每個輸出被整份重寫的次數（outputs），上游重寫後下游一定整份重跑。
+
+下一次執行時，沒有變動的來源直接略過、只有附加資料的來源從 offset（或新的 part 檔）接著讀並追加到既有輸出，
+其餘（內容被改寫、輸出檔不見）才整份重跑。彙總階段比對輸入檔前後兩次的 partitions，只重算有變動的日期 / 月份。
+
+    manifest = load_manifest(manifest_path)
+    pending = source_changes(manifest, 'pre02', file, output=cleaned_output_path)
+    if pending['status'] != 'unchanged':
+        position, digest = {}, {}
+        with stage_writer(cleaned_output_path, append=is_appended(pending)) as write:
+            for chunk in iter_stage_chunks(file, position=position, **pending_reader_args(pending)):
+                update_partitions(digest, chunk)
+                write(chunk)
+        record_source(manifest, 'pre02', file, pending, position, digest, output=cleaned_output_path)
+        save_manifest(manifest, manifest_path)
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import os
+import pandas as pd
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+MANIFEST_VERSION = 1
+MANIFEST_FILE = '_runmanifest.json'
+HASH_WINDOW = 65536               # 比對檔案開頭、offset 前各多少位元組
+PARTITION_COLUMN = 'InfoDate'
+HASH_MODULUS = 2 ** 64
+
+# ===== manifest 讀寫 =====
+def load_manifest(path: str) -> Dict[str, Any]:
+    """讀取 manifest，不存在（或版本不同）時回傳空的 manifest"""
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('version') == MANIFEST_VERSION:
+                return manifest
+        except Exception as e:
+            print(f"Error reading manifest {path}: {e}")
+    return {'version': MANIFEST_VERSION, 'stages': {}, 'outputs': {}}
+
+def save_manifest(manifest: Dict[str, Any], path: str) -> None:
+    """先寫暫存檔再取代，執行中斷時不會留下寫到一半的 manifest"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    manifest['updated'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+def stage_sources(manifest: Dict[str, Any], stage: str) -> Dict[str, Any]:
+    """某個階段所有來源檔的紀錄（key 為來源檔的絕對路徑）"""
+    return manifest['stages'].setdefault(stage, {}).setdefault('sources', {})
+
+def _key(path: str) -> str:
+    return os.path.abspath(path)
+
+def _generation(manifest: Dict[str, Any], path: str) -> Optional[int]:
+    """path 若是流程中某個階段的輸出，回傳它被整份重寫的次數；原始資料為 None"""
+    return manifest.setdefault('outputs', {}).get(_key(path))
+
+def _params(params: Optional[Dict[str, Any]]) -> Any:
+    """參數以 JSON 的形式比對（tuple 與 list 視為相同）"""
+    return json.loads(json.dumps(params, ensure_ascii=False, default=str))
+
+# ===== 來源檔比對 =====
+def _hash_range(path: str, start: int, end: int) -> str:
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return hashlib.sha256(f.read(max(end - start, 0))).hexdigest()
+
+def _csv_state(path: str, offset: int) -> Dict[str, Any]:
+    stat = os.stat(path)
+    return {
+        'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'offset': offset,
+        'head_sha256': _hash_range(path, 0, min(HASH_WINDOW, offset)),
+        'tail_sha256': _hash_range(path, max(offset - HASH_WINDOW, 0), offset),
+    }
+
+def _parquet_files(path: str) -> Dict[str, List[int]]:
+    """Parquet 資料夾內所有 part 檔（相對路徑 → [大小, 修改時間]）"""
+    files = {}
+    for root, _, names in os.walk(path):
+        for name in names:
+            if name.endswith('.parquet'):
+                full = os.path.join(root, name)
+                stat = os.stat(full)
+                files[os.path.relpath(full, path)] = [stat.st_size, stat.st_mtime_ns]
+    return files
+
+def source_changes(manifest: Dict[str, Any], stage: str, path: str, output: Optional[str] = None,
+                   params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    比對來源檔與上次處理時的紀錄。
+
+    Args:
+        manifest: load_manifest 的結果
+        stage: 階段名稱（例如 'pre01'）
+        path: 來源檔（CSV 檔案或 Parquet 資料夾）
+        output: 這個來源的輸出路徑；與紀錄不同或已不存在時視為需要整份重跑
+        params: 影響輸出的參數（篩選日期、filters 等）；與上次不同時視為需要整份重跑
+
+    Returns:
+        dict:
+            status: 'new'（沒有紀錄）、'unchanged'、'appended'（只有附加資料）、'changed'（需整份重跑）
+            offset: CSV 從這個位元組位置開始讀（整份重跑為 0）
+            files: Parquet 只需讀取的 part 檔（絕對路徑），None 代表整個資料夾
+            state: Parquet 讀取前的 part 檔清單（record_source 用）
+    """
+    record = stage_sources(manifest, stage).get(_key(path))
+    is_parquet = path.endswith('.parquet')
+    full = {'status': 'new' if record is None else 'changed', 'offset': 0, 'files': None,
+            'state': _parquet_files(path) if is_parquet else None}
+
+    if record is None:
+        return full
+    if output is not None and (record.get('output') != _key(output) or not os.path.exists(output)):
+        return full
+    if record.get('params') != _params(params):
+        return full
+    if record.get('generation') != _generation(manifest, path):
+        return full
+
+    if is_parquet:
+        files = full['state']
+        done = record.get('files', {})
+        if any(files.get(name) != value for name, value in done.items()):
+            return full
+        new_files = sorted(name for name in files if name not in done)
+        if not new_files:
+            return dict(full, status='unchanged')
+        return dict(full, status='appended', files=[os.path.join(path, name) for name in new_files])
+
+    stat = os.stat(path)
+    offset = record.get('offset', 0)
+    if stat.st_size < offset:
+        return full
+    if stat.st_size == record.get('size'):
+        # 大小相同但修改時間不同，視為內容被改寫
+        return dict(full, status='unchanged', offset=offset) if stat.st_mtime_ns == record.get('mtime_ns') else full
+    # 變大時，檔案開頭與上次讀到位置之前的內容都沒變，才視為只有附加資料
+    if (_hash_range(path, 0, min(HASH_WINDOW, offset)) != record.get('head_sha256')
+            or _hash_range(path, max(offset - HASH_WINDOW, 0), offset) != record.get('tail_sha256')):
+        return full
+    return dict(full, status='appended', offset=offset)
+
+def record_source(manifest: Dict[str, Any], stage: str, path: str, pending: Dict[str, Any],
+                  position: Optional[Dict[str, int]] = None, partitions: Optional[Dict[str, List[int]]] = None,
+                  output: Optional[str] = None, params: Optional[Dict[str, Any]] = None) -> None:
+    """
+    處理完一個來源檔後更新紀錄。
+
+    Args:
+        pending: source_changes 的結果
+        position: CSV 讀完的位置（iter_stage_chunks / read_csv_from_offset 的 position）
+        partitions: 這次讀到的資料（update_partitions 的結果）；只有附加資料時與既有紀錄相加，否則取代
+        output: 這個來源的輸出路徑
+        params: 同 source_changes
+    """
+    sources = stage_sources(manifest, stage)
+    old = sources.get(_key(path), {})
+    appended = pending['status'] == 'appended'
+
+    if path.endswith('.parquet'):
+        record = {'files': pending['state']}
+    else:
+        offset = (position or {}).get('end', pending['offset'])
+        record = _csv_state(path, offset)
+    record['output'] = _key(output) if output is not None else None
+    record['params'] = _params(params)
+    record['generation'] = _generation(manifest, path)
+    record['partitions'] = merge_partitions(old.get('partitions', {}) if appended else {}, partitions or {})
+    sources[_key(path)] = record
+    if output is not None and not appended:
+        outputs = manifest.setdefault('outputs', {})
+        outputs[_key(output)] = outputs.get(_key(output), 0) + 1
+
+def full_pending(pending: Dict[str, Any]) -> Dict[str, Any]:
+    """改為整份重跑（同一個輸出由多個來源合併時，只要一個來源需要重跑，全部都要重讀）"""
+    return dict(pending, status='changed', offset=0, files=None)
+
+def pending_reader_args(pending: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """iter_stage_chunks 只讀取尚未處理部分的參數（offset / files），pending 為 None 時讀取全部"""
+    if pending is None:
+        return {}
+    return {'offset': pending['offset'], 'files': pending['files']}
+
+def is_appended(pending: Optional[Dict[str, Any]]) -> bool:
+    """輸出是否以追加的方式寫入（stage_writer 的 append）"""
+    return pending is not None and pending['status'] == 'appended'
+
+def forget_sources(manifest: Dict[str, Any], stage: str, keep: Optional[List[str]] = None) -> List[str]:
+    """移除 keep 以外的來源紀錄（來源檔已刪除），回傳被移除的來源"""
+    sources = stage_sources(manifest, stage)
+    keep = {_key(p) for p in (keep or [])}
+    removed = [p for p in sources if p not in keep]
+    for p in removed:
+        del sources[p]
+    return removed
+
+# ===== 分區雜湊 =====
+def update_partitions(partitions: Dict[str, List[int]], df: pd.DataFrame, column: str = PARTITION_COLUMN) -> Dict[str, List[int]]:
+    """
+    將一批資料依日期分區累加到 partitions（日期 → [筆數, 雜湊]）。
+    雜湊為每列雜湊值的總和（mod 2^64），與資料順序、分批方式無關，附加資料時可以直接相加。
+    """
+    if df.empty or column not in df.columns:
+        return partitions
+    dates = pd.to_datetime(df[column], errors='coerce').dt.strftime('%Y-%m-%d').fillna('NaT')
+    row_hash = pd.util.hash_pandas_object(df.astype(str), index=False)
+    grouped = pd.DataFrame({'date': dates.to_numpy(), 'hash': row_hash.to_numpy()}).groupby('date')['hash']
+    rows, hashes = grouped.size(), grouped.agg(lambda s: int(s.sum()) % HASH_MODULUS)
+    for date in rows.index:
+        n, h = partitions.get(date, [0, 0])
+        partitions[date] = [n + int(rows[date]), (h + int(hashes[date])) % HASH_MODULUS]
+    return partitions
+
+def merge_partitions(left: Dict[str, List[int]], right: Dict[str, List[int]]) -> Dict[str, List[int]]:
+    merged = {k: list(v) for k, v in left.items()}
+    for date, (n, h) in right.items():
+        old_n, old_h = merged.get(date, [0, 0])
+        merged[date] = [old_n + n, (old_h + h) % HASH_MODULUS]
+    return merged
+
+def stage_partitions(manifest: Dict[str, Any], stage: str) -> Dict[str, List[int]]:
+    """某個階段所有來源檔的分區合計"""
+    total = {}
+    for record in stage_sources(manifest, stage).values():
+        total = merge_partitions(total, record.get('partitions', {}))
+    return total
+
+def changed_partitions(old: Dict[str, List[int]], new: Dict[str, List[int]]) -> List[str]:
+    """筆數或雜湊不同的日期（包含新增、已消失的日期）"""
+    return sorted(d for d in set(old) | set(new) if old.get(d) != new.get(d))
+
+# ===== 彙總表合併 =====
+INTEGER_TEXT = r'^-?\d+$'
+FLOAT_TEXT = r'^-?\d+\.\d+$'
+
+def _as_text(df: pd.DataFrame) -> pd.DataFrame:
+    """鍵值一律以 CSV 文字比對（3 與 3.0 視為相同）"""
+    return df.astype(str).replace(r'^(-?\d+)\.0$', r'\1', regex=True)
+
+def _float_spelling(existing: pd.DataFrame, delta: pd.DataFrame, columns: List[str], fill_value: Optional[str]) -> None:
+    """
+    整份重跑時，欄位中只要有一個小數（例如缺值讓整欄變成 float），pandas 就把整數也寫成 4.0；
+    合併時比照辦理：既有檔或新增資料任一邊有小數的欄位，兩邊的整數都補上 .0（缺值代碼 fill_value 維持原樣）。
+    """
+    for col in columns:
+        if not (existing[col].str.match(FLOAT_TEXT).any() or delta[col].str.match(FLOAT_TEXT).any()):
+            continue
+        for df in (existing, delta):
+            integer = df[col].str.match(INTEGER_TEXT) & (df[col] != fill_value)
+            df.loc[integer, col] = df.loc[integer, col] + '.0'
+
+def merge_aggregate(path: str, delta: pd.DataFrame, value_columns: List[str] = ['Count'],
+                    fill_value: Optional[str] = '-99') -> pd.DataFrame:
+    """
+    將新增資料的彙總結果（delta）合併到既有的彙總表 CSV：相同鍵值的 value_columns 相加，新的鍵值附加在後面。
+    鍵值只在分組時忽略 3 與 3.0 的差異，寫出的文字與整份重跑相同。
+
+    Args:
+        fill_value: 鍵值欄位的缺值代碼（分析01 為 '-99'），不隨欄位補上 .0
+
+    Returns:
+        pd.DataFrame: 合併後的結果（欄位順序同 delta），由呼叫端寫出
+    """
+    existing = pd.read_csv(path, dtype=str, keep_default_na=False, encoding='utf-8-sig')
+    existing = existing.reindex(columns=delta.columns).fillna('')
+    delta = pd.read_csv(io.StringIO(delta.to_csv(index=False)), dtype=str, keep_default_na=False)
+    keys = [c for c in delta.columns if c not in value_columns]
+    _float_spelling(existing, delta, keys, fill_value)
+
+    merged = pd.concat([existing, delta], ignore_index=True)
+    for col in value_columns:
+        merged[col] = pd.to_numeric(merged[col], errors='coerce').fillna(0)
+    group = _as_text(merged[keys]).groupby(keys, sort=False, dropna=False).ngroup()
+    merged = merged.groupby(group.to_numpy(), sort=False).agg({**{k: 'first' for k in keys}, **{c: 'sum' for c in value_columns}})
+    for col in value_columns:
+        if (merged[col] % 1 == 0).all():
+            merged[col] = merged[col].astype('int64')
+    return merged[list(delta.columns)].reset_index(drop=True)
@@ -0,0 +1,159 @@
+"""
+屏柵線通過量：直接由起訖資料（分時計次或票證）計算各 TRTS5 屏柵線的公車乘客通過量。
+
+03_SelectSegment 選出的路段（公車路線片段選取結果.csv）記錄每條路線的哪一段（起站序 → 迄站序）
+通過哪一條屏柵線、往哪個方向。build_crossings 把它整理成每條（路線、屏柵線）的通過位置陣列（依站序排序），
+一筆起訖 [上車站序, 下車站序) 通過的次數就是陣列在兩個站序的累計值相減：
+
+    通過次數 = C(下車站序) - C(上車站序)，C(k) = 起站序 < k 的通過路段數（= searchsorted 的位置）
+
+所有起訖列與所有（路線、屏柵線）一次以 searchsorted 查詢，再依屏柵線 × 時段加總，
+不需要先展開成每站 × 每小時的站間量表。
+
+    crossings = crossings_from_csv('公車路線片段選取結果.csv')
+    volume = screenline_volume(df_hourlycount, crossings)                  # 屏柵線、方向 × 月份、平假日、小時
+    volume = screenline_volume_from_csv(hourlycount_file, crossings)       # 分批讀取
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from keydict import as_key, concat_ranges
+from odmatrix import ROUTE_COLUMNS, PERIOD_COLUMNS
+
+SCREENLINE_COLUMNS = ['TRTS5', 'MoveDir']
+SEGMENT_ROUTE_COLUMNS = {'RouteUID': 'RouteUID', 'SRouteUID': 'SubRouteUID', 'Direction': 'Direction'}
+
+# ===== 通過位置 =====
+def build_crossings(route_in_buffer: pd.DataFrame, screenline_columns: Sequence[str] = SCREENLINE_COLUMNS,
+                    route_columns: Dict[str, str] = SEGMENT_ROUTE_COLUMNS,
+                    seq_columns: Sequence[str] = ('StartOri', 'StartSeq')) -> Dict[str, Any]:
+    """
+    由 03_SelectSegment 選出的路段建立屏柵線通過位置。
+
+    Args:
+        route_in_buffer: 路段與屏柵線的對應（每列一個路段，需有 route_columns、screenline_columns 與起站序）
+        screenline_columns: 屏柵線鍵值，預設為 TRTS5 + 行進方向（MoveDir）
+        route_columns: 路段欄位 → 起訖資料的路線欄位（路段的 SRouteUID 即 SubRouteUID）
+        seq_columns: 起站序欄位，依序取第一個有值的欄位。StartOri 為 TDX 原始站序（與票證相同），
+                     02 沒有重新編號站序時為空，改用 StartSeq
+
+    Returns:
+        dict:
+            screenlines: 屏柵線對照表（screenline_columns），index 為屏柵線代碼
+            pairs: （路線、屏柵線）對照表（ROUTE_COLUMNS + screenline 代碼），index 為 pair 代碼，依路線排序
+            route_keys: pairs 的路線鍵值（MultiIndex，給起訖資料查詢）
+            pair_ptr: 路線 i 的 pair 位於 [pair_ptr[i], pair_ptr[i + 1])
+            positions: 依 (pair, 起站序) 排序的起站序；pair p 的通過位置為 positions[pos_ptr[p]:pos_ptr[p + 1]]
+            pos_ptr: 同 CSR 的 indptr
+    """
+    seg = route_in_buffer.rename(columns=route_columns)
+    seq = pd.Series(np.nan, index=seg.index)
+    for col in seq_columns:
+        if col in seg.columns:
+            seq = seq.fillna(pd.to_numeric(seg[col], errors='coerce'))
+    seg = seg.assign(__seq__=seq)[seq.notna()]
+
+    # 同一路段對同一屏柵線只算一次（remove_duplicate_route 之後仍可能有多個調查點位對應同一屏柵線）
+    keys = seg[ROUTE_COLUMNS + list(screenline_columns)].apply(as_key)
+    keys['__seq__'] = seg['__seq__'].to_numpy()
+    keys = keys.drop_duplicates()
+
+    screenline_codes, screenline_index = pd.MultiIndex.from_frame(keys[list(screenline_columns)]).factorize(sort=True)
+    keys['screenline'] = screenline_codes
+    keys = keys.sort_values(ROUTE_COLUMNS + ['screenline', '__seq__'], kind='mergesort').reset_index(drop=True)
+
+    pair_codes, pair_index = pd.MultiIndex.from_frame(keys[ROUTE_COLUMNS + ['screenline']]).factorize(sort=True)
+    pairs = pair_index.to_frame(index=False, name=ROUTE_COLUMNS + ['screenline'])
+    route_codes, route_keys = pd.MultiIndex.from_frame(pairs[ROUTE_COLUMNS]).factorize(sort=True)
+
+    return {
+        'screenlines': screenline_index.to_frame(index=False, name=list(screenline_columns)),
+        'pairs': pairs,
+        'route_keys': route_keys,
+        'pair_ptr': np.concatenate([[0], np.cumsum(np.bincount(route_codes, minlength=len(route_keys)))]),
+        'positions': keys['__seq__'].to_numpy(dtype=float),
+        'pos_ptr': np.concatenate([[0], np.cumsum(np.bincount(pair_codes, minlength=len(pairs)))]),
+    }
+
+def crossings_from_csv(path: str, **kwargs) -> Dict[str, Any]:
+    """讀取 03_SelectSegment 的輸出（公車路線片段選取結果.csv）建立通過位置，參數同 build_crossings"""
+    return build_crossings(pd.read_csv(path, encoding='utf-8-sig'), **kwargs)
+
+# ===== 通過次數 =====
+def crossing_counts(crossings: Dict[str, Any], route: pd.DataFrame, board, deboard) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    每筆起訖通過各屏柵線的次數（只回傳次數大於 0 的組合）。
+
+    Args:
+        route: 起訖資料的路線欄位（ROUTE_COLUMNS）
+        board, deboard: 上、下車站序
+
+    Returns:
+        (row, screenline, times)：起訖列位置、屏柵線代碼、通過次數
+    """
+    board = pd.to_numeric(pd.Series(np.asarray(board)), errors='coerce').to_numpy(dtype=float)
+    deboard = pd.to_numeric(pd.Series(np.asarray(deboard)), errors='coerce').to_numpy(dtype=float)
+    r = crossings['route_keys'].get_indexer(pd.MultiIndex.from_frame(route[ROUTE_COLUMNS].apply(as_key)))
+
+    # 只有路線有通過屏柵線、站序有效（> 0）且上車站序 < 下車站序的列需要查詢
+    ok = np.flatnonzero((r >= 0) & (board > 0) & (board < deboard))
+    pair_ptr = crossings['pair_ptr']
+    n_pairs = pair_ptr[r[ok] + 1] - pair_ptr[r[ok]]
+    row = np.repeat(ok, n_pairs)
+    pair = np.repeat(pair_ptr[r[ok]], n_pairs) + concat_ranges(n_pairs)
+
+    # positions 依 (pair, 起站序) 排序，以 pair * stride + 站序 為複合鍵，所有查詢一次 searchsorted
+    positions, pos_ptr = crossings['positions'], crossings['pos_ptr']
+    stride = max(positions.max(initial=0), deboard[ok].max(initial=0)) + 1
+    keys = np.repeat(np.arange(len(pos_ptr) - 1), np.diff(pos_ptr)) * stride + positions
+
+    def cumulative(seq):
+        # C(k)：同一 pair 中起站序 < k 的通過位置數
+        return np.searchsorted(keys, pair * stride + seq, side='left') - pos_ptr[pair]
+
+    times = cumulative(deboard[row]) - cumulative(board[row])
+    hit = times > 0
+    return row[hit], crossings['pairs']['screenline'].to_numpy()[pair[hit]], times[hit]
+
+# ===== 通過量 =====
+def screenline_volume(df: pd.DataFrame, crossings: Dict[str, Any], period_columns: Sequence[str] = PERIOD_COLUMNS,
+                      value: Optional[str] = 'Count', board: str = 'BoardingStopSequence',
+                      deboard: str = 'DeboardingStopSequence') -> pd.DataFrame:
+    """
+    屏柵線 × 時段的通過量。時段以上車時間為準（例如 BoardingHour），同 analytics02 的上車小時。
+
+    Args:
+        df: 起訖資料（分時計次或票證），需有 ROUTE_COLUMNS、上下車站序、period_columns（Month 可由 InfoDate 產生）
+        crossings: build_crossings 的結果
+        value: 每列代表的人次欄位（分時計次為 Count）；None 代表每列一人次（票證）
+
+    Returns:
+        pd.DataFrame: 屏柵線欄位 + period_columns + Volume（只列出通過量大於 0 的組合，依屏柵線、時段排序）
+    """
+    if 'Month' in period_columns and 'Month' not in df.columns:
+        df = df.assign(Month=df['InfoDate'].astype(str).str[:7])
+
+    row, screenline, times = crossing_counts(crossings, df, df[board].to_numpy(), df[deboard].to_numpy())
+    weight = times if value is None else times * pd.to_numeric(df[value], errors='coerce').fillna(0).to_numpy()[row]
+
+    periods = df[list(period_columns)].iloc[row].apply(as_key).reset_index(drop=True)
+    volume = periods.assign(screenline=screenline, Volume=weight)
+    volume = volume.groupby(['screenline'] + list(period_columns), sort=True)['Volume'].sum().reset_index()
+    volume = volume.join(crossings['screenlines'], on='screenline')
+    return volume[list(crossings['screenlines'].columns) + list(period_columns) + ['Volume']]
+
+def screenline_volume_from_csv(path: str, crossings: Dict[str, Any], period_columns: Sequence[str] = PERIOD_COLUMNS,
+                               value: Optional[str] = 'Count', chunksize: int = 1000000) -> pd.DataFrame:
+    """分批讀取起訖資料 CSV（例如分時計次）計算通過量，參數同 screenline_volume"""
+    usecols = set(ROUTE_COLUMNS + ['BoardingStopSequence', 'DeboardingStopSequence', 'InfoDate']
+                  + list(period_columns) + ([value] if value else []))
+    parts = [screenline_volume(chunk, crossings, period_columns, value)
+             for chunk in pd.read_csv(path, usecols=lambda c: c in usecols, dtype=str, chunksize=chunksize)]
+    keys = list(crossings['screenlines'].columns) + list(period_columns)
+    if not parts:
+        return pd.DataFrame(columns=keys + ['Volume'])
+    return pd.concat(parts, ignore_index=True).groupby(keys, sort=True)['Volume'].sum().reset_index()
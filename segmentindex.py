@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import numpy as np
+import os
+import pickle
+import pandas as pd
+import geopandas as gpd
+import shapely
+from shapely.ops import linemerge
+from typing import Any, Dict, Tuple
+
+SEGMENT_INDEX_SUFFIX = '.strtree.pkl'
+SEGMENT_INDEX_VERSION = 1
+SHAPEFILE_PARTS = ['.shp', '.shx', '.dbf', '.prj', '.cpg']
+
+LINE_TYPE_IDS = [1, 2, 5]        # LineString、LinearRing、MultiLineString
+COLLECTION_TYPE_ID = 7           # GeometryCollection
+
+# ===== 索引檔 =====
+def segment_index_path(segment_path: str) -> str:
+    """索引檔與路段檔放在同一個資料夾，例如 gdf_segment_routes_TWD97.shp → gdf_segment_routes_TWD97.strtree.pkl"""
+    return os.path.splitext(segment_path)[0] + SEGMENT_INDEX_SUFFIX
+
+def _source_signature(segment_path: str) -> Dict[str, Any]:
+    """路段檔（shapefile 含 .shx/.dbf 等附屬檔）的大小與修改時間，任何一個改變就重建索引"""
+    stem, ext = os.path.splitext(segment_path)
+    parts = SHAPEFILE_PARTS if ext.lower() == '.shp' else [ext]
+    signature = {}
+    for part in parts:
+        path = stem + part
+        if os.path.exists(path):
+            stat = os.stat(path)
+            signature[part] = [stat.st_size, stat.st_mtime_ns]
+    return signature
+
+def build_segment_index(gdf_segment: gpd.GeoDataFrame) -> Dict[str, Any]:
+    """
+    以路段建立 STRtree 空間索引。
+
+    Returns:
+        dict: segments（路段，index 重設為 0..n-1）、geoms（幾何陣列）、tree（shapely.STRtree）
+    """
+    segments = gdf_segment.reset_index(drop=True)
+    geoms = np.asarray(segments.geometry.values, dtype=object)
+    return {'segments': segments, 'geoms': geoms, 'tree': shapely.STRtree(geoms)}
+
+def load_segment_index(segment_path: str, rebuild: bool = False) -> Dict[str, Any]:
+    """
+    讀取路段檔與其 STRtree 索引。索引檔（segment_index_path）存在且路段檔沒有變動時直接載入，
+    否則重新讀取路段檔、建立索引並存回路段檔旁邊。
+
+    Args:
+        segment_path: 路段檔路徑（例如 gdf_segment_routes_TWD97.shp）
+        rebuild: True 時不論索引檔是否有效都重建
+
+    Returns:
+        dict: build_segment_index 的結果
+    """
+    index_path = segment_index_path(segment_path)
+    signature = _source_signature(segment_path)
+
+    if not rebuild and os.path.exists(index_path):
+        try:
+            with open(index_path, 'rb') as f:
+                cached = pickle.load(f)
+            if cached.get('version') == SEGMENT_INDEX_VERSION and cached.get('signature') == signature:
+                return cached['index']
+        except Exception as e:
+            print(f"Error reading segment index {index_path}: {e}")
+
+    index = build_segment_index(gpd.read_file(segment_path))
+    try:
+        with open(index_path, 'wb') as f:
+            pickle.dump({'version': SEGMENT_INDEX_VERSION, 'signature': signature, 'index': index}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        print(f"Error writing segment index {index_path}: {e}")
+    return index
+
+# ===== 查詢與切割 =====
+def query_segments(index: Dict[str, Any], gdf_mask: gpd.GeoDataFrame, predicate: str = 'intersects') -> Tuple[np.ndarray, np.ndarray]:
+    """
+    以索引查詢與 gdf_mask（屏柵線、調查點環域等）相交的路段。
+
+    Returns:
+        (segment_idx, mask_idx)：依 (路段, 範圍) 排序的配對位置，順序同 gpd.overlay
+    """
+    mask_idx, segment_idx = index['tree'].query(np.asarray(gdf_mask.geometry.values, dtype=object), predicate=predicate)
+    order = np.lexsort((mask_idx, segment_idx))
+    return segment_idx[order], mask_idx[order]
+
+def _keep_lines(geoms: np.ndarray) -> np.ndarray:
+    """GeometryCollection 只保留其中的線段（同 overlay 的 keep_geom_type）"""
+    geoms = geoms.copy()
+    for i in np.flatnonzero(shapely.get_type_id(geoms) == COLLECTION_TYPE_ID):
+        parts = shapely.get_parts(geoms[i])
+        parts = parts[np.isin(shapely.get_type_id(parts), LINE_TYPE_IDS)]
+        geoms[i] = shapely.union_all(parts) if len(parts) else None
+    return geoms
+
+def clip_segments(index: Dict[str, Any], gdf_mask: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """
+    先以索引查詢、再只對候選配對做切割，結果與
+    gpd.overlay(segments, gdf_mask, how="intersection") 相同（欄位名稱衝突時加上 _1 / _2、只保留線段）。
+    範圍改變（例如環域距離、新增調查點）時只需重新呼叫本函式，不必重建索引。
+
+    Args:
+        index: build_segment_index / load_segment_index 的結果
+        gdf_mask: 範圍（polygon），crs 需與路段相同
+
+    Returns:
+        gpd.GeoDataFrame: 路段欄位 + 範圍欄位 + 交集後的 geometry
+    """
+    segments = index['segments']
+    mask = gdf_mask.reset_index(drop=True)
+    segment_idx, mask_idx = query_segments(index, mask)
+
+    geoms = shapely.intersection(index['geoms'][segment_idx], np.asarray(mask.geometry.values, dtype=object)[mask_idx])
+    geoms = _keep_lines(geoms)
+    keep = np.isin(shapely.get_type_id(geoms), LINE_TYPE_IDS)
+    segment_idx, mask_idx, geoms = segment_idx[keep], mask_idx[keep], geoms[keep]
+
+    left = segments.drop(columns=segments.geometry.name).iloc[segment_idx].reset_index(drop=True)
+    right = mask.drop(columns=mask.geometry.name).iloc[mask_idx].reset_index(drop=True)
+    common = left.columns.intersection(right.columns)
+    left = left.rename(columns={c: f'{c}_1' for c in common})
+    right = right.rename(columns={c: f'{c}_2' for c in common})
+
+    return gpd.GeoDataFrame(pd.concat([left, right], axis=1), geometry=geoms, crs=segments.crs)
+
+# ===== 行進方向 =====
+def line_endpoints(geoms) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    向量化的 get_line_endpoints：回傳每條線的起點、終點座標 (n, 2)，無法取得者為 NaN。
+    MultiLineString 先 linemerge，仍不連續時取最長的一段。
+    """
+    geoms = np.asarray(geoms, dtype=object).copy()
+    type_id = shapely.get_type_id(geoms)
+    for i in np.flatnonzero(type_id == 5):
+        merged = linemerge(geoms[i])
+        if shapely.get_type_id(merged) == 5:
+            parts = shapely.get_parts(merged)
+            merged = parts[np.argmax(shapely.length(parts))]
+        geoms[i] = merged
+    is_line = (shapely.get_type_id(geoms) == 1) & ~shapely.is_empty(geoms)
+
+    start = np.full((len(geoms), 2), np.nan)
+    end = np.full((len(geoms), 2), np.nan)
+    coords, which = shapely.get_coordinates(geoms[is_line], return_index=True)
+    if len(coords):
+        first = np.r_[True, which[1:] != which[:-1]]
+        last = np.r_[which[1:] != which[:-1], True]
+        rows = np.flatnonzero(is_line)
+        start[rows] = coords[first]
+        end[rows] = coords[last]
+    return start, end
+
+def line_angle(geoms) -> np.ndarray:
+    """向量化的 angle_math：起點 → 終點的數學角度（東為 0、逆時針，0~360），無法計算者為 NaN"""
+    start, end = line_endpoints(geoms)
+    angle = np.degrees(np.arctan2(end[:, 1] - start[:, 1], end[:, 0] - start[:, 0]))
+    return (angle + 360) % 360
+
+def move_direction(angle, spdir) -> np.ndarray:
+    """向量化的 get_move_dir：依調查點的方向類型（往南/往北、往東/往西）將角度轉為 南/北/東/西"""
+    angle = np.asarray(angle, dtype=float) % 360
+    spdir = np.asarray(spdir, dtype=object)
+    valid = ~np.isnan(angle)
+    ns = valid & (spdir == '往南/往北')
+    ew = valid & (spdir == '往東/往西')
+    out = np.full(len(angle), None, dtype=object)
+    out[ns] = np.where(angle[ns] < 180, '北', '南')
+    out[ew] = np.where((angle[ew] >= 315) | (angle[ew] < 135), '東', '西')
+    return out
@@ -0,0 +1,213 @@
+"""
+票證站點 → TDX 站點座標的比對索引，補上 match_stop_coordinates 前兩階段（StopUID + 站名、StopUID）比對不到的站點。
+
+索引（build_stop_index）一次建好，之後每批票證站點都只做陣列查詢：
+    uid        : StopUID 雜湊索引 → 站名、座標（同前兩階段）
+    route_name : (路線, 正規化站名) → 該路線所有同名站點（環狀路線起訖站同名時有多筆）
+    route_seq  : (路線, 站序) → 站點座標，作為票證站點的位置錨點
+    tree       : 所有站點 TWD97 座標的 KD-tree（scipy cKDTree）
+
+第三階段（resolve_unmatched_stops）對每個比對不到的站點：
+    1. route_name：同路線同名（正規化後）的站點，多筆時取離錨點最近者
+    2. nearby_name：錨點半徑內的站點中，站名相似度最高、距離最近者
+"""
+
+from __future__ import annotations
+
+import re
+import unicodedata
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, Sequence
+
+from keydict import as_key, concat_ranges
+
+STOP_ROUTE_COLUMNS = ['RouteUID', 'SubRouteUID', 'Direction']
+MATCH_STAGES = {1: 'StopUID + 站名', 2: 'StopUID', 3: '同路線站名', 4: '鄰近站名'}
+_BRACKETS = re.compile(r'\(.*?\)|\[.*?\]')
+_SPACES = re.compile(r'\s+')
+
+# ===== 站名正規化 =====
+def normalize_stop_name(names: Sequence[Any]) -> np.ndarray:
+    """
+    站名正規化：全形轉半形（NFKC）、去除空白、臺 → 台、去掉結尾的「站」。
+    只轉換不重複的值，缺值為空字串。
+    """
+    codes, uniques = pd.factorize(pd.Series(list(names), dtype=object))
+    normalized = [_SPACES.sub('', unicodedata.normalize('NFKC', str(x))).replace('臺', '台') for x in uniques]
+    normalized = np.array([x[:-1] if len(x) > 1 and x.endswith('站') else x for x in normalized] + [''], dtype=object)
+    return normalized[codes]
+
+def base_stop_name(normalized: np.ndarray) -> np.ndarray:
+    """去掉括號內的說明（例如方向、站位）後的站名"""
+    codes, uniques = pd.factorize(pd.Series(normalized, dtype=object))
+    base = np.array([_BRACKETS.sub('', x) or x for x in uniques] + [''], dtype=object)
+    return base[codes]
+
+def name_similarity(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    兩組正規化站名的相似度：2 = 相同；1 = 去掉括號後相同，或其中一個包含另一個（至少兩個字）；0 = 不相似
+    """
+    a_base, b_base = base_stop_name(a), base_stop_name(b)
+    similarity = np.zeros(len(a), dtype=np.int8)
+    for i, (x, y, bx, by) in enumerate(zip(a, b, a_base, b_base)):
+        if not x or not y:
+            continue
+        if x == y:
+            similarity[i] = 2
+        elif bx == by or (min(len(bx), len(by)) >= 2 and (bx in by or by in bx)):
+            similarity[i] = 1
+    return similarity
+
+# ===== 比對索引 =====
+def _to_twd97(lon: np.ndarray, lat: np.ndarray):
+    from pyproj import Transformer
+    return Transformer.from_crs('EPSG:4326', 'EPSG:3826', always_xy=True).transform(lon, lat)
+
+def build_stop_index(df_seq: pd.DataFrame, route_columns: Sequence[str] = STOP_ROUTE_COLUMNS,
+                     col_uid: str = 'StopUID', col_name: str = 'StopName_Zh', col_seq: str = 'StopSequence',
+                     col_lon: str = 'PositionLon', col_lat: str = 'PositionLat') -> Dict[str, Any]:
+    """
+    由 TDX 站序資料建立站點比對索引（給 resolve_unmatched_stops 使用）。
+
+    Args:
+        df_seq: TDX 站序資料（每條路線、方向的每個站點一列，需有座標）
+        route_columns: 路線鍵值欄位，需與票證站點的欄位名稱相同
+
+    Returns:
+        dict: uid / route_name / route_seq 查詢索引、站點座標（經緯度與 TWD97）與 KD-tree
+    """
+    from scipy.spatial import cKDTree
+
+    route_columns = list(route_columns)
+    seq = df_seq.reindex(columns=route_columns + [col_uid, col_name, col_seq, col_lon, col_lat]).copy()
+    seq[col_lon] = pd.to_numeric(seq[col_lon], errors='coerce')
+    seq[col_lat] = pd.to_numeric(seq[col_lat], errors='coerce')
+    seq = seq[seq[col_lon].notna() & seq[col_lat].notna()].reset_index(drop=True)
+    seq[route_columns + [col_uid]] = seq[route_columns + [col_uid]].apply(as_key)
+    seq['__norm__'] = normalize_stop_name(seq[col_name])
+    seq['__seq__'] = pd.to_numeric(seq[col_seq], errors='coerce')
+    seq['__x__'], seq['__y__'] = _to_twd97(seq[col_lon].to_numpy(), seq[col_lat].to_numpy())
+
+    # StopUID 一筆（同 drop_duplicates(subset=[StopUID])），KD-tree 也建在這些站點上
+    stops = seq.drop_duplicates(subset=[col_uid]).reset_index(drop=True)
+
+    # 同路線同名的所有站點：依 (路線, 站名) 排序後以 CSR 指標取出
+    by_name = seq.sort_values(route_columns + ['__norm__', '__seq__'], kind='mergesort').reset_index(drop=True)
+    codes, route_name = pd.MultiIndex.from_frame(by_name[route_columns + ['__norm__']]).factorize()
+    by_seq = seq[seq['__seq__'].notna()].drop_duplicates(subset=route_columns + ['__seq__'])
+
+    return {
+        'route_columns': route_columns,
+        'uid': pd.Index(stops[col_uid]),
+        'uid_name': stops[col_name].to_numpy(dtype=object),
+        'uid_norm': stops['__norm__'].to_numpy(dtype=object),
+        'uid_lon': stops[col_lon].to_numpy(dtype=float),
+        'uid_lat': stops[col_lat].to_numpy(dtype=float),
+        'tree': cKDTree(np.column_stack([stops['__x__'], stops['__y__']])),
+        'route_name': route_name,
+        'route_name_ptr': np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(route_name)))]),
+        'route_name_uid': by_name[col_uid].to_numpy(dtype=object),
+        'route_name_seq': by_name['__seq__'].to_numpy(dtype=float),
+        'route_name_xy': by_name[['__x__', '__y__']].to_numpy(dtype=float),
+        'route_seq': pd.MultiIndex.from_arrays([by_seq[c] for c in route_columns] + [by_seq['__seq__'].to_numpy(dtype=float)]),
+        'route_seq_xy': by_seq[['__x__', '__y__']].to_numpy(dtype=float),
+    }
+
+# ===== 第三階段比對 =====
+def resolve_unmatched_stops(dfstop: pd.DataFrame, index: Dict[str, Any], col_uid: str = 'StopUID',
+                            col_name: str = 'StopName_Zh', col_seq: str = 'StopSequence',
+                            radius: float = 300, k: int = 8) -> pd.DataFrame:
+    """
+    以同路線站名與鄰近站點比對 StopUID 對不到的票證站點（一次處理所有站點，不逐列查詢）。
+
+    Args:
+        dfstop: 比對不到座標的票證站點，需有 index['route_columns']、col_name、col_seq
+        index: build_stop_index 的結果
+        radius: nearby_name 以錨點（同路線同站序的 TDX 站點）為中心的搜尋半徑（公尺，TWD97）
+        k: nearby_name 每個錨點最多比較的鄰近站點數
+
+    Returns:
+        pd.DataFrame（index 同 dfstop）：MatchStopUID、MatchStopName、PositionLon、PositionLat、
+            MatchStage（3 = 同路線站名、4 = 鄰近站名、NaN = 仍比對不到）、MatchDistance（與錨點的距離，公尺）
+    """
+    route_columns = index['route_columns']
+    result = pd.DataFrame({'MatchStopUID': None, 'MatchStopName': None, 'PositionLon': np.nan, 'PositionLat': np.nan,
+                           'MatchStage': np.nan, 'MatchDistance': np.nan}, index=dfstop.index)
+    if dfstop.empty:
+        return result
+
+    # 相同的 (路線, 站名, 站序) 只比對一次
+    keys = dfstop[route_columns].apply(as_key)
+    keys['__norm__'] = normalize_stop_name(dfstop[col_name])
+    keys['__seq__'] = pd.to_numeric(dfstop[col_seq], errors='coerce').to_numpy(dtype=float)
+    row_code, queries = pd.MultiIndex.from_frame(keys).factorize()
+    queries = queries.to_frame(index=False, name=list(keys.columns))
+    n = len(queries)
+    norm, ticket_seq = queries['__norm__'].to_numpy(dtype=object), queries['__seq__'].to_numpy(dtype=float)
+
+    # 錨點：同路線同站序的 TDX 站點座標
+    pos = index['route_seq'].get_indexer(pd.MultiIndex.from_arrays([queries[c] for c in route_columns] + [ticket_seq]))
+    anchor = np.full((n, 2), np.nan)
+    anchor[pos >= 0] = index['route_seq_xy'][pos[pos >= 0]]
+    has_anchor = ~np.isnan(anchor[:, 0])
+
+    match_uid = np.full(n, None, dtype=object)
+    stage = np.full(n, np.nan)
+    distance = np.full(n, np.nan)
+
+    # ---- 1. 同路線同名：多筆時取離錨點最近者（沒有錨點時取站序最接近者）----
+    name_pos = index['route_name'].get_indexer(pd.MultiIndex.from_frame(queries[route_columns + ['__norm__']]))
+    q = np.flatnonzero((name_pos >= 0) & (norm != ''))
+    ptr = index['route_name_ptr']
+    n_cand = ptr[name_pos[q] + 1] - ptr[name_pos[q]]
+    cand_q = np.repeat(q, n_cand)
+    cand = np.repeat(ptr[name_pos[q]], n_cand) + concat_ranges(n_cand)
+    cand_dist = np.hypot(*(index['route_name_xy'][cand] - anchor[cand_q]).T)
+    seq_gap = np.abs(index['route_name_seq'][cand] - ticket_seq[cand_q])
+    score = np.where(has_anchor[cand_q], cand_dist, np.nan_to_num(seq_gap, nan=np.inf))
+    order = np.lexsort((score, cand_q))
+    best = order[np.r_[True, cand_q[order][1:] != cand_q[order][:-1]]] if len(order) else order
+    match_uid[cand_q[best]] = index['route_name_uid'][cand[best]]
+    stage[cand_q[best]] = 3
+    distance[cand_q[best]] = cand_dist[best]
+
+    # ---- 2. 錨點半徑內站名相似的站點：相似度高者優先，其次距離近者 ----
+    q = np.flatnonzero(np.isnan(stage) & has_anchor & (norm != ''))
+    if len(q) and len(index['uid']):
+        dist, nearest = index['tree'].query(anchor[q], k=min(k, len(index['uid'])), distance_upper_bound=radius)
+        dist, nearest = dist.reshape(len(q), -1), nearest.reshape(len(q), -1)
+        valid = np.isfinite(dist)
+        pair_q, pair_stop, pair_dist = np.repeat(q, valid.sum(axis=1)), nearest[valid], dist[valid]
+        similarity = name_similarity(norm[pair_q], index['uid_norm'][pair_stop])
+        ok = similarity > 0
+        pair_q, pair_stop, pair_dist, similarity = pair_q[ok], pair_stop[ok], pair_dist[ok], similarity[ok]
+        order = np.lexsort((pair_dist, -similarity, pair_q))
+        best = order[np.r_[True, pair_q[order][1:] != pair_q[order][:-1]]] if len(order) else order
+        match_uid[pair_q[best]] = index['uid'].to_numpy()[pair_stop[best]]
+        stage[pair_q[best]] = 4
+        distance[pair_q[best]] = pair_dist[best]
+
+    # 比對到的 StopUID 取站名與座標
+    found = np.flatnonzero(~np.isnan(stage))
+    uid_pos = index['uid'].get_indexer(match_uid[found])
+    matched = pd.DataFrame({'MatchStopUID': match_uid[found], 'MatchStopName': index['uid_name'][uid_pos],
+                            'PositionLon': index['uid_lon'][uid_pos], 'PositionLat': index['uid_lat'][uid_pos],
+                            'MatchStage': stage[found], 'MatchDistance': distance[found]}, index=found)
+    matched = matched.reindex(np.arange(n))
+    return matched.iloc[row_code].set_index(dfstop.index).astype({'MatchStopUID': object, 'MatchStopName': object})
+
+# ===== 比對結果 =====
+def match_summary(df: pd.DataFrame, stage_column: str = 'MatchStage', count_column: str = 'Count') -> pd.DataFrame:
+    """
+    各階段比對到的站點數與票數（含仍比對不到者）。
+
+    Returns:
+        pd.DataFrame: 階段、說明、站點數、票數、票數比例
+    """
+    stage = df[stage_column].fillna(0).astype(int)
+    summary = df.groupby(stage)[count_column].agg(['size', 'sum']).rename(columns={'size': '站點數', 'sum': '票數'})
+    summary = summary.reindex(sorted(set(summary.index) | set(MATCH_STAGES)), fill_value=0)
+    summary['票數比例'] = summary['票數'] / max(summary['票數'].sum(), 1)
+    summary.insert(0, '說明', [MATCH_STAGES.get(s, '比對不到') for s in summary.index])
+    return summary.rename_axis('階段').reset_index()
@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+from typing import Dict, Tuple
+
+SEQ_KEY_COLUMNS = ['RouteUID', 'SubRouteUID', 'Direction']
+
+# ===== 站序查詢索引 =====
+def build_stopseq_index(df_seq: pd.DataFrame) -> Dict[str, object]:
+    """
+    由 TDX 站序資料建立查詢索引，取代 checkseq / matchwithstopname / matchwith_anotherdirection 內反覆的
+    drop_duplicates + pd.merge。
+
+    索引內容（重複的鍵保留第一筆，同 drop_duplicates 的預設）：
+        uid  : (RouteUID, SubRouteUID, Direction, StopUID)  → StopName、StopSequence
+        name : (RouteUID, SubRouteUID, Direction, StopName) → StopUID、StopSequence
+    另一方向的站序用 1 - Direction 查 uid 索引即可，不需另外建表。
+
+    Args:
+        df_seq: TDX 站序資料（需有 RouteUID、SubRouteUID、Direction、StopUID、StopName_Zh、StopSequence）
+
+    Returns:
+        dict: 給 lookup_stopseq / resolve_stopsequence 使用
+    """
+    seq = df_seq.reindex(columns=SEQ_KEY_COLUMNS + ['StopUID', 'StopName_Zh', 'StopSequence']).rename(
+        columns={'StopName_Zh': 'StopName'})
+
+    by_uid = seq.drop_duplicates(subset=SEQ_KEY_COLUMNS + ['StopUID'])
+    by_name = seq.drop_duplicates(subset=SEQ_KEY_COLUMNS + ['StopName'])
+
+    return {
+        'uid': pd.MultiIndex.from_frame(by_uid[SEQ_KEY_COLUMNS + ['StopUID']]),
+        'uid_name': by_uid['StopName'].to_numpy(dtype=object),
+        'uid_seq': pd.to_numeric(by_uid['StopSequence'], errors='coerce').to_numpy(dtype=float),
+        'name': pd.MultiIndex.from_frame(by_name[SEQ_KEY_COLUMNS + ['StopName']]),
+        'name_uid': by_name['StopUID'].to_numpy(dtype=object),
+        'name_seq': pd.to_numeric(by_name['StopSequence'], errors='coerce').to_numpy(dtype=float),
+    }
+
+def _take(values: np.ndarray, pos: np.ndarray, fill=np.nan) -> np.ndarray:
+    """依 get_indexer 的位置取值，找不到（-1）的填 fill"""
+    out = values[np.where(pos >= 0, pos, 0)] if len(values) else np.full(len(pos), fill, dtype=values.dtype)
+    if out.dtype == object:
+        out = out.copy()
+        out[pos < 0] = fill
+    else:
+        out = np.where(pos >= 0, out, fill)
+    return out
+
+def lookup_stopseq(index: Dict[str, object], route, subroute, direction, stop, by: str = 'uid') -> Tuple[np.ndarray, np.ndarray]:
+    """
+    一次查詢多筆站點的站序。
+
+    Args:
+        index: build_stopseq_index 的結果
+        route, subroute, direction, stop: 等長的陣列（stop 為 StopUID 或 StopName）
+        by: 'uid' 以 StopUID 查詢；'name' 以 StopName 查詢
+
+    Returns:
+        (站序, 另一個欄位)：by='uid' 時為 (StopSequence, StopName)；by='name' 時為 (StopSequence, StopUID)。
+        找不到的為 NaN。
+    """
+    target = pd.MultiIndex.from_arrays([np.asarray(route, dtype=object), np.asarray(subroute, dtype=object),
+                                        np.asarray(direction), np.asarray(stop, dtype=object)])
+    pos = index[by].get_indexer(target)
+    other = index['uid_name'] if by == 'uid' else index['name_uid']
+    return _take(index[f'{by}_seq'], pos), _take(other, pos)
+
+# ===== 站序修正 =====
+def resolve_stopsequence(df: pd.DataFrame, index: Dict[str, object], verbose: bool = True) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    以查詢索引一次完成 pre05 的三階段站序修正，結果與 checkseq → matchwithstopname → matchwith_anotherdirection 相同：
+
+        1. 以 StopUID 比對站序：站序一致者保留；上車站序 < 下車站序者以 TDX 站序取代
+        2. 比對不到 StopUID 者改以站名比對（同站名上下車者剔除），上車站序 < 下車站序者修正
+        3. 上車站序 > 下車站序者改查另一方向：另一方向順序正確者換方向；
+           只有上車站在另一方向（往底站折返）者，上車用另一方向站序、下車用原方向站序
+
+    不需事先彙總，可直接套用在完整票證表上。
+
+    Args:
+        df: 票證（或分時計次）資料，需有 RouteUID、SubRouteUID、Direction、
+            Boarding/DeboardingStopUID、Boarding/DeboardingStopName、Boarding/DeboardingStopSequence
+        index: build_stopseq_index 的結果
+        verbose: 是否印出每階段的筆數
+
+    Returns:
+        (df_done, df_temp)：修正完成的資料（欄位同輸入）、仍無法修正的資料（附上比對用的 _S / _S2 欄位）
+    """
+    columns = df.columns.tolist()
+
+    # StopUID 為 -99 者不處理（同 checkseq）
+    df = df[~((df['BoardingStopUID'] == "-99") | (df['DeboardingStopUID'] == "-99"))].reset_index(drop=True)
+    n = len(df)
+
+    route, subroute = df['RouteUID'].to_numpy(dtype=object), df['SubRouteUID'].to_numpy(dtype=object)
+    direction = df['Direction'].to_numpy()
+    on_uid, off_uid = df['BoardingStopUID'].to_numpy(dtype=object).copy(), df['DeboardingStopUID'].to_numpy(dtype=object).copy()
+    on_seq = pd.to_numeric(df['BoardingStopSequence'], errors='coerce').to_numpy(dtype=float).copy()
+    off_seq = pd.to_numeric(df['DeboardingStopSequence'], errors='coerce').to_numpy(dtype=float).copy()
+    new_direction = direction.copy()
+    on_changed, off_changed = np.zeros(n, dtype=bool), np.zeros(n, dtype=bool)
+
+    # 每一列在哪個階段完成（0 = 未完成，-1 = 剔除）
+    stage = np.zeros(n, dtype=np.int8)
+
+    # ---- 第 1 階段：StopUID ----
+    on_seq_s, on_name_s = lookup_stopseq(index, route, subroute, direction, on_uid, by='uid')
+    off_seq_s, off_name_s = lookup_stopseq(index, route, subroute, direction, off_uid, by='uid')
+
+    m_keep = (on_seq == on_seq_s) & (off_seq == off_seq_s)
+    stage[m_keep] = 1
+    m_fix = (stage == 0) & (on_seq_s < off_seq_s)
+    on_seq[m_fix], off_seq[m_fix] = on_seq_s[m_fix], off_seq_s[m_fix]
+    on_changed |= m_fix
+    off_changed |= m_fix
+    stage[m_fix] = 2
+    if verbose:
+        print("第1次處理:透過StopUID比對")
+        print((stage > 0).sum(), (stage == 0).sum(), n)
+
+    # ---- 第 2 階段：站名 ----
+    m_same_name = (stage == 0) & (df['BoardingStopName'] == df['DeboardingStopName']).to_numpy()
+    stage[m_same_name] = -1
+
+    for stop_name, uid, seq, seq_s, name_s, changed in (
+        (df['BoardingStopName'].to_numpy(dtype=object), on_uid, on_seq, on_seq_s, on_name_s, on_changed),
+        (df['DeboardingStopName'].to_numpy(dtype=object), off_uid, off_seq, off_seq_s, off_name_s, off_changed)):
+        m_probe = (stage == 0) & np.isnan(seq_s)
+        rows = np.flatnonzero(m_probe)
+        found_seq, found_uid = lookup_stopseq(index, route[rows], subroute[rows], direction[rows], stop_name[rows], by='name')
+        seq_s[rows] = found_seq
+        name_s[rows] = np.nan
+        found = ~np.isnan(found_seq)
+        seq[rows[found]] = found_seq[found]
+        uid[rows[found]] = found_uid[found]
+        changed[rows[found]] = True
+
+    m_fix = (stage == 0) & (on_seq_s < off_seq_s)
+    on_seq[m_fix], off_seq[m_fix] = on_seq_s[m_fix], off_seq_s[m_fix]
+    on_changed |= m_fix
+    off_changed |= m_fix
+    stage[m_fix] = 3
+    if verbose:
+        print("第2次處理:透過StopName比對")
+        print((stage > 0).sum(), (stage == 0).sum(), (stage >= 0).sum())
+
+    # ---- 第 3 階段：另一方向 ----
+    m_reverse = (stage == 0) & (on_seq_s > off_seq_s)
+    rows = np.flatnonzero(m_reverse)
+    direction_another = 1 - direction[rows]
+    on_seq_s2, on_name_s2 = lookup_stopseq(index, route[rows], subroute[rows], direction_another, on_uid[rows], by='uid')
+    off_seq_s2, off_name_s2 = lookup_stopseq(index, route[rows], subroute[rows], direction_another, off_uid[rows], by='uid')
+
+    m_another = on_seq_s2 < off_seq_s2
+    m_turnaround = ~m_another & ~np.isnan(on_seq_s2) & np.isnan(off_seq_s2) & (on_seq_s2 < off_seq_s[rows])
+
+    r = rows[m_another]
+    new_direction[r], on_seq[r], off_seq[r] = direction_another[m_another], on_seq_s2[m_another], off_seq_s2[m_another]
+    on_changed[r], off_changed[r] = True, True
+    stage[r] = 4
+    r = rows[m_turnaround]
+    new_direction[r], on_seq[r], off_seq[r] = direction_another[m_turnaround], on_seq_s2[m_turnaround], off_seq_s[r]
+    on_changed[r], off_changed[r] = True, True
+    stage[r] = 5
+    if verbose:
+        print("第3次處理：轉方向處理")
+        print((stage > 0).sum(), (stage == 0).sum(), (stage >= 0).sum())
+
+    # ---- 組合輸出（只覆寫有修正的值，其餘保持原本的型別與內容）----
+    df = df.copy()
+    df['Direction'] = new_direction
+    df['BoardingStopUID'], df['DeboardingStopUID'] = on_uid, off_uid
+    df.loc[on_changed, 'BoardingStopSequence'] = on_seq[on_changed]
+    df.loc[off_changed, 'DeboardingStopSequence'] = off_seq[off_changed]
+
+    order = np.argsort(stage[stage > 0], kind='stable')
+    df_done = df[stage > 0].iloc[order].reindex(columns=columns).reset_index(drop=True)
+
+    df['BoardingStopName_S'], df['BoardingStopSequence_S'] = on_name_s, on_seq_s
+    df['DeboardingStopName_S'], df['DeboardingStopSequence_S'] = off_name_s, off_seq_s
+    for col in ['Direction_another', 'BoardingStopName_S2', 'BoardingStopSequence_S2', 'DeboardingStopName_S2', 'DeboardingStopSequence_S2']:
+        df[col] = np.nan
+    df.loc[rows, 'Direction_another'] = direction_another
+    df.loc[rows, 'BoardingStopName_S2'], df.loc[rows, 'BoardingStopSequence_S2'] = on_name_s2, on_seq_s2
+    df.loc[rows, 'DeboardingStopName_S2'], df.loc[rows, 'DeboardingStopSequence_S2'] = off_name_s2, off_seq_s2
+
+    # 未進入第 3 階段的排前面，同原本 concat 的順序
+    remain = np.flatnonzero(stage == 0)
+    remain = np.concatenate([remain[~m_reverse[remain]], remain[m_reverse[remain]]])
+    df_temp = df.iloc[remain].reset_index(drop=True)
+
+    return df_done, df_temp
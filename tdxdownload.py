@@ -0,0 +1,305 @@
+from __future__ import annotations
+
+import json
+import os
+import random
+import re
+import threading
+import time
+import pandas as pd
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+TDX_BASE_URL = "https://tdx.transportdata.tw"
+TDX_AUTH_PATH = "/auth/realms/TDXConnect/protocol/openid-connect/token"
+TDX_API_PATH = "/api/basic"
+
+DOWNLOAD_META_FILE = "_tdxdownload.json"   # 每個輸出資料夾一份：url → Last-Modified、檔案路徑
+PART_SUFFIX = ".part"
+CHUNK_SIZE = 1 << 20
+TOKEN_EXPIRY_MARGIN = 60                   # token 到期前幾秒就重新取得
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+_token_cache: Dict[Tuple[str, str], Tuple[str, float]] = {}
+_token_lock = threading.Lock()
+_meta_lock = threading.Lock()
+
+# ===== 網址 =====
+def tdx_endpoints(base_url: str = TDX_BASE_URL) -> Tuple[str, str]:
+    """回傳 (token 網址, API 網址)，base_url 可換成本機的 tdxmockserver"""
+    base_url = base_url.rstrip('/')
+    return base_url + TDX_AUTH_PATH, base_url + TDX_API_PATH
+
+def tdx_url(path: str, api_url: Optional[str] = None, fmt: str = 'XML') -> str:
+    """例如 tdx_url('v2/Bus/StopOfRoute/City/Taipei') → .../api/basic/v2/Bus/StopOfRoute/City/Taipei?%24format=XML"""
+    if api_url is None:
+        api_url = tdx_endpoints()[1]
+    return f"{api_url.rstrip('/')}/{path.lstrip('/')}?%24format={fmt}"
+
+# ===== 連線與 Token =====
+def create_session(pool_size: int = 8) -> requests.Session:
+    """共用連線池的 Session（重試由 download_file 自行處理，才能配合 Retry-After）"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def get_token(app_id: str, app_key: str, session: Optional[requests.Session] = None,
+              auth_url: Optional[str] = None, refresh: bool = False) -> str:
+    """
+    取得 TDX access token。同一組 (auth_url, app_id) 的 token 會快取到到期前 TOKEN_EXPIRY_MARGIN 秒，
+    不再每個請求都重新認證；refresh=True（例如收到 401）時強制重新取得。
+    """
+    if auth_url is None:
+        auth_url = tdx_endpoints()[0]
+    key = (auth_url, app_id)
+    with _token_lock:
+        cached = _token_cache.get(key)
+        if cached is not None and not refresh and cached[1] > time.time():
+            return cached[0]
+
+        http = session or requests
+        response = http.post(auth_url,
+                             headers={'content-type': 'application/x-www-form-urlencoded'},
+                             data={'grant_type': 'client_credentials', 'client_id': app_id, 'client_secret': app_key},
+                             timeout=30)
+        response.raise_for_status()
+        payload = response.json()
+        token = payload.get("access_token")
+        expires_in = float(payload.get("expires_in", 3600))
+        _token_cache[key] = (token, time.time() + max(expires_in - TOKEN_EXPIRY_MARGIN, 0))
+        return token
+
+# ===== 流量控制 =====
+def make_rate_limiter(rate_per_second: Optional[float]) -> Tuple[Callable[[], None], Callable[[float], None]]:
+    """
+    多執行緒共用的請求間隔控制。
+
+    Returns:
+        (wait, pause)：wait() 在每次送出請求前呼叫；pause(seconds) 在收到 429 時呼叫，所有執行緒一起暫停
+    """
+    lock = threading.Lock()
+    interval = 0 if not rate_per_second else 1.0 / rate_per_second
+    state = {'next': 0.0}
+
+    def wait():
+        with lock:
+            now = time.monotonic()
+            start = max(now, state['next'])
+            state['next'] = start + interval
+        if start > now:
+            time.sleep(start - now)
+
+    def pause(seconds: float):
+        with lock:
+            state['next'] = max(state['next'], time.monotonic() + seconds)
+
+    return wait, pause
+
+def _retry_after(response: requests.Response, attempt: int, backoff: float, max_backoff: float) -> float:
+    """依 Retry-After（秒數或 HTTP 日期）決定等待時間，沒有就用指數退避加上隨機擾動"""
+    value = response.headers.get('Retry-After')
+    if value:
+        try:
+            return min(float(value), max_backoff)
+        except ValueError:
+            try:
+                return min(max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0), max_backoff)
+            except (TypeError, ValueError):
+                pass
+    return min(backoff * (2 ** attempt), max_backoff) * (1 + random.random() * 0.25)
+
+# ===== 下載紀錄（If-Modified-Since 用）=====
+def _meta_path(output_folder: str) -> str:
+    return os.path.join(output_folder, DOWNLOAD_META_FILE)
+
+def read_download_meta(output_folder: str) -> Dict[str, Dict[str, Any]]:
+    """讀取下載紀錄（多執行緒下載時由呼叫端持有 _meta_lock）"""
+    path = _meta_path(output_folder)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def _write_download_meta(output_folder: str, url: str, record: Dict[str, Any]) -> None:
+    with _meta_lock:
+        meta = read_download_meta(output_folder)
+        meta[url] = record
+        # 先寫入暫存檔再更名，讀取端不會讀到寫到一半的檔案
+        tmp_path = _meta_path(output_folder) + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, _meta_path(output_folder))
+
+def _update_time_header(path: str, head_bytes: int = 1 << 16) -> Optional[str]:
+    """伺服器沒有回傳 Last-Modified 時，改用 XML 內第一個 UpdateTime 作為 If-Modified-Since"""
+    with open(path, 'rb') as f:
+        head = f.read(head_bytes).decode('utf-8', errors='ignore')
+    match = re.search(r'<(?:\w+:)?UpdateTime>([^<]+)</', head)
+    if match is None:
+        return None
+    try:
+        dt = datetime.fromisoformat(match.group(1).strip())
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return format_datetime(dt.astimezone(timezone.utc), usegmt=True)
+
+# ===== 下載 =====
+def download_file(url: str, output_path: str, app_id: str, app_key: str,
+                  session: Optional[requests.Session] = None, auth_url: Optional[str] = None,
+                  if_modified_since: Optional[str] = None,
+                  limiter: Optional[Tuple[Callable, Callable]] = None,
+                  max_retries: int = 5, backoff: float = 2.0, max_backoff: float = 120.0,
+                  chunk_size: int = CHUNK_SIZE, timeout: Tuple[float, float] = (10, 300)) -> Dict[str, Any]:
+    """
+    下載單一 TDX 資料並以串流寫入檔案（gzip 邊收邊解壓寫入，不會整份放在記憶體）。
+
+    1. 先寫入 output_path + '.part'，完成後才更名，中斷時不會留下不完整的正式檔案
+    2. 連線中斷時，下次以 Range（identity 編碼）從 .part 的大小接續下載；伺服器不支援則重新下載
+    3. 有 if_modified_since 時，伺服器回傳 304 代表資料未更新，不下載
+    4. 429 / 5xx 依 Retry-After 或指數退避重試，401 重新取得 token
+
+    Returns:
+        dict: url、path、status（'downloaded' / 'not_modified' / 'failed'）、last_modified、bytes、attempts、error
+    """
+    session = session or create_session(1)
+    wait, pause = limiter or make_rate_limiter(None)
+    part_path = output_path + PART_SUFFIX
+    part_meta_path = part_path + '.json'
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+
+    result = {'url': url, 'path': output_path, 'status': 'failed', 'last_modified': None,
+              'bytes': 0, 'attempts': 0, 'error': None}
+    refresh = False
+
+    for attempt in range(max_retries + 1):
+        result['attempts'] = attempt + 1
+        headers = {'Accept-Encoding': 'gzip'}
+        if if_modified_since:
+            headers['If-Modified-Since'] = if_modified_since
+
+        # 接續下載：只接同一版本（If-Range）的 .part
+        resume_from = 0
+        if os.path.exists(part_path) and os.path.exists(part_meta_path):
+            with open(part_meta_path, 'r', encoding='utf-8') as f:
+                part_meta = json.load(f)
+            validator = part_meta.get('etag') or part_meta.get('last_modified')
+            if part_meta.get('url') == url and validator:
+                resume_from = os.path.getsize(part_path)
+                headers.update({'Range': f'bytes={resume_from}-', 'If-Range': validator, 'Accept-Encoding': 'identity'})
+
+        wait()
+        try:
+            # token 也在重試範圍內：認證伺服器的 5xx 或連線錯誤同樣退避重試，不會中斷其他下載
+            headers['authorization'] = f'Bearer {get_token(app_id, app_key, session, auth_url, refresh=refresh)}'
+            refresh = False
+            with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                if response.status_code == 304:
+                    result.update(status='not_modified', last_modified=if_modified_since, error=None)
+                    return result
+                if response.status_code == 401 and attempt < max_retries:
+                    refresh = True
+                    continue
+                if response.status_code in RETRY_STATUS and attempt < max_retries:
+                    delay = _retry_after(response, attempt, backoff, max_backoff)
+                    if response.status_code == 429:
+                        pause(delay)
+                    else:
+                        time.sleep(delay)
+                    continue
+                if response.status_code == 416:
+                    # .part 已經不對應目前的資料，整份重新下載
+                    os.remove(part_path)
+                    continue
+                response.raise_for_status()
+
+                append = response.status_code == 206
+                last_modified = response.headers.get('Last-Modified')
+                with open(part_meta_path, 'w', encoding='utf-8') as f:
+                    json.dump({'url': url, 'last_modified': last_modified, 'etag': response.headers.get('ETag')}, f)
+
+                with open(part_path, 'ab' if append else 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+
+            os.replace(part_path, output_path)
+            os.remove(part_meta_path)
+            result.update(status='downloaded', error=None, last_modified=last_modified or _update_time_header(output_path),
+                          bytes=os.path.getsize(output_path))
+            return result
+
+        except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                requests.exceptions.Timeout) as e:
+            result['error'] = str(e)
+            if attempt < max_retries:
+                time.sleep(min(backoff * (2 ** attempt), max_backoff))
+        except requests.exceptions.HTTPError as e:
+            result['error'] = str(e)
+            status = e.response.status_code if e.response is not None else None
+            if status in RETRY_STATUS and attempt < max_retries:
+                time.sleep(_retry_after(e.response, attempt, backoff, max_backoff))
+                continue
+            return result
+        except (requests.exceptions.RequestException, ValueError) as e:
+            # 其他錯誤（例如 token 回應不是 JSON）：回傳失敗結果，不拋出例外
+            result['error'] = str(e)
+            return result
+
+    return result
+
+def download_many(jobs: List[Dict[str, str]], app_id: str, app_key: str,
+                  max_workers: int = 4, rate_per_second: Optional[float] = 5,
+                  skip_unchanged: bool = True, auth_url: Optional[str] = None, **kwargs) -> pd.DataFrame:
+    """
+    同時下載多個 TDX 資料（共用 token、連線池與流量控制），取代逐一下載並固定 sleep 的寫法。
+
+    Args:
+        jobs: [{'url':..., 'output_folder':..., 'output_file_name':...}, ...]
+        max_workers: 同時下載的數量
+        rate_per_second: 每秒最多送出幾個請求（所有執行緒合計），None 代表不限制
+        skip_unchanged: True 時以上次下載的 Last-Modified（或 UpdateTime）送出 If-Modified-Since，
+                        未更新的資料不重新下載，沿用上次的檔案
+        **kwargs: 傳給 download_file（max_retries、backoff、chunk_size...）
+
+    Returns:
+        pd.DataFrame: 每個 job 的下載結果（download_file 的欄位 + output_folder）
+    """
+    session = create_session(max_workers)
+    limiter = make_rate_limiter(rate_per_second)
+
+    def run(job):
+        folder = job['output_folder']
+        os.makedirs(folder, exist_ok=True)
+        output_path = os.path.join(folder, job['output_file_name'])
+        previous = None
+        if skip_unchanged:
+            with _meta_lock:
+                previous = read_download_meta(folder).get(job['url'])
+        if_modified_since = None
+        if previous and previous.get('last_modified') and os.path.exists(previous.get('path', '')):
+            if_modified_since = previous['last_modified']
+
+        result = download_file(job['url'], output_path, app_id, app_key, session=session, auth_url=auth_url,
+                               if_modified_since=if_modified_since, limiter=limiter, **kwargs)
+        if result['status'] == 'not_modified':
+            result['path'] = previous['path']
+            print(f"資料未更新，沿用 {previous['path']}")
+        elif result['status'] == 'downloaded':
+            _write_download_meta(folder, job['url'], {'path': output_path, 'last_modified': result['last_modified'],
+                                                      'downloaded_at': datetime.now().isoformat(timespec='seconds')})
+            print(f"資料已下載並存儲到 {output_path} 中。")
+        else:
+            print(f"下載失敗 {job['url']}：{result['error']}")
+        result['output_folder'] = folder
+        return result
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(run, jobs))
+    return pd.DataFrame(results)
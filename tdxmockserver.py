@@ -0,0 +1,183 @@
+"""
+本機的 TDX 模擬伺服器，讓 tdxdownload 可以離線測試（不需要帳密、不消耗 TDX 的額度）。
+
+    server, base_url = start_mock_server(rate_per_second=5)
+    auth_url, api_url = tdx_endpoints(base_url)
+    download_many(jobs, 'id', 'key', auth_url=auth_url)   # jobs 的 url 以 tdx_url(..., api_url=api_url) 產生
+    server.shutdown()
+
+支援：token（含 expires_in）、gzip、If-Modified-Since → 304、Range → 206、超過每秒請求數 → 429 + Retry-After，
+以及 drop_first_bytes（每個路徑第一次下載時在指定位元組後中斷連線，用來測試接續下載）。
+"""
+
+from __future__ import annotations
+
+import gzip
+import json
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+from tdxdownload import TDX_AUTH_PATH, TDX_API_PATH
+
+# ===== 假資料 =====
+def make_xml(path: str, records: int = 2000, update_time: str = '2025-01-01T00:00:00+08:00') -> bytes:
+    """依路徑產生固定內容的 TDX 格式 XML（同一路徑每次內容相同）"""
+    name = path.rstrip('/').split('/')[-1]
+    rows = ''.join(
+        f'<BusStopOfRoute><RouteUID>{name}{i}</RouteUID><RouteName><Zh_tw>{i}</Zh_tw></RouteName>'
+        f'<Direction>{i % 2}</Direction><UpdateTime>{update_time}</UpdateTime></BusStopOfRoute>'
+        for i in range(records))
+    return ('<?xml version="1.0" encoding="utf-8"?>'
+            '<ArrayOfBusStopOfRoute xmlns="https://ptx.transportdata.tw/standard/schema/">'
+            f'{rows}</ArrayOfBusStopOfRoute>').encode('utf-8')
+
+# ===== 伺服器 =====
+def _handler(state: Dict[str, Any]):
+    class TDXMockHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _count(self, key: str):
+            with state['lock']:
+                state['stats'][key] = state['stats'].get(key, 0) + 1
+
+        def _send(self, status: int, body: bytes = b'', headers: Optional[Dict[str, str]] = None):
+            self.send_response(status)
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if body:
+                self.wfile.write(body)
+            self._count(f'status_{status}')
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            self.rfile.read(length)
+            if urlparse(self.path).path != TDX_AUTH_PATH:
+                return self._send(404)
+            with state['lock']:
+                state['token_seq'] += 1
+                token = f"mock-token-{state['token_seq']}"
+                state['tokens'].add(token)
+            self._count('token_requests')
+            body = json.dumps({'access_token': token, 'expires_in': state['token_ttl'], 'token_type': 'Bearer'}).encode()
+            self._send(200, body, {'Content-Type': 'application/json'})
+
+        def do_GET(self):
+            self._count('data_requests')
+            path = urlparse(self.path).path
+            if not path.startswith(TDX_API_PATH):
+                return self._send(404)
+
+            token = self.headers.get('Authorization', '').replace('Bearer ', '')
+            if token not in state['tokens']:
+                return self._send(401)
+
+            # 每秒請求數限制
+            if state['rate_per_second']:
+                now = time.monotonic()
+                with state['lock']:
+                    window = state['window']
+                    while window and now - window[0] > 1:
+                        window.popleft()
+                    limited = len(window) >= state['rate_per_second']
+                    if not limited:
+                        window.append(now)
+                if limited:
+                    return self._send(429, b'', {'Retry-After': '1'})
+
+            last_modified = state['last_modified']
+            ims = self.headers.get('If-Modified-Since')
+            if ims:
+                try:
+                    if parsedate_to_datetime(ims) >= last_modified:
+                        return self._send(304)
+                except (TypeError, ValueError):
+                    pass
+
+            body = state['bodies'].get(path)
+            if body is None:
+                body = state['bodies'][path] = make_xml(path, state['records'])
+            headers = {'Content-Type': 'application/xml; charset=utf-8',
+                       'Last-Modified': format_datetime(last_modified, usegmt=True),
+                       'Accept-Ranges': 'bytes'}
+
+            status = 200
+            rng = self.headers.get('Range')
+            if_range = self.headers.get('If-Range')
+            if rng and (if_range is None or if_range == headers['Last-Modified']):
+                start = int(rng.split('=')[1].split('-')[0])
+                if start >= len(body):
+                    return self._send(416, b'', {'Content-Range': f'bytes */{len(body)}'})
+                headers['Content-Range'] = f'bytes {start}-{len(body) - 1}/{len(body)}'
+                body, status = body[start:], 206
+            elif 'gzip' in self.headers.get('Accept-Encoding', ''):
+                body = gzip.compress(body)
+                headers['Content-Encoding'] = 'gzip'
+
+            # 第一次下載該路徑時在 drop_first_bytes 後中斷
+            with state['lock']:
+                drop = state['drop_first_bytes'] and path not in state['dropped'] and status == 200
+                if drop:
+                    state['dropped'].add(path)
+            if drop:
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body[:state['drop_first_bytes']])
+                self.wfile.flush()
+                self.close_connection = True
+                self._count('dropped')
+                return
+            self._send(status, body, headers)
+
+    return TDXMockHandler
+
+def start_mock_server(host: str = '127.0.0.1', port: int = 0, rate_per_second: Optional[int] = None,
+                      last_modified: Optional[datetime] = None, token_ttl: int = 86400,
+                      records: int = 2000, drop_first_bytes: int = 0) -> Tuple[ThreadingHTTPServer, str]:
+    """
+    在背景執行緒啟動模擬伺服器。
+
+    Args:
+        port: 0 代表自動選擇可用的 port
+        rate_per_second: 每秒最多接受幾個資料請求，超過回傳 429
+        last_modified: 資料的 Last-Modified（預設為 2025-01-01），可之後改 server.state['last_modified'] 模擬資料更新
+        token_ttl: token 的 expires_in（秒）
+        records: 每份 XML 的筆數
+        drop_first_bytes: > 0 時每個路徑第一次下載只送出這麼多位元組就中斷
+
+    Returns:
+        (server, base_url)：server.state['stats'] 記錄 token 與資料請求次數、各狀態碼次數
+    """
+    state = {
+        'lock': threading.Lock(), 'stats': {}, 'tokens': set(), 'token_seq': 0, 'token_ttl': token_ttl,
+        'rate_per_second': rate_per_second, 'window': deque(),
+        'last_modified': last_modified or datetime(2025, 1, 1, tzinfo=timezone.utc),
+        'records': records, 'bodies': {}, 'drop_first_bytes': drop_first_bytes, 'dropped': set(),
+    }
+    server = ThreadingHTTPServer((host, port), _handler(state))
+    server.daemon_threads = True
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+if __name__ == "__main__":
+    server, base_url = start_mock_server(port=8765, rate_per_second=5)
+    print(f"TDX 模擬伺服器：{base_url}（Ctrl+C 結束）")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+pytest.importorskip('pyarrow')
+
+from basicprocess import stage_writer, read_stage
+
+
+def _chunk(route, deboard):
+    return pd.DataFrame({'InfoDate': ['2024-10-01'] * len(route), 'Authority': ['TPE'] * len(route),
+                         'RouteUID': route, 'DeboardingStopUID': deboard, 'Count': range(len(route))})
+
+
+def test_parquet_stage_nan_then_string(tmp_path):
+    """第一批 DeboardingStopUID 整欄空白（float NaN）、之後才出現文字時不應該失敗"""
+    path = str(tmp_path / 'tickets.parquet')
+    with stage_writer(path, buffer_rows=1) as write:
+        write(_chunk([101, 102], [np.nan, np.nan]))
+        write(_chunk(['TPE1', 'TPE2'], ['TPE1', np.nan]))
+    with stage_writer(path, buffer_rows=1, append=True) as write:
+        write(_chunk(['TPE3'], [5.0]))
+
+    df = read_stage(path).sort_values('RouteUID').reset_index(drop=True)
+    assert df['RouteUID'].tolist() == ['101', '102', 'TPE1', 'TPE2', 'TPE3']
+    assert df['DeboardingStopUID'].tolist() == [None, None, 'TPE1', None, '5']